@@ -0,0 +1,32 @@
+# SubFlo/benchmarking.py
+from contextlib import contextmanager
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+# Private to the benchmarking process: the shared cache of the site is never read, written or cleared
+BENCHMARK_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "subflo-benchmark",
+    },
+}
+
+
+@contextmanager
+def throwaway_environment():
+    """
+    Runs the block the way the test runner runs a test: on a test copy of every configured database (the
+    catalog, every shard and the replica mirrors, so that routed writes never reach a real database), with
+    a private in-memory cache. The copies are destroyed on exit.
+    """
+    setup_test_environment()
+    try:
+        with override_settings(CACHES=BENCHMARK_CACHES):
+            old_config = setup_databases(verbosity=0, interactive=False, serialized_aliases=set())
+            try:
+                yield
+            finally:
+                teardown_databases(old_config, verbosity=0)
+    finally:
+        teardown_test_environment()
@@ -0,0 +1,44 @@
+# SubFlo/compression.py
+import re
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # optional: without it every client gets gzip
+    brotli = None
+
+_ACCEPTS_BROTLI_RE = re.compile(r"\bbr\b")
+
+# Downloads that are compressed files already (e.g. gzipped exports)
+ALREADY_COMPRESSED_TYPES = ("application/gzip", "application/zip")
+
+# Text payloads compress well at this level for a fraction of the CPU of the maximum (11)
+BROTLI_QUALITY = 5
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    `GZipMiddleware` that answers with brotli instead when the client accepts it and the `brotli`
+    package is installed. Streaming responses are always gzipped, chunk by chunk; compressed files are left alone.
+    """
+
+    def process_response(self, request, response):
+        if response.get("Content-Type", "").startswith(ALREADY_COMPRESSED_TYPES):
+            return response
+        if (brotli is None or response.streaming or len(response.content) < 200
+                or response.has_header("Content-Encoding")
+                or not _ACCEPTS_BROTLI_RE.search(request.META.get("HTTP_ACCEPT_ENCODING", ""))):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        compressed_content = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers["Content-Length"] = str(len(response.content))
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = "br"
+        return response
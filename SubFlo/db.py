@@ -0,0 +1,117 @@
+# SubFlo/db.py
+import contextvars
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Run by every new SQLite connection (`OPTIONS["init_command"]`): write-ahead logging lets readers run while a
+# writer holds the lock, NORMAL sync is durable across application crashes in WAL mode, and the page cache
+# and memory map keep hot pages out of read() calls. Waits up to 5 s on a lock instead of failing at once.
+SQLITE_INIT_COMMAND = (
+    "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA mmap_size=268435456; "
+    "PRAGMA cache_size=-65536; PRAGMA busy_timeout=5000"
+)
+# Same tuning for the connections that only read; `query_only` turns any write through them into an error
+SQLITE_READ_INIT_COMMAND = (
+    "PRAGMA mmap_size=268435456; PRAGMA cache_size=-65536; PRAGMA busy_timeout=5000; PRAGMA query_only=ON"
+)
+
+_read_alias = contextvars.ContextVar("read_alias", default=None)
+
+
+@contextmanager
+def reads_from(alias):
+    """
+    Routes the reads made in this block (thread or task) to the database `alias`.
+    """
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends every write, and by default every read, to the primary ("default") database.
+    Reads go to another alias only inside `reads_from(alias)` (see `ReplicaReadsMiddleware`), and never while
+    the primary has a transaction open: they must see its uncommitted rows. Ingestion and extraction
+    (management commands) therefore always work on the primary. Migrations only run on the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or alias not in connections.databases or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadsMiddleware:
+    """
+    Serves the reads of GET and HEAD requests from `settings.DATABASE_READ_ALIAS`, including those made while
+    a streaming response is iterated. Other methods keep reading from the primary.
+    Sync and async capable: the alias is a context variable, which the sync code an async view runs through
+    `sync_to_async` inherits.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.alias = getattr(settings, "DATABASE_READ_ALIAS", None)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.alias or request.method not in ("GET", "HEAD"):
+            return self.get_response(request)
+        with reads_from(self.alias):
+            response = self.get_response(request)
+        return self.wrap_stream(response)
+
+    async def __acall__(self, request):
+        if not self.alias or request.method not in ("GET", "HEAD"):
+            return await self.get_response(request)
+        with reads_from(self.alias):
+            response = await self.get_response(request)
+        return self.wrap_stream(response)
+
+    def wrap_stream(self, response):
+        if response.streaming and response.is_async:
+            response.streaming_content = self._astream(response.streaming_content, self.alias)
+        elif response.streaming:
+            response.streaming_content = self._stream(response.streaming_content, self.alias)
+        return response
+
+    @staticmethod
+    def _stream(content, alias):
+        iterator = iter(content)
+        while True:
+            with reads_from(alias):
+                chunk = next(iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    @staticmethod
+    async def _astream(content, alias):
+        iterator = aiter(content)
+        while True:
+            with reads_from(alias):
+                chunk = await anext(iterator, None)
+            if chunk is None:
+                return
+            yield chunk
@@ -0,0 +1,255 @@
+# SubFlo/metrics.py
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+# Upper bounds of the histogram buckets (the `+Inf` bucket is implicit)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+# Per-process snapshots are written at most this often (seconds), so recording stays off the disk
+FLUSH_INTERVAL = 1.0
+
+# (metric name, help text, buckets) of the three per-view histograms
+HISTOGRAMS = (
+    ("subflo_request_duration_seconds", "Request latency by URL name.", LATENCY_BUCKETS),
+    ("subflo_request_db_queries", "SQL queries issued per request by URL name.", QUERY_BUCKETS),
+    ("subflo_request_db_duration_seconds", "Time spent in SQL per request by URL name.", LATENCY_BUCKETS),
+)
+
+
+class MetricsRegistry:
+    """
+    In-process store of the per-view histograms and of plain counters (declared with `describe_counter`).
+    Every worker process writes its own snapshot to `settings.METRICS_DIR` (atomically, at most once per
+    `FLUSH_INTERVAL`), and the metrics endpoint adds up the snapshots of the processes still running, like
+    the multiprocess mode of the Prometheus client. Without a directory only the current process is reported.
+    """
+
+    def __init__(self):
+        self.series = {}
+        self.counters = {}
+        self.counter_help = {}
+        self.lock = threading.Lock()
+        self.flushed = 0.0
+
+    def describe_counter(self, name, help_text):
+        self.counter_help[name] = help_text
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, view, method, duration, queries, db_duration):
+        key = f"{view}\0{method}"
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(buckets) + 1) + [0] for _, _, buckets in HISTOGRAMS]
+            for histogram, (_, _, buckets), value in zip(series, HISTOGRAMS, (duration, queries, db_duration)):
+                # Per-bucket counts (made cumulative on export), then the sum in the last slot
+                index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+                histogram[index] += 1
+                histogram[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "histograms": {key: [list(histogram) for histogram in series] for key, series in self.series.items()},
+                "counters": dict(self.counters),
+            }
+
+    def reset(self):
+        with self.lock:
+            self.series = {}
+            self.counters = {}
+
+    @staticmethod
+    def directory():
+        directory = getattr(settings, "METRICS_DIR", None)
+        return Path(directory) if directory else None
+
+    def maybe_flush(self):
+        directory = self.directory()
+        now = time.monotonic()
+        if directory is None or now - self.flushed < FLUSH_INTERVAL:
+            return
+        self.flushed = now
+        self.flush(directory)
+
+    def flush(self, directory):
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"metrics-{os.getpid()}.json"
+        temporary = path.with_suffix(f".tmp{threading.get_ident()}")
+        temporary.write_text(json.dumps(self.snapshot()))
+        os.replace(temporary, path)
+
+    def collect(self):
+        """
+        Returns the merged snapshot of every live process (this one included, always up to date).
+        Snapshots of processes that are gone are deleted.
+        """
+        merged = {"histograms": {}, "counters": {}}
+        snapshots = [self.snapshot()]
+        directory = self.directory()
+        if directory is not None and directory.is_dir():
+            for path in directory.glob("metrics-*.json"):
+                pid = int(path.stem.split("-", 1)[1])
+                if pid == os.getpid():
+                    continue
+                if not _is_running(pid):
+                    path.unlink(missing_ok=True)
+                    continue
+                try:
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    continue
+        for snapshot in snapshots:
+            for key, series in snapshot.get("histograms", {}).items():
+                total = merged["histograms"].setdefault(key, [[0] * len(histogram) for histogram in series])
+                for total_histogram, histogram in zip(total, series):
+                    for i, value in enumerate(histogram):
+                        total_histogram[i] += value
+            for name, value in snapshot.get("counters", {}).items():
+                merged["counters"][name] = merged["counters"].get(name, 0) + value
+        return merged
+
+    def render(self):
+        """
+        Renders the merged metrics in the Prometheus text exposition format.
+        """
+        collected = self.collect()
+        merged = collected["histograms"]
+        lines = []
+        for index, (name, help_text, buckets) in enumerate(HISTOGRAMS):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for key in sorted(merged):
+                view, method = key.split("\0")
+                labels = f'view="{_escape(view)}",method="{_escape(method)}"'
+                histogram = merged[key][index]
+                cumulative = 0
+                for bound, count in zip((*buckets, "+Inf"), histogram[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram[-1]:.6f}".rstrip("0").rstrip("."))
+                lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        for name, help_text in sorted(self.counter_help.items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter",
+                      f"{name} {collected['counters'].get(name, 0)}"]
+        return "\n".join(lines) + "\n"
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+
+
+class QueryTimer:
+    """
+    `execute_wrapper` that counts the queries of one request and adds up their duration.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.queries += 1
+
+    @contextmanager
+    def installed(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield
+
+
+class MetricsMiddleware:
+    """
+    Records latency, query count and SQL time of every request routed to a named URL.
+    Streamed responses are measured until their last chunk has been sent, so the queries run while
+    iterating the body (the external APIs) are included.
+    Sync and async capable: under ASGI it awaits the async views instead of moving every request to a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with timer.installed():
+            response = self.get_response(request)
+        return self.measure(request, response, started, timer)
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with timer.installed():
+            response = await self.get_response(request)
+        return self.measure(request, response, started, timer)
+
+    def measure(self, request, response, started, timer):
+        match = request.resolver_match
+        if match is None or not match.url_name or match.url_name in getattr(settings, "METRICS_EXCLUDED_URL_NAMES", ()):
+            return response
+        finish = lambda: self.record(match.view_name, request.method, started, timer)
+
+        if not response.streaming:
+            finish()
+        elif response.is_async:
+            response.streaming_content = self._astream(response.streaming_content, timer, finish)
+        else:
+            response.streaming_content = self._stream(response.streaming_content, timer, finish)
+        return response
+
+    @staticmethod
+    def _stream(content, timer, finish):
+        try:
+            with timer.installed():
+                yield from content
+        finally:
+            finish()
+
+    @staticmethod
+    async def _astream(content, timer, finish):
+        try:
+            with timer.installed():
+                async for chunk in content:
+                    yield chunk
+        finally:
+            finish()
+
+    @staticmethod
+    def record(view, method, started, timer):
+        registry.observe(view, method, time.perf_counter() - started, timer.queries, timer.duration)
+        registry.maybe_flush()
@@ -34,6 +34,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'SubFlo.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -102,4 +103,88 @@ STATIC_URL = '/static/'
 
 STATICFILES_DIRS = [BASE_DIR / "SubFlo/ui-ux/static"]
 STATIC_ROOT = BASE_DIR / "SubFlo/ui-ux/staticfiles"
-STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'
\ No newline at end of file
+STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'
+
+# Full-text search
+# `subscriptions.search.IContainsSearchBackend` works without an index on any database.
+
+SEARCH_BACKEND = 'subscriptions.search.SQLiteFTS5Backend'
+
+
+# LLM extraction
+# Dotted path of the client used by `extract_subscriptions` (the offline stub until a real backend is wired in).
+
+LLM_CLIENT = 'subscriptions.extraction.StubLLMClient'
+
+
+# Mailbox sync (subscriptions.mailsync)
+# IMAP server read by `sync_mailboxes`, and the dotted path of the callable returning the IMAP `(username, password)`
+# of a profile (None skips the user). The default logs in as the user's email address with MAIL_SYNC_IMAP_PASSWORD.
+
+MAIL_SYNC_IMAP_HOST = env('MAIL_SYNC_IMAP_HOST', default='localhost')
+MAIL_SYNC_IMAP_PORT = env.int('MAIL_SYNC_IMAP_PORT', default=993)
+MAIL_SYNC_IMAP_SSL = env.bool('MAIL_SYNC_IMAP_SSL', default=True)
+MAIL_SYNC_IMAP_PASSWORD = env('MAIL_SYNC_IMAP_PASSWORD', default='')
+MAIL_SYNC_CREDENTIALS = 'subscriptions.mailsync.shared_password_credentials'
+
+
+# Link checks (subscriptions.linkcheck)
+# Seconds a checked unsubscribe link is trusted before `check_unsubscribe_links` requests it again.
+
+LINK_CHECK_TTL = 60 * 60 * 24
+
+
+# Spending
+# Prices are normalized to this currency with the `ExchangeRate` table (editable in the admin).
+
+SPENDING_BASE_CURRENCY = 'USD'
+
+
+# Deduplication (subscriptions.dedup)
+# Two subscriptions of a user are merged when both their platform and service names are at least this
+# similar (0-1, after canonicalization through the CanonicalName table) and their dates agree.
+
+SUBSCRIPTION_DEDUP_SIMILARITY = 0.85
+
+
+# Renewals
+# "Expiring soon" window of the dashboard, and the windows (days ahead) of `notify_renewals`.
+
+EXPIRING_SOON_DAYS = 7
+RENEWAL_NOTIFICATION_WINDOWS = [7, 1]
+
+
+# User-id verification (accounts.verification)
+# Positive answers are cached per process for CACHE_TTL seconds; profiles created by other processes are
+# picked up as soon as they are asked for.
+
+USER_VERIFICATION_BLOOM_ERROR_RATE = 0.001
+USER_VERIFICATION_CACHE_SIZE = 10000
+USER_VERIFICATION_CACHE_TTL = 60
+
+
+# Metrics
+# With several worker processes, set METRICS_DIR to a directory they share: every process writes its
+# snapshot there and `/metrics` adds up those of the live processes. Only staff and scrapers sending
+# `Authorization: Bearer <METRICS_TOKEN>` may read it (no token configured: staff only).
+
+METRICS_DIR = None
+METRICS_EXCLUDED_URL_NAMES = ['metrics-url']
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+
+
+# Dashboard page cache (dashboard.caching)
+# Rendered pages are kept at most this long (seconds); any write to the data they show replaces them sooner.
+
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+# Sharding (SubFlo.sharding)
+# The subscriptions, emails and rollups of every user live in one of DATABASE_SHARDS (database aliases);
+# users, profiles and shared tables stay in the "default" catalog. While the list is empty, everything is
+# in "default". To add a shard: configure it, `migrate --database <alias>`, list it here and run
+# `rebalance_shards`. Processes notice that a user moved within SHARD_DIRECTORY_TTL seconds.
+
+DATABASE_SHARDS = []
+DATABASE_ROUTERS = ['SubFlo.sharding.ShardRouter']
+SHARD_DIRECTORY_TTL = 5
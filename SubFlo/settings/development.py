@@ -10,5 +10,14 @@ DATABASES = {
         'ENGINE': 'django.db.backends.sqlite3',
         # put the DB in project-root/data/db.sqlite3
         'NAME': BASE_DIR / 'data' / 'db.sqlite3',
-    }
-}
\ No newline at end of file
+    },
+    # Shards (see DATABASE_SHARDS in base.py), unused until they are listed there
+    'shard_1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'data' / 'shard_1.sqlite3',
+    },
+    'shard_2': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'data' / 'shard_2.sqlite3',
+    },
+}
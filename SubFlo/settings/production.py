@@ -1,4 +1,5 @@
 from .base import *
+from SubFlo.db import SQLITE_INIT_COMMAND, SQLITE_READ_INIT_COMMAND
 
 DEBUG = False
 
@@ -6,10 +7,88 @@ DEBUG = False
 ALLOWED_HOSTS = ['localhost', '127.0.0.1']
 
 # Database for the development server
+# "default" is the primary: every write (ingestion, extraction, admin) and every read outside of GET/HEAD
+# requests. "replica" is a query-only connection to the same file that serves the dashboard and API reads
+# (see SubFlo.db); point it at a real replica when there is one. Connections are kept for 10 minutes.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         # put the DB in project-root/data/db.sqlite3
         'NAME': BASE_DIR / 'data' / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': SQLITE_INIT_COMMAND,
+            # Writers take the lock when their transaction starts, instead of failing to upgrade it halfway
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'data' / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': SQLITE_READ_INIT_COMMAND,
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+}
+# Shards (see base.py): DATABASE_SHARD_COUNT more files next to the catalog, tuned like it
+DATABASES.update({
+    f'shard_{n}': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'data' / f'shard_{n}.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': SQLITE_INIT_COMMAND,
+            'transaction_mode': 'IMMEDIATE',
+        },
+    }
+    for n in range(1, env.int('DATABASE_SHARD_COUNT', default=0) + 1)
+})
+DATABASE_SHARDS = [alias for alias in DATABASES if alias.startswith('shard_')]
+DATABASE_ROUTERS = [*DATABASE_ROUTERS, 'SubFlo.db.PrimaryReplicaRouter']
+DATABASE_READ_ALIAS = 'replica'
+
+
+# Per-process metrics snapshots, merged by `/metrics` (see base.py)
+METRICS_DIR = BASE_DIR / 'data' / 'metrics'
+
+
+# Caches
+# Ingestion runs in management commands, not in the web workers: the dashboard caches and their data
+# versions (dashboard.caching) must live where every process sees them.
+# Every user has a few cached pages (one per URL) and a summary; the default of 300 entries would be culled
+# all the time. Past the limit a tenth of the entries is dropped.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'data' / 'cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': env.int('CACHE_MAX_ENTRIES', default=100_000),
+            'CULL_FREQUENCY': 10,
+        },
     }
 }
+
+
+# Templates are compiled once per process
+TEMPLATES[0]['APP_DIRS'] = False
+TEMPLATES[0]['OPTIONS']['loaders'] = [
+    ('django.template.loaders.cached.Loader', [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ]),
+]
+
+
+# Responses are compressed (brotli when the `brotli` package is installed, gzip otherwise).
+# It runs right after the metrics middleware, so the measured time includes the compression.
+# GET and HEAD requests read from DATABASE_READ_ALIAS.
+MIDDLEWARE = [
+    MIDDLEWARE[0], 'SubFlo.compression.CompressionMiddleware', 'SubFlo.db.ReplicaReadsMiddleware', *MIDDLEWARE[1:],
+]
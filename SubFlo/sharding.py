@@ -0,0 +1,295 @@
+# SubFlo/sharding.py
+import contextvars
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, models, router, transaction
+
+# User-owned models: the rows of a user live in the shard of the user. Everything else (users, profiles,
+# exchange rates, canonical names, sessions, ...) lives in the catalog, the "default" database.
+SHARDED_MODELS = frozenset({
+    "subscriptions.subscription", "subscriptions.emailmessage", "subscriptions.emailbody",
+    "subscriptions.spendingrollup", "subscriptions.renewalnotification",
+})
+SHARDED_APPS = frozenset(label.split(".")[0] for label in SHARDED_MODELS)
+
+DEFAULT_DIRECTORY_TTL = 5  # seconds a process trusts its copy of a user's shard
+DIRECTORY_MAX_SIZE = 100_000
+
+_current_shard = contextvars.ContextVar("current_shard", default=None)
+
+
+def shard_aliases():
+    """
+    The databases new users are placed on (`settings.DATABASE_SHARDS`). Sharding is off while it is empty.
+    """
+    return list(getattr(settings, "DATABASE_SHARDS", []))
+
+
+def sharding_enabled():
+    return bool(shard_aliases())
+
+
+def data_aliases():
+    """
+    Every database that may hold user data: the shards, and the catalog, where users created before sharding
+    was turned on stay until they are rebalanced.
+    """
+    return list(dict.fromkeys([DEFAULT_DB_ALIAS, *shard_aliases()]))
+
+
+def is_sharded(model):
+    return model._meta.label_lower in SHARDED_MODELS
+
+
+def placement(profile_id):
+    """
+    Shard a new user goes to, from its `UserProfile.id` (rendezvous hashing: adding a shard only claims the
+    users that hash highest on it, about 1/N of them, and leaves the others where they are).
+    """
+    shards = shard_aliases()
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    return max(shards, key=lambda alias: hashlib.blake2b(profile_id.bytes + alias.encode(), digest_size=8).digest())
+
+
+class ShardDirectory:
+    """
+    Per-process view of `UserProfile.shard`, the shard every user's rows live in.
+    Entries are trusted for `SHARD_DIRECTORY_TTL` seconds, which bounds how long another process keeps using a
+    user's old shard after a move (the rebalancer waits that long before it drops the old copy).
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        return getattr(settings, "SHARD_DIRECTORY_TTL", DEFAULT_DIRECTORY_TTL)
+
+    def lookup(self, user_id):
+        return self.lookup_many([user_id])[user_id]
+
+    def lookup_many(self, user_ids):
+        """
+        Returns `{user_id: alias}`, with a single catalog query for the users this process does not know yet.
+        """
+        now = time.monotonic()
+        found, missing = {}, []
+        with self.lock:
+            for user_id in user_ids:
+                entry = self.entries.get(user_id)
+                if entry is not None and entry[1] > now:
+                    found[user_id] = entry[0]
+                else:
+                    missing.append(user_id)
+        if missing:
+            # Always the primary: a lagging replica would send writes to the shard a user just left
+            profiles = apps.get_model("accounts", "UserProfile").objects.using(DEFAULT_DB_ALIAS)
+            shards = dict(profiles.filter(user_id__in=missing).values_list("user_id", "shard"))
+            with self.lock:
+                if len(self.entries) > DIRECTORY_MAX_SIZE:
+                    self.entries.clear()
+                for user_id in missing:
+                    found[user_id] = shards.get(user_id) or DEFAULT_DB_ALIAS
+                    self.entries[user_id] = (found[user_id], now + self.ttl)
+        return found
+
+    def forget(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+shard_directory = ShardDirectory()
+
+
+def shard_of(user_id):
+    """Returns the database holding the rows of `user_id` ("default" while sharding is off)."""
+    if not sharding_enabled():
+        return DEFAULT_DB_ALIAS
+    return shard_directory.lookup(user_id)
+
+
+def users_by_shard(user_ids):
+    """Groups `user_ids` by the database holding their rows: `{alias: [user_id, ...]}`."""
+    if not sharding_enabled():
+        return {DEFAULT_DB_ALIAS: list(user_ids)} if user_ids else {}
+    groups = {}
+    for user_id, alias in shard_directory.lookup_many(list(user_ids)).items():
+        groups.setdefault(alias, []).append(user_id)
+    return groups
+
+
+def current_shard():
+    return _current_shard.get()
+
+
+@contextmanager
+def on_shard(alias):
+    """
+    Routes the queries on user-owned models made in this block (thread or task) to the database `alias`.
+    """
+    token = _current_shard.set(alias)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+
+def for_user(user_id):
+    """Routes the queries on user-owned models made in this block to the shard of `user_id`."""
+    return on_shard(shard_of(user_id))
+
+
+def write_alias():
+    """The database the current block writes user data to: the current shard, else the catalog."""
+    return (current_shard() if sharding_enabled() else None) or DEFAULT_DB_ALIAS
+
+
+def shard_atomic(**kwargs):
+    """
+    `transaction.atomic` on `write_alias()`: a plain `transaction.atomic()` only covers "default".
+    """
+    return transaction.atomic(using=write_alias(), **kwargs)
+
+
+def on_signal_database(receiver):
+    """
+    Runs a model signal receiver inside `on_shard(using)`, so that the queries it makes on user data go to
+    the database of the row that was written.
+    """
+    @wraps(receiver)
+    def wrapper(sender, **kwargs):
+        with on_shard(kwargs.get("using")):
+            return receiver(sender, **kwargs)
+    return wrapper
+
+
+def stream_on_shard(alias, content):
+    """
+    Iterates a streamed response body with the queries of every step routed to `alias`: the body is consumed
+    after the view returned, outside of its `on_shard` block.
+    """
+    iterator = iter(content)
+    while True:
+        with on_shard(alias):
+            chunk = next(iterator, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+async def astream_on_shard(alias, content):
+    iterator = aiter(content)
+    while True:
+        with on_shard(alias):
+            chunk = await anext(iterator, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def across_shards(queryset):
+    """
+    Returns the querysets to evaluate for `queryset` to cover every user: one per database holding user data
+    when it reads a user-owned model outside of any `on_shard` block (and not through a related manager),
+    `[queryset]` otherwise.
+    """
+    if (not sharding_enabled() or not is_sharded(queryset.model) or current_shard() is not None
+            or queryset._db is not None or "instance" in queryset._hints):
+        return [queryset]
+    return [queryset.using(alias) for alias in data_aliases()]
+
+
+def get_across_shards(queryset):
+    """Returns the first object of `queryset` found on any shard, or None."""
+    for candidate in across_shards(queryset):
+        obj = candidate.first()
+        if obj is not None:
+            return obj
+    return None
+
+
+class ShardedQuerySet(models.QuerySet):
+    """
+    QuerySet of the user-owned models: `create()` writes to the shard of the new row's user even outside of
+    any `on_shard` block (a plain queryset asks the router about the model only, not about the row).
+    """
+
+    def create(self, **kwargs):
+        if self._db is None and current_shard() is None and sharding_enabled():
+            alias = router.db_for_write(self.model, instance=self.model(**kwargs))
+            return super(ShardedQuerySet, self.using(alias)).create(**kwargs)
+        return super().create(**kwargs)
+
+
+class ShardRouter:
+    """
+    Sends the queries on user-owned models (`SHARDED_MODELS`) to the shard of their user, and everything else
+    to the catalog. The shard comes from, in order: the instance a query is about (a row keeps the database
+    it was loaded from, a new row follows its `user_id`, a related manager follows its user), then the
+    enclosing `on_shard`/`for_user` block. Without either, the query is left to the next router (the catalog,
+    or its replica): code spanning every user iterates `data_aliases()` or uses `across_shards`.
+    Does nothing while `settings.DATABASE_SHARDS` is empty.
+
+    Shard databases only get the tables of the sharded apps; the catalog keeps every table, so that users
+    created before sharding was turned on keep working until `rebalance_shards` moves them.
+    """
+
+    def _shard(self, hints):
+        instance = hints.get("instance")
+        if instance is not None:
+            if is_sharded(type(instance)):
+                if instance._state.db:
+                    return instance._state.db
+                if getattr(instance, "user_id", None) is not None:
+                    return shard_of(instance.user_id)
+            elif instance._meta.label_lower == settings.AUTH_USER_MODEL.lower() and instance.pk is not None:
+                return shard_of(instance.pk)
+        return current_shard()
+
+    def _route(self, model, hints, catalog):
+        if not sharding_enabled():
+            return None
+        if is_sharded(model):
+            return self._shard(hints)
+        instance = hints.get("instance")
+        if catalog is None and instance is not None and is_sharded(type(instance)):
+            # e.g. `subscription.user`: without a router answer Django would read it where the subscription is
+            return DEFAULT_DB_ALIAS
+        return catalog
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints, None)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints, DEFAULT_DB_ALIAS)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # A user's rows point at the user across databases (their foreign keys carry no constraint)
+        return True if sharding_enabled() else None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or not self.is_shard_database(db):
+            return None
+        if model_name is None:
+            # Data migrations without a model hint: only those of the sharded apps (e.g. search tables)
+            return app_label in SHARDED_APPS
+        return f"{app_label}.{model_name}" in SHARDED_MODELS
+
+    @staticmethod
+    def is_shard_database(alias):
+        # Any database but the catalog and its read-only replica, so shards can be migrated before they are
+        # listed in DATABASE_SHARDS
+        config = connections.databases.get(alias, {})
+        return (alias != DEFAULT_DB_ALIAS and alias != getattr(settings, "DATABASE_READ_ALIAS", None)
+                and not config.get("TEST", {}).get("MIRROR"))
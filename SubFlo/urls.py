@@ -16,11 +16,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from SubFlo.views import redirect_root_view
+from SubFlo.views import redirect_root_view, metrics_view
 
 urlpatterns = [
     path("", redirect_root_view),
     path("admin/", admin.site.urls),
     path("dashboard/", include("dashboard.urls")),
     path("accounts/", include("accounts.urls")),
+    path("metrics", metrics_view, name="metrics-url"),
 ]
\ No newline at end of file
@@ -1,4 +1,22 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import redirect
+from django.utils.crypto import constant_time_compare
+from SubFlo.metrics import registry
 
 def redirect_root_view(request):
     return redirect('subscription-list-url')
+
+
+def metrics_view(request):
+    """
+    GET /metrics
+    Per-view latency, query count and SQL time histograms in the Prometheus text format.
+    Internal: only answered to staff users and to scrapers sending `Authorization: Bearer <METRICS_TOKEN>`.
+    The client address is not trusted: behind the reverse proxy every request comes from 127.0.0.1.
+    """
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    scraper = bool(settings.METRICS_TOKEN) and scheme.lower() == "bearer" and constant_time_compare(token, settings.METRICS_TOKEN)
+    if not scraper and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
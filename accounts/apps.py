@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class AccountsConfig(AppConfig):
     name = 'accounts'
+
+    def ready(self):
+        # Register the signal receivers that keep the user-id verifier in sync
+        from accounts import verification  # noqa: F401
@@ -0,0 +1,51 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from accounts.onboarding import DEFAULT_BATCH_SIZE, onboard_users
+from SubFlo.benchmarking import throwaway_environment
+from SubFlo.metrics import QueryTimer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares onboarding users one `create_user` at a time (signal path) with `onboard_users` (bulk path) "
+        "on throwaway test databases, and reports time and SQL queries per user."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100_000, help="Users created by each path.")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        users = options["users"]
+        with throwaway_environment():
+            results = [
+                ("signal path", self.measure(lambda: self.one_by_one("single", users))),
+                ("bulk path", self.measure(lambda: onboard_users(
+                    ({"username": f"bulk-{n}", "email": f"bulk-{n}@example.com"} for n in range(users)),
+                    batch_size=options["batch_size"],
+                ))),
+            ]
+
+        self.stdout.write(f"{users} users")
+        self.stdout.write(f"{'path':<14}{'seconds':>10}{'users/s':>12}{'queries':>10}{'queries/user':>14}")
+        for name, (elapsed, queries) in results:
+            self.stdout.write(
+                f"{name:<14}{elapsed:>10.2f}{users / elapsed:>12.0f}{queries:>10}{queries / users:>14.2f}"
+            )
+
+    @staticmethod
+    def one_by_one(prefix, users):
+        # Best case for the signal path: one transaction, no password hashing
+        with transaction.atomic():
+            for n in range(users):
+                User.objects.create_user(username=f"{prefix}-{n}", email=f"{prefix}-{n}@example.com")
+
+    @staticmethod
+    def measure(run):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with timer.installed():
+            run()
+        return time.perf_counter() - started, timer.queries
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from accounts.onboarding import DEFAULT_BATCH_SIZE, onboard_users, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates users and their profiles in bulk from a CSV (header: username,email,first_name,last_name,"
+        "email_access_granted) or .jsonl file, in one transaction. Existing usernames are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or .jsonl file with one user per row.")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Users per bulk insert.")
+
+    def handle(self, *args, **options):
+        try:
+            stats = onboard_users(read_records(options["path"]), batch_size=options["batch_size"])
+        except (OSError, ValueError) as error:
+            raise CommandError(str(error))
+        self.stdout.write(f"Skipped {stats.skipped} existing or duplicate usernames.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Onboarded {stats.created} users in {stats.elapsed:.2f}s ({stats.rate:.0f} users/s)."
+        ))
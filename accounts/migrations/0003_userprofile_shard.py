@@ -0,0 +1,25 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:53
+
+from django.db import migrations, models
+
+
+def place_existing_users(apps, schema_editor):
+    # Existing users keep their data in the default database until they are rebalanced
+    UserProfile = apps.get_model('accounts', 'UserProfile')
+    UserProfile.objects.using(schema_editor.connection.alias).update(shard='default')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_userprofile_id_alter_userprofile_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='shard',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100, verbose_name='Shard'),
+        ),
+        migrations.RunPython(place_existing_users, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 14:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_userprofile_shard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='imap_last_uid',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='IMAP Last UID'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='imap_uid_validity',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True, verbose_name='IMAP UIDVALIDITY'),
+        ),
+    ]
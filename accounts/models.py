@@ -3,6 +3,7 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from SubFlo.sharding import placement
 import uuid
 
 class UserProfile(models.Model):
@@ -11,15 +12,43 @@ class UserProfile(models.Model):
     Represents the user's profile information.
     Used to keep track of the latest date a LLM processes emails, so the LLM knows where it left off.
     `user` is globally unique automatically due to Django User model.
+    `shard` is the database alias holding the user's subscriptions and emails (see `SubFlo.sharding`),
+    chosen from the profile id when the profile is created and changed only by `rebalance_shards`.
+    `imap_uid_validity`/`imap_last_uid` are where `sync_mailboxes` resumes (see `subscriptions.mailsync`).
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, verbose_name="Profile ID")
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile') # Link to Django's built-in User model
     email_access_granted = models.BooleanField(default=False, verbose_name="Email Access Granted") # Flag for email access permission
     last_processed_date = models.DateTimeField(null=True, blank=True, verbose_name="Last Processed Date") # Timestamp of last email processing
+    shard = models.CharField(max_length=100, blank=True, default="", editable=False, verbose_name="Shard") # Database of the user's data
+    imap_uid_validity = models.PositiveBigIntegerField(null=True, blank=True, editable=False, verbose_name="IMAP UIDVALIDITY") # Mailbox generation of `imap_last_uid`
+    imap_last_uid = models.PositiveBigIntegerField(default=0, editable=False, verbose_name="IMAP Last UID") # Mailbox sync high-water mark
 
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        if not self.shard:
+            self.shard = placement(self.id)
+        super().save(*args, **kwargs)
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+
+    def changed_fields(self):
+        """
+        Names of the fields modified since the profile was loaded or saved (every field when that is unknown).
+        """
+        loaded = getattr(self, "_loaded_values", None)
+        fields = [field for field in self._meta.concrete_fields if not field.primary_key]
+        if loaded is None:
+            return [field.name for field in fields]
+        return [field.name for field in fields if field.attname in loaded and getattr(self, field.attname) != loaded[field.attname]]
+
     class Meta:
         verbose_name = "User Profile"
         verbose_name_plural = "User Profiles"
@@ -32,6 +61,11 @@ def create_user_profile(sender, instance, created, **kwargs):
         UserProfile.objects.create(user=instance)
 
 # Signal to save the UserProfile when the User is updated
+# Only a profile already loaded on the user can hold unsaved changes, and only its changed fields are written.
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
\ No newline at end of file
+def save_user_profile(sender, instance, created, raw=False, **kwargs):
+    if created or raw or not User.profile.related.is_cached(instance):
+        return
+    changed = instance.profile.changed_fields()
+    if changed:
+        instance.profile.save(update_fields=changed)
\ No newline at end of file
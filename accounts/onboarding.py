@@ -0,0 +1,109 @@
+# accounts/onboarding.py
+import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.utils import timezone
+from accounts.models import UserProfile
+from SubFlo.sharding import placement
+from subscriptions.signals import bulk_changed
+
+DEFAULT_BATCH_SIZE = 1000
+USER_FIELDS = ("username", "email", "first_name", "last_name")
+PROFILE_FIELDS = ("email_access_granted",)
+TRUE_VALUES = {"1", "true", "yes", "y", "t"}
+
+
+def read_records(path):
+    """
+    Streams user records from a CSV file (with a header row) or a .jsonl file, one dict per user.
+    Only `username` is required; see `USER_FIELDS` and `PROFILE_FIELDS` for the other columns.
+    """
+    path = Path(path)
+    with path.open(newline="", encoding="utf-8") as lines:
+        if path.suffix in (".jsonl", ".ndjson"):
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(lines)
+
+
+class OnboardingStats:
+
+    def __init__(self):
+        self.created = 0
+        self.skipped = 0
+        self.user_ids = []
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.created / self.elapsed if self.elapsed else 0.0
+
+
+def _flag(value):
+    return value if isinstance(value, bool) else str(value or "").strip().lower() in TRUE_VALUES
+
+
+def onboard_users(records, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Creates a `User` and its `UserProfile` for every record with two `bulk_create` calls per batch, all in one
+    transaction (a failure leaves nothing behind). The per-row signal path (`create_user_profile`,
+    `save_user_profile`) is skipped; usernames that already exist, in the database or earlier in `records`,
+    are skipped. Passwords are unusable (users set theirs through a reset), hashed once for the whole run.
+    Caches that track profiles (the user-id verifier) are notified with `bulk_changed`.
+    """
+    stats = OnboardingStats()
+    password = make_password(None)
+    now = timezone.now()
+    records = iter(records)
+    seen = set()
+
+    with transaction.atomic():
+        for batch in iter(lambda: list(islice(records, batch_size)), []):
+            by_username = {}
+            for record in batch:
+                username = str(record.get("username") or "").strip()
+                if not username or username in seen:
+                    stats.skipped += 1
+                    continue
+                seen.add(username)
+                by_username[username] = record
+            existing = set(User.objects.filter(username__in=by_username).values_list("username", flat=True))
+            stats.skipped += len(existing)
+
+            users = [
+                User(password=password, date_joined=now, username=username,
+                     **{name: str(record.get(name) or "") for name in USER_FIELDS if name != "username"})
+                for username, record in by_username.items() if username not in existing
+            ]
+            User.objects.bulk_create(users)
+            if connections[User.objects.db].features.can_return_rows_from_bulk_insert:
+                user_ids = {user.username: user.pk for user in users}
+            else:
+                # No RETURNING support: read the new primary keys back by username
+                user_ids = dict(User.objects.filter(username__in=[user.username for user in users])
+                                .values_list("username", "pk"))
+            profiles = [
+                UserProfile(user_id=user_ids[user.username],
+                            **{name: _flag(by_username[user.username].get(name)) for name in PROFILE_FIELDS})
+                for user in users
+            ]
+            for profile in profiles:
+                profile.shard = placement(profile.id)  # bulk_create skips `UserProfile.save`
+            UserProfile.objects.bulk_create(profiles)
+            stats.created += len(users)
+            stats.user_ids += user_ids.values()
+
+        if stats.user_ids:
+            bulk_changed.send(sender=onboard_users, model=UserProfile, user_ids=set(stats.user_ids))
+    return stats
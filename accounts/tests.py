@@ -1,3 +1,147 @@
-from django.test import TestCase
+import tempfile
+import uuid
+from pathlib import Path
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from accounts.models import UserProfile
+from accounts.onboarding import onboard_users
+from accounts.verification import BloomFilter, TTLCache, profile_verifier, profiles_created
+from SubFlo.metrics import registry
 
-# Create your tests here.
+
+class BloomFilterTests(TestCase):
+
+    def test_no_false_negatives_and_bounded_false_positives(self):
+        bloom = BloomFilter(capacity=10_000, error_rate=0.01)
+        members = [uuid.uuid4() for _ in range(10_000)]
+        for member in members:
+            bloom.add(member)
+        self.assertTrue(all(member in bloom for member in members))
+        false_positives = sum(uuid.uuid4() in bloom for _ in range(10_000))
+        self.assertLess(false_positives, 300)
+
+    def test_ttl_cache_is_bounded_and_expires(self):
+        cache = TTLCache(max_size=2, ttl=60)
+        for key in "abc":
+            cache.set(key, key.upper())
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("c"), "C")
+        with mock.patch("accounts.verification.time.monotonic", return_value=10 ** 9):
+            self.assertIsNone(cache.get("c"))
+
+
+class VerifyUserIdTests(TestCase):
+
+    def setUp(self):
+        profile_verifier.reset()
+        registry.reset()
+        self.user = User.objects.create_user(username="alice")
+        self.profile_id = str(self.user.profile.id)
+        self.url = reverse("api-verify-user-id-url")
+
+    def verify(self, user_id):
+        return self.client.get(self.url, {"user_id": user_id}).status_code
+
+    def test_repeats_skip_the_database(self):
+        # First call builds the filter (count + id scan); the profile was cached when it was created
+        with self.assertNumQueries(2):
+            self.assertEqual(self.verify(self.profile_id), 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.verify(self.profile_id), 200)
+            self.assertEqual(self.verify("not-a-uuid"), 404)
+        # An id the filter rules out is rejected without a query
+        with self.assertNumQueries(0):
+            self.assertEqual(self.verify(str(uuid.uuid4())), 404)
+        counters = registry.snapshot()["counters"]
+        self.assertEqual(counters["subflo_user_verification_cache_hits_total"], 2)
+        self.assertEqual(counters["subflo_user_verification_bloom_negatives_total"], 1)
+        self.assertEqual(counters["subflo_user_verification_invalid_total"], 1)
+
+    def test_signals_keep_the_verifier_current(self):
+        self.verify(self.profile_id)
+        bob = User.objects.create_user(username="bob")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.verify(str(bob.profile.id)), 200)
+
+        # Deleted ids stay in the filter and come back as counted false positives
+        bob.delete()
+        self.assertEqual(self.verify(str(bob.profile.id)), 404)
+        self.assertEqual(registry.snapshot()["counters"]["subflo_user_verification_false_positives_total"], 1)
+        with override_settings(METRICS_TOKEN="scraper-token"):
+            body = self.client.get(reverse("metrics-url"), headers={"authorization": "Bearer scraper-token"}).content.decode()
+        self.assertIn("subflo_user_verification_false_positives_total 1", body)
+
+    def test_profiles_created_elsewhere_are_synced(self):
+        self.verify(self.profile_id)
+        # Written without signals, as another worker process would look from here: its signals only reach
+        # this process through the shared version
+        User.objects.bulk_create([User(username="carol")])
+        carol = User.objects.get(username="carol")
+        profile = UserProfile.objects.bulk_create([UserProfile(user=carol)])[0]
+        self.assertEqual(self.verify(str(profile.id)), 404)
+        profiles_created()
+        # One incremental sync (new profiles only), then the lookup by id
+        with self.assertNumQueries(2):
+            self.assertEqual(self.verify(str(profile.id)), 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.verify(str(uuid.uuid4())), 404)
+
+
+class OnboardingTests(TestCase):
+
+    def setUp(self):
+        profile_verifier.reset()
+        User.objects.create_user(username="existing")
+
+    def test_creates_users_and_profiles_in_bulk(self):
+        records = [{"username": f"user{n}", "email": f"user{n}@example.com", "email_access_granted": "yes"}
+                   for n in range(50)]
+        records += [{"username": "user0"}, {"username": "existing"}, {"username": ""}]
+        # savepoint, 2 batches x (existing usernames, users, profiles), verifier sync, release
+        with self.assertNumQueries(9):
+            stats = onboard_users(records, batch_size=30)
+
+        self.assertEqual((stats.created, stats.skipped), (50, 3))
+        profiles = UserProfile.objects.filter(user__username__startswith="user")
+        self.assertEqual(profiles.count(), 50)
+        self.assertEqual(profiles.filter(email_access_granted=True).count(), 50)
+        self.assertFalse(User.objects.get(username="user7").has_usable_password())
+        # The verifier was told about the new profiles
+        self.assertIsNotNone(profile_verifier.resolve(str(profiles.first().id)))
+
+    def test_command_reads_csv(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "users.csv"
+            path.write_text("username,email,email_access_granted\nbob,bob@example.com,false\nexisting,,\n")
+            call_command("onboard_users", str(path), stdout=mock.MagicMock())
+        self.assertFalse(User.objects.get(username="bob").profile.email_access_granted)
+        self.assertEqual(UserProfile.objects.count(), 2)
+
+
+class SaveUserProfileTests(TestCase):
+
+    def setUp(self):
+        User.objects.create_user(username="alice")
+
+    def test_unchanged_profile_is_not_written(self):
+        user = User.objects.get(username="alice")
+        with self.assertNumQueries(1):  # the user UPDATE only, the profile is not even loaded
+            user.save()
+        user.profile.email_access_granted  # load it
+        with self.assertNumQueries(1):
+            user.save()
+
+    def test_changed_fields_only_are_written(self):
+        user = User.objects.select_related("profile").get(username="alice")
+        user.profile.email_access_granted = True
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertEqual(len(queries), 2)
+        self.assertIn('"email_access_granted"', queries[1]["sql"])
+        self.assertNotIn('"last_processed_date"', queries[1]["sql"])
+        self.assertTrue(UserProfile.objects.get(user=user).email_access_granted)
@@ -1,7 +1,8 @@
 from django.urls import path
-from accounts.views import AccountDetail, api_verify_user_id
+from accounts.views import AccountDetail, api_verify_user_id, api_verify_user_id_async
 
 urlpatterns = [
     path("<uuid:pk>", AccountDetail.as_view(), name="account-detail-url"),
     path("api/accounts/verify/", api_verify_user_id, name="api-verify-user-id-url"),
+    path("api/accounts/verify/async/", api_verify_user_id_async, name="api-verify-user-id-async-url"),
 ]
\ No newline at end of file
@@ -0,0 +1,288 @@
+# accounts/verification.py
+import hashlib
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from accounts.models import UserProfile
+from subscriptions.signals import bulk_changed
+from SubFlo.metrics import registry
+
+DEFAULT_BLOOM_ERROR_RATE = 0.001
+MIN_BLOOM_CAPACITY = 100_000
+DEFAULT_CACHE_SIZE = 10_000
+DEFAULT_CACHE_TTL = 60        # seconds a positive answer is trusted (bounds staleness after a delete elsewhere)
+BUILD_CHUNK_SIZE = 5000
+# Shared by every process through the cache, bumped whenever profiles are created
+PROFILES_VERSION_KEY = "accounts:profiles:version"
+
+COUNTERS = {
+    "lookups": "User-id verifications.",
+    "invalid": "User-id verifications rejected as malformed UUIDs.",
+    "bloom_negatives": "User-id verifications answered negatively by the Bloom filter (once synced).",
+    "cache_hits": "User-id verifications answered by the positive cache.",
+    "db_lookups": "User-id verifications that queried UserProfile.",
+    "false_positives": "Database lookups for ids the Bloom filter let through but that do not exist.",
+}
+for _name, _help in COUNTERS.items():
+    registry.describe_counter(f"subflo_user_verification_{_name}_total", _help)
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter of UUIDs: no false negatives, about `error_rate` false positives at `capacity` items.
+    Bit positions come from double hashing one BLAKE2b digest, so ids crafted by a client cannot target bits.
+    """
+
+    def __init__(self, capacity, error_rate=DEFAULT_BLOOM_ERROR_RATE, key=b""):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.key = key
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.bytes, digest_size=16, key=self.key).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class TTLCache:
+    """
+    Bounded LRU mapping whose entries expire `ttl` seconds after they were set.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def profiles_version():
+    version = cache.get(PROFILES_VERSION_KEY)
+    if version is None:
+        # Starting from the clock keeps a version that was evicted from the cache from reusing an old number
+        version = time.time_ns()
+        cache.set(PROFILES_VERSION_KEY, version, None)
+    return version
+
+
+def _bump_profiles_version():
+    try:
+        cache.incr(PROFILES_VERSION_KEY)
+    except ValueError:
+        cache.set(PROFILES_VERSION_KEY, time.time_ns(), None)
+
+
+def profiles_created(using=None):
+    """
+    Tells the verifier of every process that profiles were created: its next negative answer syncs first.
+    The version is bumped again once the transaction of `using` commits, since a process syncing in between
+    does not see the new rows yet.
+    """
+    _bump_profiles_version()
+    transaction.on_commit(_bump_profiles_version, using=using)
+
+
+class ProfileVerifier:
+    """
+    Resolves a profile UUID (as sent by the extension) to its user id, or None when it does not exist.
+    Malformed ids are rejected without a query; known ids are answered from the positive LRU/TTL cache; ids
+    the Bloom filter of every `UserProfile.id` lets through reach the database.
+    The filter is built on first use and kept current by the profile signals of this process. The profiles
+    other processes create are not in it: they bump `profiles_version`, and the first id ruled out after a
+    bump runs a cheap incremental query (profiles of new `auth_user` ids) before it is rejected. Other ids
+    it rules out are rejected without a query. The filter is rebuilt when it outgrows its capacity.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cache = TTLCache(
+            getattr(settings, "USER_VERIFICATION_CACHE_SIZE", DEFAULT_CACHE_SIZE),
+            getattr(settings, "USER_VERIFICATION_CACHE_TTL", DEFAULT_CACHE_TTL),
+        )
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.bloom = None
+            self.last_user_id = 0
+            self.version = None
+        self.cache.clear()
+
+    def _build(self):
+        # Read first: profiles created while the filter is built bump it again
+        self.version = profiles_version()
+        count = UserProfile.objects.count()
+        bloom = BloomFilter(
+            max(MIN_BLOOM_CAPACITY, count * 2),
+            getattr(settings, "USER_VERIFICATION_BLOOM_ERROR_RATE", DEFAULT_BLOOM_ERROR_RATE),
+            key=uuid.uuid4().bytes,
+        )
+        last_user_id = 0
+        for pk, user_id in UserProfile.objects.order_by().values_list("pk", "user_id").iterator(chunk_size=BUILD_CHUNK_SIZE):
+            bloom.add(pk)
+            last_user_id = max(last_user_id, user_id)
+        self.bloom, self.last_user_id = bloom, last_user_id
+
+    def _sync(self):
+        # Profiles created since the last build or sync, by any process
+        new = UserProfile.objects.filter(user_id__gt=self.last_user_id).values_list("pk", "user_id")
+        for pk, user_id in new:
+            self.bloom.add(pk)
+            self.last_user_id = max(self.last_user_id, user_id)
+
+    def might_exist(self, profile_id):
+        return bool(self.filter_existing([profile_id]))
+
+    def _parse(self, profile_uuid):
+        registry.increment("subflo_user_verification_lookups_total")
+        try:
+            return uuid.UUID(str(profile_uuid))
+        except ValueError:
+            registry.increment("subflo_user_verification_invalid_total")
+            return None
+
+    def _prefilter(self, profile_id):
+        """
+        Returns `(answered, user_id)`: answered is True when the filter or the cache settled the lookup.
+        """
+        if not self.might_exist(profile_id):
+            registry.increment("subflo_user_verification_bloom_negatives_total")
+            return True, None
+        user_id = self.cache.get(profile_id)
+        if user_id is not None:
+            registry.increment("subflo_user_verification_cache_hits_total")
+            return True, user_id
+        registry.increment("subflo_user_verification_db_lookups_total")
+        return False, None
+
+    def _remember(self, profile_id, user_id):
+        if user_id is None:
+            registry.increment("subflo_user_verification_false_positives_total")
+        else:
+            self.cache.set(profile_id, user_id)
+        return user_id
+
+    def resolve(self, profile_uuid):
+        profile_id = self._parse(profile_uuid)
+        if profile_id is None:
+            return None
+        answered, user_id = self._prefilter(profile_id)
+        if answered:
+            return user_id
+        return self._remember(profile_id, UserProfile.objects.filter(pk=profile_id).values_list("user_id", flat=True).first())
+
+    async def aresolve(self, profile_uuid):
+        """
+        Async twin of `resolve`; the Bloom filter is built or synced with the sync ORM when needed.
+        """
+        from asgiref.sync import sync_to_async
+
+        profile_id = self._parse(profile_uuid)
+        if profile_id is None:
+            return None
+        answered, user_id = await sync_to_async(self._prefilter)(profile_id)
+        if answered:
+            return user_id
+        user_id = await UserProfile.objects.filter(pk=profile_id).values_list("user_id", flat=True).afirst()
+        return self._remember(profile_id, user_id)
+
+    def filter_existing(self, profile_ids):
+        """
+        Drops the ids the Bloom filter rules out (for batch lookups that query the rest at once). When some are
+        not in it and profiles were created since the last sync, the filter is synced first, once: they may
+        have been created by another process.
+        """
+        with self.lock:
+            if self.bloom is None or self.bloom.count > self.bloom.capacity:
+                self._build()
+            if not all(profile_id in self.bloom for profile_id in profile_ids):
+                version = profiles_version()
+                if version != self.version:
+                    self._sync()
+                    self.version = version
+            return [profile_id for profile_id in profile_ids if profile_id in self.bloom]
+
+    def add(self, profile_id, user_id):
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(profile_id)
+                self.last_user_id = max(self.last_user_id, user_id)
+        self.cache.set(profile_id, user_id)
+
+    def remove(self, profile_id):
+        # A Bloom filter cannot forget: the id becomes a (counted) false positive until the next rebuild
+        self.cache.delete(profile_id)
+
+
+profile_verifier = ProfileVerifier()
+
+
+# Signals to keep the verifier in sync with `UserProfile` writes (`create_user_profile` saves through these)
+@receiver(post_save, sender=UserProfile)
+def add_verified_profile(sender, instance, created, using=None, **kwargs):
+    if created:
+        profile_verifier.add(instance.pk, instance.user_id)
+        profiles_created(using)
+
+
+@receiver(post_delete, sender=UserProfile)
+def remove_verified_profile(sender, instance, **kwargs):
+    profile_verifier.remove(instance.pk)
+
+
+@receiver(bulk_changed)
+def add_bulk_created_profiles(sender, model, user_ids, **kwargs):
+    if model is UserProfile:
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), BUILD_CHUNK_SIZE):
+            chunk = user_ids[start:start + BUILD_CHUNK_SIZE]
+            for pk, user_id in UserProfile.objects.filter(user_id__in=chunk).values_list("pk", "user_id"):
+                profile_verifier.add(pk, user_id)
+        profiles_created()
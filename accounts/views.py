@@ -2,6 +2,7 @@ from django.http import HttpResponse
 from django.shortcuts import render, get_object_or_404
 from django.views import View
 from accounts.models import UserProfile
+from accounts.verification import profile_verifier
 
 
 ############################################################
@@ -32,14 +33,28 @@ class AccountDetail(View):
 def api_verify_user_id(request):
     """
     GET /api/accounts/verify/?user_id=<profile_uuid>
+    Bogus ids are answered by the verifier's Bloom filter and known ones by its cache, without a query.
     """
     profile_uuid = request.GET.get("user_id")
     
     if not profile_uuid:
         return HttpResponse("No user_id provided.", status=400)
 
-    try:
-        _ = UserProfile.objects.select_related("user").get(id=profile_uuid)
+    if profile_verifier.resolve(profile_uuid) is not None:
         return HttpResponse(f"This user_id ({profile_uuid}) is existing/valid.", status=200)
-    except UserProfile.DoesNotExist:
-        return HttpResponse(f"This user_id ({profile_uuid}) does not exist.", status=404)
\ No newline at end of file
+    return HttpResponse(f"This user_id ({profile_uuid}) does not exist.", status=404)
+
+
+async def api_verify_user_id_async(request):
+    """
+    GET /api/accounts/verify/async/?user_id=<profile_uuid>
+    Same contract as `api_verify_user_id`, served on the event loop with the async ORM under ASGI.
+    """
+    profile_uuid = request.GET.get("user_id")
+
+    if not profile_uuid:
+        return HttpResponse("No user_id provided.", status=400)
+
+    if await profile_verifier.aresolve(profile_uuid) is not None:
+        return HttpResponse(f"This user_id ({profile_uuid}) is existing/valid.", status=200)
+    return HttpResponse(f"This user_id ({profile_uuid}) does not exist.", status=404)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class DashboardConfig(AppConfig):
     name = 'dashboard'
+
+    def ready(self):
+        # Register the signal receivers that invalidate the dashboard caches
+        from dashboard import caching, summary  # noqa: F401
@@ -0,0 +1,107 @@
+# dashboard/benchmark.py
+import json
+import statistics
+import time
+from pathlib import Path
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from accounts.models import UserProfile
+from SubFlo.sharding import for_user
+from subscriptions.models import Subscription, EmailMessage
+
+# A scenario regresses when a percentile grows by more than the tolerance AND by more than this many
+# milliseconds (sub-millisecond noise would flag everything), or when it issues more queries than before
+MIN_REGRESSION_MS = 1.0
+PERCENTILES = (50, 95, 99)
+
+
+def scenarios():
+    """
+    Returns `(name, method, path, data)` for every benchmarked page and API, aimed at a sample of the data.
+    """
+    profile = UserProfile.objects.order_by("user_id").first()
+    with for_user(profile.user_id):
+        subscription = Subscription.objects.filter(user_id=profile.user_id).order_by("pk").first()
+        email = EmailMessage.objects.filter(user_id=profile.user_id).order_by("pk").first()
+    profile_ids = ",".join(str(pk) for pk in UserProfile.objects.order_by("user_id").values_list("pk", flat=True)[:50])
+    return [
+        ("subscription_list", "get", reverse("subscription-list-url"), {}),
+        ("subscription_list_search", "get", reverse("subscription-list-url"), {"q": "netflix"}),
+        ("subscription_list_post_search", "post", reverse("subscription-list-url"), {"text": "family"}),
+        ("email_message_list", "get", reverse("email_message_list-url"), {}),
+        ("subscription_detail", "get", subscription.get_absolute_url(), {}),
+        ("email_message_detail", "get", reverse("email_message_detail-url", args=[email.pk]), {}),
+        ("api_active_subscriptions", "get", reverse("api-active-subscriptions-url"), {"user_id": str(profile.pk)}),
+        ("api_batch_active_subscriptions", "get", reverse("api-batch-active-subscriptions-url"), {"user_ids": profile_ids}),
+        ("api_verify_user_id", "get", reverse("api-verify-user-id-url"), {"user_id": str(profile.pk)}),
+    ]
+
+
+def measure(client, method, path, data, requests=50, warmup=2):
+    """
+    Requests `path` `warmup + requests` times and returns the latency percentiles (ms) and query count
+    of the timed requests. Streamed bodies are read completely, so they are part of the latency.
+    """
+    latencies, queries = [], 0
+    for i in range(warmup + requests):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = getattr(client, method)(path, data)
+            if response.streaming:
+                b"".join(response.streaming_content)
+            elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f"{method.upper()} {path} returned {response.status_code}")
+        if i >= warmup:
+            latencies.append(elapsed)
+            queries = max(queries, len(captured))
+
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    result = {f"p{p}": round(cuts[p - 1], 3) for p in PERCENTILES}
+    result["queries"] = queries
+    return result
+
+
+def run_benchmark(requests=50, warmup=2):
+    """
+    Measures every scenario against the current database. Returns `{scenario: measurement}`.
+    """
+    client = Client()
+    return {
+        name: measure(client, method, path, data, requests, warmup)
+        for name, method, path, data in scenarios()
+    }
+
+
+def find_regressions(results, baseline, tolerance=0.25):
+    """
+    Compares `{size: {scenario: measurement}}` with a saved baseline of the same shape and returns one
+    message per regression. Sizes and scenarios missing from the baseline are ignored.
+    """
+    regressions = []
+    for size, measurements in results.items():
+        for name, current in measurements.items():
+            previous = baseline.get(str(size), {}).get(name)
+            if previous is None:
+                continue
+            if current["queries"] > previous["queries"]:
+                regressions.append(f"{name} @ {size}: {previous['queries']} -> {current['queries']} queries")
+            for p in PERCENTILES:
+                key = f"p{p}"
+                before, after = previous[key], current[key]
+                if after > before * (1 + tolerance) and after - before > MIN_REGRESSION_MS:
+                    regressions.append(f"{name} @ {size}: {key} {before:.1f} -> {after:.1f} ms")
+    return regressions
+
+
+def load_baseline(path):
+    path = Path(path)
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def save_baseline(path, results):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({str(size): value for size, value in results.items()}, indent=2, sort_keys=True))
@@ -0,0 +1,149 @@
+# dashboard/caching.py
+import hashlib
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from subscriptions.models import Subscription, EmailMessage, ExchangeRate
+from subscriptions.signals import bulk_changed
+from SubFlo.sharding import write_alias
+
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+# Cache entries never expire on their own: a bumped version makes them unreachable
+VERSION_TIMEOUT = None
+
+
+############################################################
+###################### Data versions #######################
+############################################################
+
+def version_key(user_id=None):
+    return f"dashboard:version:{user_id or 'all'}"
+
+
+def _fresh_version():
+    # Starting from the clock keeps a version that was evicted from the cache from reusing an old number
+    return time.time_ns()
+
+
+def data_versions(user_ids):
+    """
+    Returns `{user_id: version}` for every id of `user_ids` (None is the version of every user's data).
+    Missing versions are created, so the returned numbers are always the ones the next bump increments.
+    """
+    keys = {version_key(user_id): user_id for user_id in user_ids}
+    versions = cache.get_many(keys)
+    missing = {key: _fresh_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, VERSION_TIMEOUT)
+        versions.update(missing)
+    return {user_id: versions[key] for key, user_id in keys.items()}
+
+
+def data_version(user_id=None):
+    return data_versions([user_id])[user_id]
+
+
+def _bump(user_ids):
+    for key in {version_key(user_id) for user_id in user_ids} | {version_key()}:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _fresh_version(), VERSION_TIMEOUT)
+
+
+def bump_data_versions(user_ids, using=None):
+    """
+    Invalidates every cached page built from the data of `user_ids` (and every all-users page).
+    The versions are bumped right away and again once the transaction of the database `using` (by default the
+    one user data is being written to) commits: a page rendered in between may have read the rows as they
+    were before the commit, and must not outlive it.
+    """
+    user_ids = set(user_ids)
+    _bump(user_ids)
+    transaction.on_commit(lambda: _bump(user_ids), using=using or write_alias())
+
+
+############################################################
+######################## Page cache ########################
+############################################################
+
+def _page_key(request, vary_on_csrf):
+    # The day is part of the key: "active", "expiring soon" and renewal countdowns change at midnight with no write
+    parts = [timezone.localdate().isoformat(), str(request.user.pk or ""), request.get_full_path()]
+    if vary_on_csrf:
+        # The page embeds a CSRF token, which is only valid with the visitor's CSRF cookie
+        parts.append(request.META.get("CSRF_COOKIE", ""))
+    return "dashboard:page:" + hashlib.md5("\0".join(parts).encode()).hexdigest()
+
+
+def cache_page_per_version(owners=lambda request, **kwargs: [None], vary_on_csrf=False):
+    """
+    Caches the rendered GET responses of a view, per visitor, URL and day.
+    `owners(request, **kwargs)` returns the users whose data the page shows (`[None]`, the default, stands for
+    every user's data). An entry is stored with the data versions of its owners, read before the view runs,
+    and is only served while those versions are unchanged: any `Subscription`/`EmailMessage` write of an owner
+    makes it stale without looking for the keys it invalidates. A hit costs two cache reads and no query.
+    Views rendering a CSRF token set `vary_on_csrf`; their pages are only cached for visitors holding a
+    CSRF cookie.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+
+            key = _page_key(request, vary_on_csrf)
+            entry = cache.get(key)
+            if entry is not None:
+                versions, response = entry
+                if data_versions(versions) == versions:
+                    return response
+                page_owners = list(versions)
+            else:
+                page_owners = owners(request, **kwargs)
+            versions = data_versions(page_owners)
+            had_csrf_cookie = "CSRF_COOKIE" in request.META
+
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200 or response.streaming:
+                return response
+
+            def store(response):
+                if vary_on_csrf and not had_csrf_cookie and "CSRF_COOKIE_NEEDS_UPDATE" in request.META:
+                    return  # The token belongs to a cookie the visitor does not have yet
+                cache.set(key, (versions, response), getattr(settings, "PAGE_CACHE_TIMEOUT", PAGE_CACHE_TIMEOUT))
+
+            if hasattr(response, "render") and not response.is_rendered:
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+            return response
+        return wrapper
+    return decorator
+
+
+# Signals to bump the data versions on `Subscription` and `EmailMessage` writes
+@receiver(post_save, sender=Subscription)
+@receiver(post_save, sender=EmailMessage)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_delete, sender=EmailMessage)
+def bump_version_on_write(sender, instance, using=None, **kwargs):
+    bump_data_versions([instance.user_id], using)
+
+
+@receiver(bulk_changed)
+def bump_version_on_bulk_change(sender, model, user_ids, **kwargs):
+    if model in (Subscription, EmailMessage):
+        bump_data_versions(user_ids)
+
+
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+def bump_version_on_rate_change(sender, instance, **kwargs):
+    # Only the all-users summary converts amounts
+    bump_data_versions([])
@@ -0,0 +1,84 @@
+# dashboard/encoders.py
+import datetime
+import decimal
+import json
+import uuid
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.http import parse_header_parameters
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib encoder is the fallback
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, only served when installed
+    msgpack = None
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+
+def _default(value):
+    # What neither orjson nor msgpack encode natively: prices as strings (like DjangoJSONEncoder), UUIDs and dates
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def encode_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, cls=DjangoJSONEncoder, separators=(",", ":")).encode()
+
+
+def encode_msgpack(payload):
+    return msgpack.packb(payload, default=_default, datetime=False)
+
+
+def negotiate(request):
+    """
+    Picks the response format from the `Accept` header: msgpack when it is asked for (and installed), JSON otherwise.
+    Returns `(content_type, encoder)`, or None when only unsupported formats are acceptable.
+    """
+    accepted = []
+    for item in request.headers.get("Accept", "").split(","):
+        media_type, params = parse_header_parameters(item)
+        if not media_type:
+            continue
+        try:
+            quality = float(params.get("q", 1))
+        except ValueError:
+            quality = 1.0
+        accepted.append((quality, media_type.lower()))
+    if not accepted:
+        return JSON_CONTENT_TYPE, encode_json
+
+    for quality, media_type in sorted(accepted, key=lambda item: -item[0]):
+        if quality <= 0:
+            continue
+        if media_type in MSGPACK_CONTENT_TYPES and msgpack is not None:
+            return MSGPACK_CONTENT_TYPES[0], encode_msgpack
+        if media_type in (JSON_CONTENT_TYPE, "application/*", "*/*"):
+            return JSON_CONTENT_TYPE, encode_json
+    return None
+
+
+def encoded_response(request, payload, status=200):
+    """
+    Serializes `payload` in the format negotiated with `negotiate` (406 when none is acceptable).
+    """
+    negotiated = negotiate(request)
+    if negotiated is None:
+        return HttpResponse(encode_json({"error": "Supported formats: application/json, application/msgpack"}),
+                            status=406, content_type=JSON_CONTENT_TYPE)
+    content_type, encoder = negotiated
+    response = HttpResponse(encoder(payload), status=status, content_type=content_type)
+    response["Vary"] = "Accept"
+    return response
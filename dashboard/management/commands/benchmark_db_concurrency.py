@@ -0,0 +1,144 @@
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from SubFlo.benchmarking import throwaway_environment
+from SubFlo.db import SQLITE_INIT_COMMAND
+from SubFlo.sharding import sharding_enabled
+from subscriptions.models import Subscription, EmailMessage
+from subscriptions.synthetic import SyntheticDataset
+
+# Connection settings compared by the benchmark: SQLite's own defaults (rollback journal) and production's
+MODES = {
+    "defaults": {"journal_mode": "DELETE", "options": {}},
+    "tuned": {"journal_mode": "WAL", "options": {"init_command": SQLITE_INIT_COMMAND, "transaction_mode": "IMMEDIATE"}},
+}
+
+
+def _dashboard_reads(user_ids, today):
+    """
+    The queries of a dashboard visit: the user's active subscriptions, their spending summary and a page of emails.
+    """
+    user_id = random.choice(user_ids)
+    list(Subscription.objects.filter(user_id=user_id, already_canceled=False)
+         .filter(Q(end_date__isnull=True) | Q(end_date__gte=today)).values("id", "platform_name", "price"))
+    Subscription.objects.filter(user_id=user_id).aggregate(total=Sum("price"), count=Count("pk"))
+    list(EmailMessage.objects.filter(user_id=user_id).order_by("-received_date", "-id")
+         .values("id", "subject", "sender", "received_date")[:50])
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures dashboard reads while a writer bulk-imports synthetic users, once with SQLite's default "
+        "settings and once with the production tuning (WAL, synchronous=NORMAL, page cache, memory map). "
+        "Reports read throughput, latency percentiles and lock errors. Runs on a throwaway database file, "
+        "never on the real one; needs the SQLite backend."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=500, help="Users created before the measurement.")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds measured per mode.")
+        parser.add_argument("--readers", type=int, default=4, help="Threads issuing dashboard reads.")
+        parser.add_argument("--batch-users", type=int, default=100, help="Users written per write transaction.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("This benchmark compares SQLite settings; the default database is not SQLite.")
+        if sharding_enabled():
+            # The synthetic rows would land in the shards, while the settings compared are the catalog's
+            raise CommandError("This benchmark measures the catalog database alone; run it with DATABASE_SHARDS empty.")
+        if options["readers"] < 1 or options["duration"] <= 0:
+            raise CommandError("--readers and --duration must be positive.")
+
+        # Threads need their own connections to one file: the in-memory test database would be shared-cache
+        directory = tempfile.mkdtemp()
+        connection.settings_dict["TEST"]["NAME"] = os.path.join(directory, "benchmark.sqlite3")
+        original_options = dict(settings.DATABASES[connection.alias].get("OPTIONS", {}))
+        dataset = SyntheticDataset(subscriptions_per_user=10, emails_per_user=20, batch_users=options["batch_users"])
+        try:
+            with throwaway_environment():
+                try:
+                    dataset.grow_to(options["users"])
+                    self.stdout.write(f"{'mode':<10}{'reads':>8}{'reads/s':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}"
+                                      f"{'max (ms)':>10}{'errors':>8}{'written':>9}")
+                    for mode, config in MODES.items():
+                        self.use_mode(config)
+                        result = self.measure(dataset, options)
+                        self.stdout.write(
+                            f"{mode:<10}{result['reads']:>8}{result['rate']:>10.1f}{result['p50']:>10.2f}"
+                            f"{result['p95']:>10.2f}{result['max']:>10.2f}{result['errors']:>8}{result['written']:>9}"
+                        )
+                finally:
+                    self.use_mode({"journal_mode": "DELETE", "options": original_options})
+        finally:
+            os.rmdir(directory)
+
+    @staticmethod
+    def use_mode(config):
+        # Every thread's connection is built from this dict, so the mode applies to connections opened afterwards
+        options = connection.settings_dict.setdefault("OPTIONS", {})
+        options.clear()
+        options.update(config["options"])
+        connections.close_all()
+        with connection.cursor() as cursor:
+            # The journal mode is stored in the file; the init command only sets it again
+            cursor.execute(f"PRAGMA journal_mode={config['journal_mode']}")
+        connection.close()
+
+    def measure(self, dataset, options):
+        user_ids = list(dataset.users().values_list("pk", flat=True))
+        today = timezone.localdate()
+        deadline = time.perf_counter() + options["duration"]
+        latencies, errors, written = [], [], []
+
+        def read():
+            try:
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        _dashboard_reads(user_ids, today)
+                    except OperationalError as exc:
+                        errors.append(exc)
+                        continue
+                    latencies.append((time.perf_counter() - started) * 1000)
+            finally:
+                connection.close()
+
+        def write():
+            try:
+                while time.perf_counter() < deadline:
+                    start = dataset.users().count()
+                    try:
+                        dataset.generate(start, start + options["batch_users"])
+                    except OperationalError as exc:
+                        errors.append(exc)
+                        continue
+                    written.append(options["batch_users"])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(options["readers"])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+        return {
+            "reads": len(latencies),
+            "rate": len(latencies) / elapsed,
+            "p50": cuts[49] if cuts else 0.0,
+            "p95": cuts[94] if cuts else 0.0,
+            "max": max(latencies, default=0.0),
+            "errors": len(errors),
+            "written": sum(written),
+        }
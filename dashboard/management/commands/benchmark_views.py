@@ -0,0 +1,62 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from dashboard.benchmark import find_regressions, load_baseline, run_benchmark, save_baseline
+from SubFlo.benchmarking import throwaway_environment
+from subscriptions.synthetic import SyntheticDataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the dashboard pages and the external APIs on synthetic datasets of growing size and reports "
+        "latency percentiles and query counts. Runs on throwaway test databases and a private cache, never on the real ones. "
+        "With --baseline, results are compared with a saved run and the command fails on regressions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10,100,1000", help="Comma-separated numbers of users.")
+        parser.add_argument("--subscriptions", type=int, default=10, help="Subscriptions per user.")
+        parser.add_argument("--emails", type=int, default=20, help="Emails per user.")
+        parser.add_argument("--requests", type=int, default=50, help="Timed requests per scenario.")
+        parser.add_argument("--baseline", help="JSON file with a previous run to compare against.")
+        parser.add_argument("--save-baseline", action="store_true", help="Write this run to --baseline.")
+        parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="Allowed relative latency increase before a scenario counts as a regression.")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted({int(size) for size in options["sizes"].split(",")})
+        except ValueError:
+            raise CommandError("--sizes must be comma-separated integers.")
+        if options["save_baseline"] and not options["baseline"]:
+            raise CommandError("--save-baseline needs --baseline.")
+
+        dataset = SyntheticDataset(subscriptions_per_user=options["subscriptions"], emails_per_user=options["emails"])
+        results = {}
+        with throwaway_environment():
+            # The dataset only grows, so each size reuses the rows of the previous one
+            for size in sizes:
+                dataset.grow_to(size)
+                cache.clear()  # The benchmark's own cache: every size starts cold
+                results[str(size)] = run_benchmark(requests=options["requests"])
+                self.report(size, results[str(size)])
+
+        if not options["baseline"]:
+            return
+        if options["save_baseline"]:
+            save_baseline(options["baseline"], results)
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['baseline']}."))
+            return
+        regressions = find_regressions(results, load_baseline(options["baseline"]), options["tolerance"])
+        if regressions:
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(regression))
+            raise CommandError(f"{len(regressions)} regression(s) against {options['baseline']}.")
+        self.stdout.write(self.style.SUCCESS("No regression against the baseline."))
+
+    def report(self, size, measurements):
+        self.stdout.write(f"\n{size} users")
+        self.stdout.write(f"{'scenario':<32}{'queries':>8}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}")
+        for name, result in measurements.items():
+            self.stdout.write(
+                f"{name:<32}{result['queries']:>8}{result['p50']:>10.2f}{result['p95']:>10.2f}{result['p99']:>10.2f}"
+            )
@@ -0,0 +1,113 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlencode, urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from accounts.models import UserProfile
+
+# Sync view -> async twin, compared side by side
+ENDPOINTS = [
+    ("active subscriptions", "api-active-subscriptions-url", "api-active-subscriptions-async-url"),
+    ("verify user id", "api-verify-user-id-url", "api-verify-user-id-async-url"),
+]
+
+
+async def _read_response(reader):
+    """
+    Reads one HTTP/1.1 response (Content-Length or chunked body) and returns its status code.
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by the server.")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    return status, headers.get("connection", "").lower() == "close"
+
+
+async def _client(host, port, path, deadline, latencies, errors):
+    reader = writer = None
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n".encode()
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            started = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, closed = await _read_response(reader)
+            latencies.append(time.perf_counter() - started)
+            if status >= 500:
+                errors.append(status)
+            if closed:
+                writer.close()
+                writer = None
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as exc:
+            errors.append(exc)
+            if writer is not None:
+                writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def _run(host, port, path, concurrency, duration):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, path, deadline, latencies, errors) for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-tests the external JSON APIs of a running server and compares the sync views with their "
+        "async twins (requests per second, p50 and p99 latency). Run the server under ASGI, e.g. "
+        "`uvicorn SubFlo.asgi:application`, to measure the async path without thread hops."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="Server to load-test.")
+        parser.add_argument("--user-id", help="Profile UUID to query (default: the first profile in the database).")
+        parser.add_argument("--concurrency", type=int, default=50, help="Concurrent keep-alive connections.")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds per endpoint.")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options["base_url"])
+        if url.scheme != "http":
+            raise CommandError("Only plain http:// servers are supported.")
+        user_id = options["user_id"] or UserProfile.objects.values_list("id", flat=True).first()
+        if user_id is None:
+            raise CommandError("No user profile found; pass --user-id.")
+        query = urlencode({"user_id": str(user_id)})
+
+        self.stdout.write(f"{'endpoint':<22}{'path':<7}{'req/s':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}{'errors':>8}")
+        for label, sync_name, async_name in ENDPOINTS:
+            for kind, name in (("sync", sync_name), ("async", async_name)):
+                path = f"{url.path.rstrip('/')}{reverse(name)}?{query}"
+                latencies, errors, elapsed = asyncio.run(
+                    _run(url.hostname, url.port or 80, path, options["concurrency"], options["duration"])
+                )
+                if len(latencies) > 1:
+                    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+                    p50, p99 = cuts[49] * 1000, cuts[98] * 1000
+                else:
+                    p50 = p99 = 0.0
+                self.stdout.write(
+                    f"{label:<22}{kind:<7}{len(latencies) / elapsed:>10.1f}{p50:>10.1f}{p99:>10.1f}{len(errors):>8}"
+                )
@@ -0,0 +1,170 @@
+# dashboard/pagination.py
+import base64
+import datetime
+import json
+import uuid
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+from django.db.models import F, Q
+from django.http import Http404
+from SubFlo.sharding import across_shards
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _cursor_value(value):
+    # Full precision on purpose: DjangoJSONEncoder would truncate datetimes to milliseconds
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return value.hex
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Unsupported cursor value: {value!r}")
+
+
+class KeysetPage:
+    """
+    One page of a keyset-paginated queryset.
+    `next_cursor` / `previous_cursor` are opaque tokens to pass back as `after` / `before`.
+    """
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Cursor-based paginator.
+    Instead of an OFFSET, every page continues from the ordering values of the last row of the previous
+    page, so fetching page 1000 costs the same as fetching page 1 when an index covers `ordering`.
+    `ordering` must end with a unique column (usually "-id") so that the order is total. It may name annotations
+    whose values JSON keeps exactly (numbers, strings).
+    NULLs follow SQLite's order: first in ascending columns, last in descending columns.
+    Querysets spanning several shards are read one page per shard and merged.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = [(name.lstrip("-"), name.startswith("-")) for name in ordering]
+        self.per_page = per_page
+
+    def _order_by(self, reverse):
+        expressions = []
+        for name, descending in self.ordering:
+            descending = descending != reverse
+            expressions.append(F(name).desc(nulls_last=True) if descending else F(name).asc(nulls_first=True))
+        return expressions
+
+    @staticmethod
+    def _value(row, name):
+        return row[name] if isinstance(row, dict) else getattr(row, name)
+
+    def _encode(self, row):
+        values = [self._value(row, name) for name, _ in self.ordering]
+        payload = json.dumps(values, default=_cursor_value, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def _decode(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            opts = self.queryset.model._meta
+            annotations = self.queryset.query.annotations
+            return [
+                value if value is None or name in annotations else opts.get_field(name).to_python(value)
+                for (name, _), value in zip(self.ordering, values)
+            ]
+        except Exception as exc:
+            raise InvalidCursor(cursor) from exc
+
+    @staticmethod
+    def _beyond(name, descending, value):
+        """Rows strictly past `value` in one column, or None when nothing can be."""
+        if descending:
+            if value is None:
+                return None
+            return Q(**{f"{name}__lt": value}) | Q(**{f"{name}__isnull": True})
+        if value is None:
+            return Q(**{f"{name}__isnull": False})
+        return Q(**{f"{name}__gt": value})
+
+    def _seek(self, values, reverse):
+        # (a, b, c) > (x, y, z)  <=>  a > x  OR  (a = x AND b > y)  OR  (a = x AND b = y AND c > z)
+        conditions = []
+        equal = Q()
+        for (name, descending), value in zip(self.ordering, values):
+            beyond = self._beyond(name, descending != reverse, value)
+            if beyond is not None:
+                conditions.append(equal & beyond)
+            equal &= Q(**{f"{name}__isnull": True}) if value is None else Q(**{name: value})
+        return reduce(or_, conditions) if conditions else Q(pk__in=[])
+
+    def _merge(self, rows, reverse):
+        # The pages of every shard, sorted like the database does: one stable sort per column, last column first
+        for name, descending in reversed(self.ordering):
+            rows.sort(key=lambda row: (self._value(row, name) is not None, self._value(row, name)),
+                      reverse=descending != reverse)
+        return rows
+
+    def page(self, after=None, before=None):
+        """
+        Returns the page following the `after` cursor, the one preceding the `before` cursor,
+        or the first page when neither is given.
+        """
+        reverse = bool(before) and not after
+        queryset = self.queryset
+        cursor = after or before
+        if cursor:
+            queryset = queryset.filter(self._seek(self._decode(cursor), reverse))
+        querysets = across_shards(queryset)
+        rows = [row for shard_queryset in querysets
+                for row in shard_queryset.order_by(*self._order_by(reverse))[:self.per_page + 1]]
+        if len(querysets) > 1:
+            rows = self._merge(rows, reverse)[:self.per_page + 1]
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+        if not rows:
+            return KeysetPage(rows, None, None)
+        more_after = has_more if not reverse else True
+        more_before = has_more if reverse else bool(cursor)
+        return KeysetPage(
+            rows,
+            self._encode(rows[-1]) if more_after else None,
+            self._encode(rows[0]) if more_before else None,
+        )
+
+
+def paginate_by_cursor(request, queryset, ordering, per_page):
+    """
+    Keyset-paginates `queryset` using the `after` / `before` GET parameters.
+    Raises Http404 on a malformed cursor, like Django's paginator does on an invalid page number.
+    """
+    paginator = KeysetPaginator(queryset, ordering, per_page)
+    try:
+        return paginator, paginator.page(after=request.GET.get("after"), before=request.GET.get("before"))
+    except InvalidCursor:
+        raise Http404("Invalid cursor.")
@@ -0,0 +1,129 @@
+# dashboard/summary.py
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from subscriptions.models import Subscription, ExchangeRate
+from subscriptions.signals import bulk_changed
+from subscriptions.spending import CENT, base_currency, exchange_rates
+from SubFlo.sharding import across_shards
+
+SUMMARY_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def summary_cache_key(user_id=None, day=None):
+    """
+    Cache key for the dashboard summary of one user (or of every user when `user_id` is None).
+    The day is part of the key because "active" and "expiring soon" depend on today's date.
+    """
+    day = day or timezone.now().date()
+    return f"dashboard:summary:{user_id or 'all'}:{day.isoformat()}"
+
+
+def compute_subscription_summary(user=None, today=None):
+    """
+    Computes every figure of the dashboard summary in a single conditional-aggregation query.
+    Rows are grouped by `payment_method` and `currency` so the payment breakdown (the price of every active,
+    non-trial subscription per payment method) comes out of the same scan; the counters are then added up
+    across the groups in Python.
+    Rows are counted on `already_canceled` (never NULL) rather than the primary key, so the scan stays
+    inside `subscription_summary_idx` and never reads the table.
+    Prices are converted to the base currency with the `ExchangeRate` table, which is only read when a price
+    is in another currency. Currencies without a rate are left out.
+    """
+    today = today or timezone.now().date()
+    soon = today + timedelta(days=getattr(settings, "EXPIRING_SOON_DAYS", 7))
+
+    active = Q(already_canceled=False) & (Q(end_date__isnull=True) | Q(end_date__gte=today))
+    active_paid = active & Q(is_trial=False)
+    # Renewing or ending within the window, from the stored `next_renewal_date`
+    expiring_soon = Q(already_canceled=False, next_renewal_date__gte=today, next_renewal_date__lte=soon)
+
+    # Through the user's related manager, so the query goes to the user's shard only
+    queryset = user.subscriptions.all() if user is not None else Subscription.objects.all()
+
+    counters = Counter()
+    costs = []
+    for shard_queryset in across_shards(queryset):
+        for group in shard_queryset.values("payment_method", "currency").annotate(
+            total=Count("already_canceled"),
+            active=Count("already_canceled", filter=active),
+            active_trial=Count("already_canceled", filter=active & Q(is_trial=True)),
+            active_paid=Count("already_canceled", filter=active_paid),
+            soon_to_expire=Count("already_canceled", filter=expiring_soon),
+            total_cost=Sum("price", filter=active_paid),
+        ).order_by():
+            counters.update({name: group[name] for name in ("total", "active", "active_trial", "soon_to_expire")})
+            if group["active_paid"]:
+                costs.append(group)
+
+    rates = exchange_rates({group["currency"] for group in costs})
+    breakdown = {}
+    for group in costs:
+        total = breakdown.setdefault(group["payment_method"], None)
+        if group["total_cost"] is not None and group["currency"] in rates:
+            breakdown[group["payment_method"]] = (total or 0) + group["total_cost"] * rates[group["currency"]]
+
+    return {
+        "total_subscriptions": counters["total"],
+        "total_active_subscriptions": counters["active"],
+        "total_active_trial_subscriptions": counters["active_trial"],
+        "total_soon_to_expire_subscriptions": counters["soon_to_expire"],
+        # Credit/Debit card, PayPal, etc. (only methods that pay for an active, non-trial subscription)
+        "total_cost_per_payment_method": [
+            {"payment_method": method, "total_cost": total.quantize(CENT) if total is not None else None}
+            for method, total in sorted(breakdown.items(), key=lambda item: item[0] or "")
+        ],
+        "base_currency": base_currency(),
+    }
+
+
+def get_subscription_summary(user=None):
+    """
+    Returns the dashboard summary from the per-user cache, computing it on a miss.
+    A miss costs one aggregate query (and one exchange rate query with prices in foreign currencies), a hit
+    costs none.
+    """
+    today = timezone.now().date()
+    key = summary_cache_key(getattr(user, "pk", None), today)
+    summary = cache.get(key)
+    if summary is None:
+        summary = compute_subscription_summary(user=user, today=today)
+        cache.set(key, summary, SUMMARY_CACHE_TIMEOUT)
+    return summary
+
+
+def invalidate_subscription_summary(user_id):
+    """
+    Drops the cached summary of `user_id` and the all-users summary that includes it.
+    """
+    cache.delete_many([summary_cache_key(user_id), summary_cache_key()])
+
+
+# Signals to keep the cached summary in sync with `Subscription` writes
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_summary_on_subscription_change(sender, instance, **kwargs):
+    invalidate_subscription_summary(instance.user_id)
+
+
+@receiver(bulk_changed)
+def invalidate_summary_on_bulk_change(sender, model, user_ids, **kwargs):
+    if model is Subscription:
+        for user_id in user_ids:
+            invalidate_subscription_summary(user_id)
+
+
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+def invalidate_summary_on_rate_change(sender, instance, **kwargs):
+    # The payment breakdown of everyone paying in this currency is converted differently now
+    rows = Subscription.objects.filter(currency=instance.currency).values_list("user_id", flat=True).order_by().distinct()
+    user_ids = {user_id for queryset in across_shards(rows) for user_id in queryset}
+    for user_id in user_ids:
+        invalidate_subscription_summary(user_id)
+    cache.delete(summary_cache_key())
@@ -1,3 +1,772 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import re
+import tempfile
+import uuid
+from datetime import timedelta
+from unittest import mock
+from decimal import Decimal
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.db.models import Q, Sum
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import parse_http_date
+from SubFlo.db import PrimaryReplicaRouter, ReplicaReadsMiddleware, reads_from
+from SubFlo.metrics import registry
+from accounts.verification import profile_verifier
+from subscriptions.models import Subscription, EmailMessage, ExchangeRate
+from subscriptions.synthetic import SyntheticDataset
+from subscriptions.signals import bulk_changed
+from dashboard.benchmark import find_regressions, run_benchmark
+from dashboard.pagination import KeysetPaginator
+from dashboard.summary import compute_subscription_summary, get_subscription_summary
+from dashboard.views import SubscriptionList
 
-# Create your tests here.
+
+class SubscriptionSummaryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="alice")
+        today = timezone.now().date()
+        Subscription.objects.create(user=self.user, platform_name="Netflix", service_name="Premium",
+                                    end_date=today + timedelta(days=3), price=Decimal("15.49"), payment_method="Visa")
+        Subscription.objects.create(user=self.user, platform_name="Spotify", service_name="Family",
+                                    end_date=today + timedelta(days=30), price=Decimal("16.99"), payment_method="Visa")
+        Subscription.objects.create(user=self.user, platform_name="Disney+", service_name="Basic",
+                                    end_date=today + timedelta(days=30), price=Decimal("7.99"), payment_method="PayPal",
+                                    is_trial=True)
+        Subscription.objects.create(user=self.user, platform_name="Hulu", service_name="Basic",
+                                    end_date=today - timedelta(days=1), price=Decimal("7.99"), payment_method="PayPal")
+
+    def test_summary_figures(self):
+        summary = get_subscription_summary(self.user)
+        self.assertEqual(summary["total_subscriptions"], 4)
+        self.assertEqual(summary["total_active_subscriptions"], 3)
+        self.assertEqual(summary["total_active_trial_subscriptions"], 1)
+        self.assertEqual(summary["total_soon_to_expire_subscriptions"], 1)
+        self.assertEqual(
+            summary["total_cost_per_payment_method"],
+            [{"payment_method": "Visa", "total_cost": Decimal("32.48")}],
+        )
+
+    def test_payment_breakdown_matches_the_live_sum(self):
+        # The breakdown as it was computed before prices were converted: the price of every active, non-trial
+        # subscription summed per payment method. With a single currency both must agree.
+        def live_sum(queryset, today):
+            active_paid = Q(already_canceled=False, is_trial=False) & (Q(end_date__isnull=True) | Q(end_date__gte=today))
+            return [
+                {"payment_method": group["payment_method"], "total_cost": group["total_cost"]}
+                for group in queryset.filter(active_paid).values("payment_method")
+                .annotate(total_cost=Sum("price")).order_by("payment_method")
+            ]
+
+        SyntheticDataset(subscriptions_per_user=20, emails_per_user=0, seed=3).grow_to(5)
+        Subscription.objects.update(currency="USD")
+        today = timezone.now().date()
+        for user in [None, self.user, *SyntheticDataset.users()]:
+            queryset = Subscription.objects.filter(user=user) if user else Subscription.objects.all()
+            with self.subTest(user=user):
+                self.assertEqual(compute_subscription_summary(user, today)["total_cost_per_payment_method"],
+                                 live_sum(queryset, today))
+
+    def test_payment_breakdown_is_converted(self):
+        ExchangeRate.objects.create(currency="EUR", rate=Decimal("1.10"))
+        Subscription.objects.create(user=self.user, platform_name="Deezer", service_name="Premium", currency="EUR",
+                                    price=Decimal("10.00"), payment_method="PayPal")
+        Subscription.objects.create(user=self.user, platform_name="Canal+", service_name="Basic", currency="XOF",
+                                    price=Decimal("5000"), payment_method="PayPal")
+        self.assertEqual(
+            compute_subscription_summary(self.user)["total_cost_per_payment_method"],
+            [{"payment_method": "PayPal", "total_cost": Decimal("11.00")},
+             {"payment_method": "Visa", "total_cost": Decimal("32.48")}],
+        )
+
+    def test_summary_is_one_query_then_cached(self):
+        # Every price is in the base currency: no exchange rate to read
+        with self.assertNumQueries(1):
+            get_subscription_summary(self.user)
+        with self.assertNumQueries(0):
+            get_subscription_summary(self.user)
+
+    def test_summary_invalidated_on_save_and_delete(self):
+        get_subscription_summary(self.user)
+        subscription = Subscription.objects.create(user=self.user, platform_name="YouTube", service_name="Premium",
+                                                   price=Decimal("13.99"), payment_method="PayPal")
+        with self.assertNumQueries(1):
+            self.assertEqual(get_subscription_summary(self.user)["total_active_subscriptions"], 4)
+        subscription.delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_subscription_summary(self.user)["total_active_subscriptions"], 3)
+
+    def test_dashboard_refresh_query_count(self):
+        url = reverse("subscription-list-url")
+        # Subscription list + one aggregate query for the summary
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.context["total_active_subscriptions"], 3)
+        # Summary served from the cache
+        with self.assertNumQueries(1):
+            self.client.get(url)
+
+    def test_dashboard_search(self):
+        response = self.client.get(reverse("subscription-list-url"), {"q": "netf"})
+        self.assertEqual([sub.platform_name for sub in response.context["subscriptions"]], ["Netflix"])
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice")
+        today = timezone.now().date()
+        # Ties and NULL dates on purpose, to exercise every branch of the seek condition
+        for i in range(23):
+            end_date = None if i % 5 == 0 else today + timedelta(days=i % 4)
+            start_date = None if i % 3 == 0 else today - timedelta(days=i % 2)
+            Subscription.objects.create(user=self.user, platform_name=f"Platform {i}", service_name="Plan", notes="monthly plan",
+                                        start_date=start_date, end_date=end_date)
+        self.ordering = ("-end_date", "-start_date", "-id")
+        self.expected = list(
+            Subscription.objects.order_by("-end_date", "-start_date", "-id").values_list("pk", flat=True)
+        )
+
+    def test_walks_forward_and_backward(self):
+        paginator = KeysetPaginator(Subscription.objects.all(), self.ordering, per_page=5)
+        pages, page = [], paginator.page()
+        self.assertFalse(page.has_previous())
+        while True:
+            pages.append([sub.pk for sub in page])
+            if not page.has_next():
+                break
+            page = paginator.page(after=page.next_cursor)
+        self.assertEqual([pk for ids in pages for pk in ids], self.expected)
+        self.assertEqual(len(pages), 5)
+
+        # And back again from the last page
+        for ids in reversed(pages[:-1]):
+            page = paginator.page(before=page.previous_cursor)
+            self.assertEqual([sub.pk for sub in page], ids)
+        self.assertFalse(page.has_previous())
+
+    def test_page_cost_is_constant(self):
+        paginator = KeysetPaginator(Subscription.objects.all(), self.ordering, per_page=5)
+        page = paginator.page()
+        while page.has_next():
+            with self.assertNumQueries(1):
+                page = paginator.page(after=page.next_cursor)
+
+    def test_views_paginate_search_results(self):
+        url = reverse("subscription-list-url")
+        response = self.client.get(url, {"q": "platform"})
+        self.assertEqual(len(response.context["subscriptions"]), 23)
+        self.assertFalse(response.context["is_paginated"])
+
+        # Every note matches equally well: ties are listed by primary key
+        ranked = sorted(self.expected, reverse=True)
+        with mock.patch.object(SubscriptionList, "paginate_by", 10):
+            response = self.client.post(url, {"text": "plan"})
+            page = response.context["page_obj"]
+            self.assertEqual([sub.pk for sub in page], ranked[:10])
+            response = self.client.get(url, {"text": "plan", "after": page.next_cursor})
+            self.assertEqual([sub.pk for sub in response.context["subscriptions"]], ranked[10:20])
+
+    def test_views_list_the_best_matches_first(self):
+        for i in range(1, 6):
+            Subscription.objects.create(user=self.user, platform_name="Netflix", service_name=" ".join(["Netflix"] * i))
+            EmailMessage.objects.create(user=self.user, subject=" ".join(["Renewal"] * i), sender="billing@example.com",
+                                        received_date=timezone.now() - timedelta(days=i), raw_email_body="...")
+        url = reverse("subscription-list-url")
+        with mock.patch.object(SubscriptionList, "paginate_by", 2):
+            pages = [self.client.get(url, {"q": "netflix"}).context["page_obj"]]
+            while pages[-1].has_next():
+                pages.append(self.client.get(url, {"q": "netflix", "after": pages[-1].next_cursor}).context["page_obj"])
+        self.assertEqual([sub.service_name.count("Netflix") for page in pages for sub in page], [5, 4, 3, 2, 1])
+        previous = self.client.get(url, {"q": "netflix", "before": pages[1].previous_cursor}).context["page_obj"]
+        self.assertEqual([sub.pk for sub in previous], [sub.pk for sub in pages[0]])
+
+        # The most repeated subject is the best match, although it is the oldest email
+        response = self.client.get(reverse("email_message_list-url"), {"q": "renewal"})
+        self.assertEqual([email["subject"].count("Renewal") for email in response.context["page_obj"]], [5, 4, 3, 2, 1])
+
+    def test_email_list_pagination(self):
+        now = timezone.now()
+        for i in range(60):
+            EmailMessage.objects.create(user=self.user, subject=f"Receipt {i}", sender="billing@example.com",
+                                        received_date=now - timedelta(minutes=i), raw_email_body="...")
+        url = reverse("email_message_list-url")
+        response = self.client.get(url)
+        page = response.context["page_obj"]
+        self.assertEqual([email["subject"] for email in page][:2], ["Receipt 0", "Receipt 1"])
+        self.assertEqual(len(page), 50)
+        response = self.client.get(url, {"after": page.next_cursor})
+        self.assertEqual([email["subject"] for email in response.context["page_obj"]],
+                         [f"Receipt {i}" for i in range(50, 60)])
+        self.assertEqual(self.client.get(url, {"after": "not-a-cursor"}).status_code, 404)
+
+
+class ActiveSubscriptionsApiTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice")
+        self.profile_id = str(self.user.profile.id)
+        today = timezone.now().date()
+        self.netflix = Subscription.objects.create(user=self.user, platform_name="Netflix", service_name="Premium",
+                                                   end_date=today + timedelta(days=3), price=Decimal("15.49"))
+        Subscription.objects.create(user=self.user, platform_name="Hulu", service_name="Basic",
+                                    end_date=today - timedelta(days=1))
+        Subscription.objects.create(user=self.user, platform_name="Spotify", service_name="Family",
+                                    already_canceled=True)
+        self.url = reverse("api-active-subscriptions-url")
+
+    def get(self, **headers):
+        return self.client.get(self.url, {"user_id": self.profile_id}, headers=headers)
+
+    def test_streams_active_subscriptions(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        data = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(data["user_id"], self.profile_id)
+        self.assertEqual(data["num_active_subscriptions"], 1)
+        self.assertEqual(data["subscriptions"][0]["id"], str(self.netflix.pk))
+        self.assertEqual(data["subscriptions"][0]["price"], "15.49")
+        self.assertNotIn("user", data["subscriptions"][0])
+        self.assertIn("ETag", response)
+        self.assertIn("Last-Modified", response)
+
+    def test_not_modified_without_serializing_rows(self):
+        etag = self.get()["ETag"]
+        # Version aggregate only: no row query, and the profile comes from the verifier's cache
+        with self.assertNumQueries(1):
+            response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        self.netflix.price = Decimal("17.99")
+        self.netflix.save()
+        self.assertEqual(self.get(if_none_match=etag).status_code, 200)
+
+    def test_not_modified_since_only_until_midnight(self):
+        Subscription.objects.filter(user=self.user).update(updated_at=timezone.now() - timedelta(days=5))
+        last_modified = self.get()["Last-Modified"]
+        self.assertEqual(self.get(if_modified_since=last_modified).status_code, 304)
+
+        # No row changed, but the next day the payload may not be the same (subscriptions expired overnight)
+        tomorrow = timezone.now() + timedelta(days=1)
+        with mock.patch("django.utils.timezone.now", return_value=tomorrow):
+            response = self.get(if_modified_since=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(parse_http_date(response["Last-Modified"]), parse_http_date(last_modified))
+
+    def test_invalid_user_id(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"user_id": "not-a-uuid"}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {"user_id": "0" * 32}).status_code, 404)
+
+
+class SpendingHistoryApiTests(TestCase):
+
+    def test_reads_only_the_rollup(self):
+        user = User.objects.create_user(username="alice")
+        ExchangeRate.objects.create(currency="EUR", rate=Decimal("1.10"))
+        today = timezone.now().date()
+        Subscription.objects.create(user=user, platform_name="Netflix", service_name="Premium", start_date=today,
+                                    price=Decimal("15.49"), payment_method="Visa")
+        Subscription.objects.create(user=user, platform_name="Spotify", service_name="Family", start_date=today,
+                                    price=Decimal("10.00"), currency="EUR", payment_method="Visa")
+        url = reverse("api-spending-history-url")
+        profile_verifier.resolve(user.profile.id)
+
+        # Rollup rows only (the profile id is cached)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {"user_id": str(user.profile.id), "months": 3})
+        data = json.loads(response.content)
+        self.assertEqual(data["base_currency"], "USD")
+        self.assertEqual(data["months"], [{
+            "month": today.strftime("%Y-%m"), "total": "26.49", "subscriptions": 2,
+            "by_payment_method": {"Visa": "26.49"}, "by_currency": {"EUR": "10.00", "USD": "15.49"},
+            "unconverted_currencies": [],
+        }])
+        self.assertEqual(self.client.get(url, {"user_id": str(user.profile.id), "months": 0}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"user_id": "0" * 32}).status_code, 404)
+
+
+class ExportApiTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice")
+        self.bob = User.objects.create_user(username="bob")
+        self.profile_id = str(self.alice.profile.id)
+        now = timezone.now()
+        for n in range(30):
+            email = EmailMessage.objects.create(user=self.alice, subject=f"Receipt {n}", sender="info@netflix.com",
+                                                received_date=now - timedelta(days=n), raw_email_body="...",
+                                                parsed_data={"is_subscription": True, "n": n})
+            Subscription.objects.create(user=self.alice, platform_name="Netflix", service_name="Premium",
+                                        start_date=now.date() - timedelta(days=n), email_message_id=email,
+                                        price=Decimal("9.99"))
+        Subscription.objects.create(user=self.bob, platform_name="Spotify", service_name="Family")
+        self.url = reverse("api-export-subscriptions-url")
+
+    def export(self, url=None, **params):
+        response = self.client.get(url or self.url, {"user_id": self.profile_id, **params})
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content)
+
+    def test_csv_export_is_streamed_in_chunks(self):
+        with mock.patch("subscriptions.exports.FLUSH_SIZE", 512):
+            response = self.client.get(self.url, {"user_id": self.profile_id})
+            chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 3)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertIn('filename="subscriptions.csv"', response["Content-Disposition"])
+        rows = list(csv.DictReader(b"".join(chunks).decode().splitlines()))
+        self.assertEqual(len(rows), 30)
+        self.assertNotIn("user_id", rows[0])  # Single-user exports do not leak the internal id
+        self.assertEqual((rows[0]["price"], rows[0]["is_trial"]), ("9.99", "false"))
+
+    async def test_asgi_export_is_streamed_in_chunks(self):
+        with mock.patch("subscriptions.exports.FLUSH_SIZE", 512):
+            response = await self.async_client.get(self.url, {"user_id": self.profile_id})
+            # A sync iterator would be collected into one list by the ASGI handler before sending
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+        self.assertGreater(len(chunks), 3)
+        self.assertEqual(len(list(csv.DictReader(b"".join(chunks).decode().splitlines()))), 30)
+
+    def test_ndjson_filters_and_parsed_data(self):
+        today = timezone.now().date()
+        _, content = self.export(reverse("api-export-emails-url"), format="ndjson", parsed_data="1",
+                                 **{"from": (today - timedelta(days=4)).isoformat()})
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]["parsed_data"]["is_subscription"], True)
+
+        # Incremental: only what was written after the previous export
+        since = Subscription.objects.order_by("-updated_at").values_list("updated_at", flat=True).first()
+        Subscription.objects.filter(start_date=today).update(notes="Family plan now", updated_at=since + timedelta(seconds=1))
+        _, content = self.export(format="ndjson", since=since.isoformat())
+        self.assertEqual([json.loads(line)["notes"] for line in content.decode().splitlines()], ["Family plan now"])
+
+    def test_gzip_export(self):
+        response, content = self.export(compress="gzip")
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertIn('filename="subscriptions.csv.gz"', response["Content-Disposition"])
+        self.assertEqual(gzip.decompress(content), self.export()[1])
+
+    def test_parameters_and_access(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"user_id": self.profile_id, "format": "xml"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"user_id": self.profile_id, "from": "yesterday"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"user_id": "0" * 32}).status_code, 404)
+
+        self.client.force_login(User.objects.create_user(username="analyst", is_staff=True))
+        rows = list(csv.DictReader(b"".join(self.client.get(self.url).streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 31)
+        self.assertEqual({row["user_id"] for row in rows}, {str(self.alice.pk), str(self.bob.pk)})
+
+
+class BatchActiveSubscriptionsApiTests(TestCase):
+
+    def setUp(self):
+        today = timezone.now().date()
+        self.alice = User.objects.create_user(username="alice")
+        self.bob = User.objects.create_user(username="bob")
+        self.carol = User.objects.create_user(username="carol")
+        for user, platform in ((self.alice, "Netflix"), (self.alice, "Hulu"), (self.bob, "Spotify")):
+            Subscription.objects.create(user=user, platform_name=platform, service_name="Premium",
+                                        end_date=today + timedelta(days=3), price=Decimal("9.99"))
+        Subscription.objects.create(user=self.carol, platform_name="Max", service_name="Basic", already_canceled=True)
+        self.url = reverse("api-batch-active-subscriptions-url")
+        self.ids = [str(user.profile.id) for user in (self.alice, self.bob, self.carol)]
+
+    def test_one_query_for_many_users(self):
+        profile_verifier.resolve(self.ids[0])
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {"user_ids": ",".join(self.ids), "fields": "platform_name,price"})
+        self.assertEqual(response.status_code, 200)
+        users = json.loads(response.content)["users"]
+        self.assertEqual(users[self.ids[0]]["num_active_subscriptions"], 2)
+        self.assertEqual(users[self.ids[1]]["subscriptions"], [{"platform_name": "Spotify", "price": "9.99"}])
+        self.assertEqual(users[self.ids[2]], {"subscriptions": [], "num_active_subscriptions": 0})
+
+    def test_post_body_and_invalid_ids(self):
+        missing = "0" * 32
+        response = self.client.post(self.url, {"user_ids": [self.ids[0], missing, "bogus"]},
+                                    content_type="application/json")
+        data = json.loads(response.content)
+        self.assertEqual(list(data["users"]), [self.ids[0]])
+        self.assertEqual(sorted(data["invalid_user_ids"]), sorted(["bogus", str(uuid.UUID(missing))]))
+        self.assertIn("email_message_id", data["users"][self.ids[0]]["subscriptions"][0])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"user_ids": self.ids[0], "fields": "user"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"user_ids": self.ids[0]}, headers={"accept": "text/csv"}).status_code, 406)
+        for body in ("[]", '"x"', "42", "null", "{", '{"user_ids": "abc"}'):
+            with self.subTest(body=body):
+                self.assertEqual(self.client.post(self.url, body, content_type="application/json").status_code, 400)
+
+    def test_msgpack(self):
+        from dashboard import encoders
+        if encoders.msgpack is None:
+            self.skipTest("msgpack is not installed")
+        response = self.client.get(self.url, {"user_ids": self.ids[1]}, headers={"accept": "application/msgpack"})
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        users = encoders.msgpack.unpackb(response.content)["users"]
+        self.assertEqual(users[self.ids[1]]["num_active_subscriptions"], 1)
+
+
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username="alice")
+        self.bob = User.objects.create_user(username="bob")
+        self.email = EmailMessage.objects.create(user=self.alice, subject="Netflix receipt", sender="info@netflix.com",
+                                                 received_date=timezone.now(), raw_email_body="...")
+        self.subscription = Subscription.objects.create(user=self.alice, platform_name="Netflix",
+                                                        service_name="Premium", price=Decimal("9.99"),
+                                                        email_message_id=self.email)
+
+    def test_pages_are_served_from_cache_until_their_data_changes(self):
+        url = reverse("email_message_list-url")
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).content, first.content)
+
+        EmailMessage.objects.create(user=self.bob, subject="Spotify receipt", sender="info@spotify.com",
+                                    received_date=timezone.now(), raw_email_body="...")
+        self.assertContains(self.client.get(url), "Spotify receipt")
+
+    def test_pages_are_not_served_the_next_day(self):
+        url = reverse("email_message_list-url")
+        self.client.get(url)
+        tomorrow = timezone.now() + timedelta(days=1)
+        with mock.patch("django.utils.timezone.now", return_value=tomorrow), \
+                CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertTrue(queries.captured_queries)
+
+    def test_detail_pages_only_depend_on_their_owner(self):
+        url = self.subscription.get_absolute_url()
+        self.client.get(url)
+        Subscription.objects.create(user=self.bob, platform_name="Hulu", service_name="Basic")
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        bulk_changed.send(sender=None, model=Subscription, user_ids={self.alice.pk})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertTrue(queries.captured_queries)
+
+    def test_pages_with_a_csrf_token_need_the_visitor_cookie(self):
+        url = reverse("subscription-list-url")
+        first = self.client.get(url)  # no cookie yet: rendered with a new one, not cached
+        self.assertIn(settings.CSRF_COOKIE_NAME, self.client.cookies)
+        self.assertIsNotNone(self.client.get(url).context)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertIsNone(second.context)
+        self.assertContains(second, "Netflix")
+        self.assertNotEqual(first.content, second.content)
+
+    def test_summary_fragment_is_cached_per_version(self):
+        url = reverse("subscription-list-url")
+        self.client.get(url)
+        with mock.patch("dashboard.views.get_subscription_summary", return_value={}):
+            response = self.client.get(url, {"q": "netflix"})
+        # The fragment rendered by the first request is reused, although the figures were not computed again
+        self.assertContains(response, "Payment Breakdown")
+
+    @override_settings(MIDDLEWARE=["SubFlo.compression.CompressionMiddleware", *settings.MIDDLEWARE])
+    def test_responses_are_compressed(self):
+        response = self.client.get(reverse("email_message_list-url"), headers={"accept-encoding": "gzip"})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+
+class QueryPlanTests(TestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every query issued by the dashboard pages and the external APIs,
+    and fails when one of them scans a table or a whole index instead of searching an index.
+    """
+
+    # Every SCAN step fails the test unless it is one of these, or an exception the test grants explicitly
+    ALLOWED_SCANS = [
+        # Full-text MATCH lookups: the FTS5 module searches its own index
+        re.compile(r"^SCAN \w+_fts VIRTUAL TABLE INDEX \d+:M"),
+    ]
+    # Explicit exception for the summary query only: the all-users counters aggregate every row by definition,
+    # and read them from the narrow covering index rather than from the table
+    SUMMARY_SCAN = re.compile(r"^SCAN subscriptions_subscription USING COVERING INDEX subscription_summary_idx$")
+    # Listing pages walk their ordering index and stop after one page. Only allowed for the page query of an
+    # unfiltered listing (see `page_scan`): any other condition could make the walk cover the whole index
+    PAGE_SCANS = {
+        "subscriptions_subscription": (re.compile(r"^SCAN subscriptions_subscription USING INDEX subscription_listing_idx$"),
+                                       {"end_date", "start_date", "id"}),
+        "subscriptions_emailmessage": (re.compile(r"^SCAN subscriptions_emailmessage USING INDEX emailmessage_listing_idx$"),
+                                       {"received_date", "id"}),
+    }
+    PAGE_QUERY = re.compile(r' FROM "(\w+)"(?: WHERE (.*?))? ORDER BY .* LIMIT \d+$')
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="alice")
+        today = timezone.now().date()
+        for i in range(60):
+            email = EmailMessage.objects.create(user=self.user, subject=f"Receipt {i}", sender="info@netflix.com",
+                                                received_date=timezone.now() - timedelta(days=i), raw_email_body="...")
+            Subscription.objects.create(user=self.user, platform_name=f"Netflix {i}", service_name="Premium",
+                                        end_date=today + timedelta(days=i - 10), email_message_id=email,
+                                        price=Decimal("9.99"), payment_method="Visa")
+        self.email = email
+        self.subscription = Subscription.objects.first()
+
+    def page_scan(self, sql):
+        """
+        Returns the scan pattern allowed in `sql` when it is the page query of an unfiltered listing: a single
+        table, ordered and limited, whose only condition is the keyset seek on the columns of its ordering.
+        """
+        match = self.PAGE_QUERY.search(sql)
+        if match is None or match.group(1) not in self.PAGE_SCANS:
+            return None
+        pattern, columns = self.PAGE_SCANS[match.group(1)]
+        where = match.group(2) or ""
+        if "SELECT" in where or set(re.findall(r'"(\w+)"\."(\w+)"', where)) - {(match.group(1), column) for column in columns}:
+            return None
+        return pattern
+
+    def assertNoFullScan(self, request, allowed=()):
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        self.assertTrue(queries.captured_queries)
+        for query in queries.captured_queries:
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                plan = [row[3] for row in cursor.fetchall()]
+            patterns = [*self.ALLOWED_SCANS, *allowed, self.page_scan(query["sql"])]
+            for step in plan:
+                if step.startswith("SCAN"):
+                    self.assertTrue(any(pattern and pattern.match(step) for pattern in patterns),
+                                    f"Scan ({step}) in: {query['sql']}")
+        return response
+
+    def test_dashboard_queries(self):
+        url = reverse("subscription-list-url")
+        # The first request computes the all-users summary
+        self.assertNoFullScan(lambda: self.client.get(url), allowed=[self.SUMMARY_SCAN])
+        cursor = self.client.get(url).context["page_obj"].next_cursor
+        self.assertNoFullScan(lambda: self.client.get(url, {"after": cursor}))
+        self.assertNoFullScan(lambda: self.client.get(url, {"before": cursor}))
+        self.assertNoFullScan(lambda: self.client.get(url, {"q": "netflix"}))
+        self.assertNoFullScan(lambda: self.client.post(url, {"text": "premium"}))
+        self.assertNoFullScan(lambda: self.client.get(self.subscription.get_absolute_url()))
+
+    def test_summary_queries(self):
+        self.assertNoFullScan(lambda: compute_subscription_summary(), allowed=[self.SUMMARY_SCAN])
+        self.assertNoFullScan(lambda: compute_subscription_summary(self.user))
+
+    def test_email_queries(self):
+        url = reverse("email_message_list-url")
+        cursor = self.assertNoFullScan(lambda: self.client.get(url)).context["page_obj"].next_cursor
+        self.assertNoFullScan(lambda: self.client.get(url, {"after": cursor}))
+        self.assertNoFullScan(lambda: self.client.get(url, {"q": "receipt"}))
+        self.assertNoFullScan(lambda: self.client.get(reverse("email_message_detail-url", args=[self.email.pk])))
+
+    def test_api_queries(self):
+        profile_id = str(self.user.profile.id)
+        url = reverse("api-active-subscriptions-url")
+        profile_verifier.resolve(profile_id)  # building the bloom filter reads every profile, once per process
+        self.assertNoFullScan(lambda: b"".join(self.client.get(url, {"user_id": profile_id}).streaming_content))
+        profile_verifier.cache.clear()
+        self.assertNoFullScan(lambda: self.client.get(reverse("api-verify-user-id-url"), {"user_id": profile_id}))
+        self.assertNoFullScan(lambda: self.client.get(reverse("api-batch-active-subscriptions-url"),
+                                                      {"user_ids": profile_id}))
+        self.assertNoFullScan(lambda: self.client.get(reverse("api-spending-history-url"), {"user_id": profile_id}))
+
+
+class AsyncApiTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice")
+        self.profile_id = str(self.user.profile.id)
+        Subscription.objects.create(user=self.user, platform_name="Netflix", service_name="Premium")
+
+    async def test_async_active_subscriptions_matches_sync(self):
+        url = reverse("api-active-subscriptions-url")
+        sync_response = await self.async_client.get(url, {"user_id": self.profile_id})
+        response = await self.async_client.get(reverse("api-active-subscriptions-async-url"), {"user_id": self.profile_id})
+        self.assertEqual(response.status_code, 200)
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(json.loads(content)["num_active_subscriptions"], 1)
+        self.assertEqual(response["ETag"], sync_response["ETag"])
+
+        not_modified = await self.async_client.get(reverse("api-active-subscriptions-async-url"),
+                                                   {"user_id": self.profile_id}, headers={"if-none-match": response["ETag"]})
+        self.assertEqual(not_modified.status_code, 304)
+
+    async def test_async_verify_user_id(self):
+        url = reverse("api-verify-user-id-async-url")
+        self.assertEqual((await self.async_client.get(url, {"user_id": self.profile_id})).status_code, 200)
+        self.assertEqual((await self.async_client.get(url, {"user_id": "0" * 32})).status_code, 404)
+        self.assertEqual((await self.async_client.get(url, {"user_id": "bogus"})).status_code, 404)
+        self.assertEqual((await self.async_client.get(url)).status_code, 400)
+
+
+class BenchmarkTests(TestCase):
+
+    def test_measures_every_scenario(self):
+        SyntheticDataset(subscriptions_per_user=3, emails_per_user=3).grow_to(2)
+        results = run_benchmark(requests=2, warmup=0)
+        self.assertIn("subscription_list_post_search", results)
+        self.assertIn("api_batch_active_subscriptions", results)
+        for result in results.values():
+            self.assertLessEqual(result["p50"], result["p99"])
+        self.assertGreater(results["subscription_list"]["queries"], 0)
+        self.assertEqual(results["api_verify_user_id"]["queries"], 0)
+
+    def test_find_regressions(self):
+        baseline = {"100": {"subscription_list": {"p50": 10.0, "p95": 12.0, "p99": 15.0, "queries": 2}}}
+        same = {"100": {"subscription_list": {"p50": 10.5, "p95": 12.4, "p99": 15.2, "queries": 2}}}
+        self.assertEqual(find_regressions(same, baseline), [])
+        slower = {"100": {"subscription_list": {"p50": 20.0, "p95": 12.0, "p99": 15.0, "queries": 3}}}
+        self.assertEqual(len(find_regressions(slower, baseline)), 2)
+        self.assertEqual(find_regressions({"1000": slower["100"]}, baseline), [])
+
+
+@override_settings(METRICS_TOKEN="scraper-token")
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice")
+        Subscription.objects.create(user=self.user, platform_name="Netflix", service_name="Premium")
+        profile_verifier.resolve(self.user.profile.id)
+        registry.reset()
+
+    def test_records_latency_and_queries_per_view(self):
+        self.client.get(reverse("subscription-list-url"))
+        self.client.get(reverse("email_message_list-url"))
+        b"".join(self.client.get(reverse("api-active-subscriptions-url"),
+                                 {"user_id": str(self.user.profile.id)}).streaming_content)
+
+        snapshot = registry.snapshot()["histograms"]
+        self.assertEqual(set(key.split("\0")[0] for key in snapshot),
+                         {"subscription-list-url", "email_message_list-url", "api-active-subscriptions-url"})
+        # Version aggregate + the rows streamed after the view returned (the profile id is cached)
+        api = snapshot["api-active-subscriptions-url\0GET"]
+        self.assertEqual(api[1][-1], 2)
+
+        body = self.client.get(reverse("metrics-url"), headers={"authorization": "Bearer scraper-token"}).content.decode()
+        self.assertIn('subflo_request_duration_seconds_count{view="subscription-list-url",method="GET"} 1', body)
+        self.assertIn('subflo_request_db_queries_bucket{view="api-active-subscriptions-url",method="GET",le="5"} 1', body)
+        self.assertIn("# TYPE subflo_request_db_duration_seconds histogram", body)
+        self.assertNotIn('view="metrics-url"', body)
+
+    async def test_records_async_views(self):
+        await self.async_client.get(reverse("api-verify-user-id-async-url"), {"user_id": str(self.user.profile.id)})
+        self.assertIn("api-verify-user-id-async-url\0GET", registry.snapshot()["histograms"])
+
+    def test_middleware_stack_stays_async(self):
+        # A sync-only middleware makes Django run every ASGI request in a thread, logging the adaptation (in DEBUG)
+        stack = ["SubFlo.metrics.MetricsMiddleware", "SubFlo.compression.CompressionMiddleware",
+                 "SubFlo.db.ReplicaReadsMiddleware", *settings.MIDDLEWARE[1:]]
+        with override_settings(MIDDLEWARE=stack, DEBUG=True), self.assertNoLogs("django.request", "DEBUG"):
+            ASGIHandler()
+
+    def test_merges_snapshots_of_live_processes(self):
+        registry.observe("subscription-list-url", "GET", 0.02, 3, 0.001)
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            # Another live worker (our parent process) and a worker that has exited
+            for pid in (os.getppid(), 2 ** 22 + 1):
+                (registry.directory() / f"metrics-{pid}.json").write_text(json.dumps(registry.snapshot()))
+            body = registry.render()
+            self.assertIn('subflo_request_duration_seconds_count{view="subscription-list-url",method="GET"} 2', body)
+            self.assertFalse((registry.directory() / f"metrics-{2 ** 22 + 1}.json").exists())
+
+    def test_endpoint_is_internal(self):
+        url = reverse("metrics-url")
+        # Behind the reverse proxy every request comes from 127.0.0.1: the address proves nothing
+        self.assertEqual(self.client.get(url, REMOTE_ADDR="127.0.0.1").status_code, 403)
+        self.assertEqual(self.client.get(url, headers={"authorization": "Bearer wrong"}).status_code, 403)
+        self.assertEqual(self.client.get(url, headers={"authorization": "Bearer scraper-token"}).status_code, 200)
+        with override_settings(METRICS_TOKEN=""):
+            self.assertEqual(self.client.get(url, headers={"authorization": "Bearer "}).status_code, 403)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class ReadRoutingTests(TestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        # A second alias the router may route to; it is never connected to
+        patcher = mock.patch.dict(connections.databases, {"replica": connections.databases["default"]})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_go_to_the_alias_inside_reads_from_only(self):
+        # TestCase wraps every test in a transaction; pretend there is none
+        patcher = mock.patch.object(connection, "in_atomic_block", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.assertEqual(self.router.db_for_read(Subscription), "default")
+        with reads_from("replica"):
+            self.assertEqual(self.router.db_for_read(Subscription), "replica")
+            self.assertEqual(self.router.db_for_write(Subscription), "default")
+            with reads_from("unknown"):
+                self.assertEqual(self.router.db_for_read(Subscription), "default")
+        self.assertEqual(self.router.db_for_read(Subscription), "default")
+        self.assertTrue(self.router.allow_migrate("default", "subscriptions"))
+        self.assertFalse(self.router.allow_migrate("replica", "subscriptions"))
+
+    def test_reads_stay_on_the_primary_inside_a_transaction(self):
+        with reads_from("replica"):
+            with mock.patch.object(connection, "in_atomic_block", False):
+                self.assertEqual(self.router.db_for_read(Subscription), "replica")
+            with transaction.atomic():
+                self.assertEqual(self.router.db_for_read(Subscription), "default")
+
+    @override_settings(DATABASE_READ_ALIAS="replica")
+    def test_middleware_routes_get_requests(self):
+        def view(request):
+            with mock.patch.object(connection, "in_atomic_block", False):
+                alias = self.router.db_for_read(Subscription)
+            if request.GET.get("stream"):
+                def content():
+                    with mock.patch.object(connection, "in_atomic_block", False):
+                        yield self.router.db_for_read(Subscription).encode()
+                return StreamingHttpResponse(content())
+            return HttpResponse(alias)
+
+        middleware = ReplicaReadsMiddleware(view)
+        factory = RequestFactory()
+        self.assertEqual(middleware(factory.get("/")).content, b"replica")
+        self.assertEqual(middleware(factory.post("/")).content, b"default")
+        # The stream is consumed after the middleware returned
+        self.assertEqual(b"".join(middleware(factory.get("/", {"stream": "1"})).streaming_content), b"replica")
+
+    @override_settings(DATABASE_READ_ALIAS="replica")
+    async def test_middleware_routes_async_requests(self):
+        async def view(request):
+            with mock.patch.object(connection, "in_atomic_block", False):
+                return HttpResponse(self.router.db_for_read(Subscription))
+
+        middleware = ReplicaReadsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        factory = RequestFactory()
+        self.assertEqual((await middleware(factory.get("/"))).content, b"replica")
+        self.assertEqual((await middleware(factory.post("/"))).content, b"default")
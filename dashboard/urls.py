@@ -1,5 +1,5 @@
 from django.urls import path
-from dashboard.views import (SubscriptionList, api_all_active_subscriptions, email_message_list, subscription_detail, email_message_detail)
+from dashboard.views import (SubscriptionList, api_all_active_subscriptions, api_export, api_all_active_subscriptions_async, api_batch_active_subscriptions, api_spending_history, email_message_list, subscription_detail, email_message_detail)
 
 urlpatterns = [
     path("", SubscriptionList.as_view(), name="subscription-list-url"),  
@@ -10,4 +10,9 @@ urlpatterns = [
     path("email_message/<uuid:pk>", email_message_detail, name="email_message_detail-url"),
     
     path("api/subscriptions/active/", api_all_active_subscriptions, name="api-active-subscriptions-url"),
+    path("api/subscriptions/active/async/", api_all_active_subscriptions_async, name="api-active-subscriptions-async-url"),
+    path("api/subscriptions/active/batch/", api_batch_active_subscriptions, name="api-batch-active-subscriptions-url"),
+    path("api/spending/", api_spending_history, name="api-spending-history-url"),
+    path("api/export/subscriptions/", api_export, {"kind": "subscriptions"}, name="api-export-subscriptions-url"),
+    path("api/export/emails/", api_export, {"kind": "emails"}, name="api-export-emails-url"),
 ]
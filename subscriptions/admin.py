@@ -1,15 +1,140 @@
 from django.contrib import admin
-from .models import Subscription, EmailMessage
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .models import Subscription, EmailMessage, EmailBody, ExchangeRate, RenewalNotification, CanonicalName, LinkCheck
+from .search import get_search_backend
+
+# Filtered changelists count at most this many rows; below it, unfiltered ones are counted exactly too
+EXACT_COUNT_LIMIT = 10000
+
+
+def estimated_row_count(model, using):
+    """
+    Number of rows of `model`'s table read from the database's bookkeeping instead of a `COUNT(*)` scan, or
+    None when the database keeps no usable figure. SQLite: the row count recorded by the last ANALYZE in
+    `sqlite_stat1` (the first number of any of the table's entries), None before the table is analyzed.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute("SELECT CAST(stat AS INTEGER) FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+        elif connection.vendor == "postgresql":
+            # -1 until the table is first vacuumed or analyzed
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        elif connection.vendor == "mysql":
+            cursor.execute("SELECT table_rows FROM information_schema.tables "
+                           "WHERE table_schema = DATABASE() AND table_name = %s", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator of the changelists of the big tables. An unfiltered list takes its count from
+    `estimated_row_count`; a filtered (or small) one is counted up to `EXACT_COUNT_LIMIT` rows only, so the
+    pages past the limit are not linked.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= EXACT_COUNT_LIMIT:
+                return estimate
+        return queryset.order_by()[:EXACT_COUNT_LIMIT].count()
+
+
+class DeferringChangeList(ChangeList):
+
+    def get_queryset(self, request, exclude_parameters=None):
+        return super().get_queryset(request, exclude_parameters).defer(*self.model_admin.list_defer)
+
+
+class UserDataAdmin(admin.ModelAdmin):
+    """
+    Admin of a table holding rows of every user, built to stay fast at millions of rows: users joined in
+    the list query, estimated counts and no second unfiltered count, `list_defer` columns left out of list
+    pages, users picked through the `UserAdmin` autocomplete, and searches answered by the search index
+    (`search_fields` are its columns, see `SEARCH_DOCUMENTS`) or by an exact username.
+    """
+    list_select_related = ("user",)
+    list_defer = ()
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    autocomplete_fields = ("user",)
+
+    def get_changelist(self, request, **kwargs):
+        return DeferringChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        results = get_search_backend().filter(queryset, search_term, fields=self.search_fields)
+        user_ids = list(User.objects.filter(username=search_term).values_list("pk", flat=True))
+        if user_ids:
+            results = results | queryset.filter(user_id__in=user_ids)
+        return results, False
+
 
 # Register your models here.
 @admin.register(Subscription)
-class SubscriptionAdmin(admin.ModelAdmin):
+class SubscriptionAdmin(UserDataAdmin):
     list_display = ("id", "user", "platform_name", "service_name", "start_date", "end_date")
-    search_fields = ("user__username", "platform_name", "service_name")
-    ordering     = ("user", "-end_date", "-start_date", "platform_name", "service_name")
+    list_defer   = ("unsubscribe_link", "notes")
+    search_fields = ("platform_name", "service_name", "sender")
+    search_help_text = "Platform, service or sender words, or an exact username."
+    # The dashboard listing order, served by `subscription_listing_idx`
+    ordering     = ("-end_date", "-start_date", "-id")
+
+class EmailBodyInline(admin.StackedInline):
+    model = EmailBody
+    fields = ("content",)
+    readonly_fields = ("content",)
+    can_delete = False
 
 @admin.register(EmailMessage)
-class EmailMessageAdmin(admin.ModelAdmin):
+class EmailMessageAdmin(UserDataAdmin):
+    inlines = (EmailBodyInline,)
     list_display = ("user", "id", "subject", "received_date")
-    search_fields = ("user__username", "subject", "sender")
-    ordering     = ("user", "-received_date")
\ No newline at end of file
+    list_defer   = ("parsed_data",)
+    search_fields = ("subject", "sender", "body")
+    search_help_text = "Subject, sender or body words, or an exact username."
+    # The "All Emails" listing order, served by `emailmessage_listing_idx`
+    ordering     = ("-received_date", "-id")
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ("currency", "rate", "updated_at")
+    ordering     = ("currency",)
+
+@admin.register(RenewalNotification)
+class RenewalNotificationAdmin(admin.ModelAdmin):
+    list_display = ("user", "subscription", "kind", "event_date", "window_days", "sent_at")
+    list_select_related = ("user", "subscription", "subscription__user")
+    ordering     = ("-event_date",)
+@admin.register(CanonicalName)
+class CanonicalNameAdmin(admin.ModelAdmin):
+    list_display = ("kind", "alias", "canonical")
+    list_filter  = ("kind",)
+    search_fields = ("alias", "canonical")
+    ordering     = ("kind", "canonical", "alias")
+
+@admin.register(LinkCheck)
+class LinkCheckAdmin(admin.ModelAdmin):
+    list_display = ("url", "status", "status_code", "checked_at")
+    list_filter  = ("status",)
+    search_fields = ("url",)
+    ordering     = ("url",)
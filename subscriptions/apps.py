@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class SubscriptionsConfig(AppConfig):
     name = 'subscriptions'
+
+    def ready(self):
+        # Register the signal receivers that keep the search index, the spending rollup and the renewal dates in sync
+        from subscriptions import renewals, search, spending  # noqa: F401
@@ -0,0 +1,258 @@
+# subscriptions/dedup.py
+import time
+from collections import Counter
+from datetime import date, timedelta
+from difflib import SequenceMatcher
+from itertools import groupby
+from django.conf import settings
+from django.utils import timezone
+from SubFlo.sharding import current_shard, data_aliases, on_shard, shard_atomic, users_by_shard, write_alias
+from subscriptions.models import CanonicalName, RenewalNotification, Subscription
+from subscriptions.names import PLATFORM, SERVICE, normalize_name
+from subscriptions.search import get_search_backend
+from subscriptions.signals import bulk_changed
+
+DEFAULT_SIMILARITY = 0.85
+# Rows compared with each of their neighbours in every sorted pass
+DEFAULT_WINDOW = 6
+DEFAULT_BATCH_USERS = 500
+# Two copies of the same subscription may have been dated from different emails of the same billing event
+DATE_TOLERANCE = timedelta(days=2)
+
+ROW_FIELDS = (
+    "id", "user_id", "platform_name", "service_name", "start_date", "end_date", "is_trial", "already_canceled",
+    "price", "currency", "payment_method", "email_message_id", "unsubscribe_link", "notes", "created_at", "updated_at",
+)
+# Filled from the duplicates when the surviving row has no value
+COALESCED_FIELDS = ("payment_method", "email_message_id", "unsubscribe_link", "notes")
+# Status flags are taken from the most recently updated copy
+STATUS_FIELDS = ("is_trial", "already_canceled")
+MERGE_UPDATE_FIELDS = (
+    "platform_name", "service_name", "start_date", "end_date", "price", "currency",
+    *COALESCED_FIELDS, *STATUS_FIELDS, "updated_at",
+)
+
+
+class Canonicalizer:
+    """
+    Maps platform and service names to their canonical spelling through the `CanonicalName` table,
+    which is read once per instance.
+    """
+
+    def __init__(self):
+        self.names = {(kind, alias): canonical for kind, alias, canonical in
+                      CanonicalName.objects.values_list("kind", "alias", "canonical")}
+
+    def lookup(self, name, kind):
+        """Returns the canonical spelling of `name`, or None when the table does not know it."""
+        return self.names.get((kind, normalize_name(name, kind)))
+
+    def canonical(self, name, kind):
+        return self.lookup(name, kind) or name.strip()
+
+    def key(self, name, kind):
+        """Comparison key of `name`: two names with the same key are the same platform (or service)."""
+        return normalize_name(self.canonical(name, kind), kind)
+
+
+class DedupStats:
+
+    def __init__(self):
+        self.users = 0
+        self.scanned = 0
+        self.clusters = 0
+        self.merged = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.scanned / self.elapsed if self.elapsed else 0.0
+
+
+class SubscriptionDeduplicator:
+    """
+    Finds the subscriptions of a user that are the same subscription under different spellings
+    ("Netflix"/"NETFLIX Inc.", "Premium"/"Premium Plan") and merges each group into its oldest row.
+
+    Names are compared on their `Canonicalizer.key`. Candidates come from a sorted-neighbourhood search:
+    a user's rows are sorted by (platform, service, start date) and by (service, platform, start date),
+    and every row is only compared with the next `window - 1` rows of each order, so a user with n rows costs
+    O(n log n) instead of the O(n²) of comparing every pair. Two rows match when both names are at least
+    `similarity` alike (difflib ratio) and their dates agree within `DATE_TOLERANCE` (unknown dates agree
+    with anything). Matches are grouped, but a row only joins a group whose every member has dates agreeing
+    with its own: an undated row joins one period at most, and never bridges the months of a subscription.
+
+    A merge keeps the oldest row, renamed to the canonical names, with the widest known period, the first
+    known price, payment method, email, link and notes, and the status of the most recently updated copy.
+    The other rows are deleted and their renewal notifications move to the kept row. Every batch of users is
+    written in bulk in one transaction on its shard, then the search index and the caches are refreshed with
+    `bulk_changed`.
+    """
+
+    def __init__(self, similarity=None, window=DEFAULT_WINDOW, batch_users=DEFAULT_BATCH_USERS, dry_run=False,
+                 canonicalizer=None):
+        self.similarity = similarity or getattr(settings, "SUBSCRIPTION_DEDUP_SIMILARITY", DEFAULT_SIMILARITY)
+        self.window = window
+        self.batch_users = batch_users
+        self.dry_run = dry_run
+        self.canonicalizer = canonicalizer or Canonicalizer()
+
+    def run(self, user_ids=None):
+        """
+        Deduplicates the subscriptions of `user_ids` (of every user when omitted) and returns a `DedupStats`.
+        """
+        stats = DedupStats()
+        if user_ids is None:
+            groups = dict.fromkeys(data_aliases())
+        elif current_shard() is not None:
+            groups = {current_shard(): user_ids}
+        else:
+            groups = users_by_shard(set(user_ids))
+        for alias, shard_user_ids in groups.items():
+            with on_shard(alias):
+                self._run_shard(stats, shard_user_ids)
+        return stats
+
+    def _run_shard(self, stats, user_ids):
+        if user_ids is None:
+            user_ids = Subscription.objects.order_by("user_id").values_list("user_id", flat=True).distinct()
+        user_ids = sorted(set(user_ids))
+
+        for start in range(0, len(user_ids), self.batch_users):
+            rows = (Subscription.objects.filter(user_id__in=user_ids[start:start + self.batch_users])
+                    .order_by("user_id", "created_at", "id").values(*ROW_FIELDS))
+            clusters = []
+            for _, user_rows in groupby(rows, key=lambda row: row["user_id"]):
+                user_rows = list(user_rows)
+                stats.users += 1
+                stats.scanned += len(user_rows)
+                clusters += self.find_duplicates(user_rows)
+            stats.clusters += len(clusters)
+            stats.merged += sum(len(cluster) - 1 for cluster in clusters)
+            if clusters and not self.dry_run:
+                self.merge(clusters)
+
+    def find_duplicates(self, rows):
+        """
+        Returns the groups of duplicates among `rows` (the subscriptions of one user), each oldest first.
+        """
+        keys = [(self.canonicalizer.key(row["platform_name"], PLATFORM),
+                 self.canonicalizer.key(row["service_name"], SERVICE)) for row in rows]
+        parent = list(range(len(rows)))
+        members = {i: [i] for i in range(len(rows))}
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        passes = (
+            lambda i: (keys[i][0], keys[i][1], rows[i]["start_date"] or date.min),
+            lambda i: (keys[i][1], keys[i][0], rows[i]["start_date"] or date.min),
+        )
+        for sort_key in passes:
+            order = sorted(range(len(rows)), key=sort_key)
+            for position, i in enumerate(order):
+                for j in order[position + 1:position + self.window]:
+                    root_i, root_j = find(i), find(j)
+                    if root_i == root_j or not self._matches(rows[i], keys[i], rows[j], keys[j]):
+                        continue
+                    if all(self._dates_agree(rows[a], rows[b]) for a in members[root_i] for b in members[root_j]):
+                        parent[root_j] = root_i
+                        members[root_i] += members.pop(root_j)
+
+        groups = {}
+        for i in range(len(rows)):  # `rows` is oldest first, so every group is too
+            groups.setdefault(find(i), []).append(rows[i])
+        return [group for group in groups.values() if len(group) > 1]
+
+    def _similar(self, a, b):
+        if a == b:
+            return True
+        matcher = SequenceMatcher(None, a, b, autojunk=False)
+        return matcher.quick_ratio() >= self.similarity and matcher.ratio() >= self.similarity
+
+    @staticmethod
+    def _dates_agree(a, b):
+        return not any(a[name] and b[name] and abs(a[name] - b[name]) > DATE_TOLERANCE
+                       for name in ("start_date", "end_date"))
+
+    def _matches(self, a, a_keys, b, b_keys):
+        return self._dates_agree(a, b) and self._similar(a_keys[0], b_keys[0]) and self._similar(a_keys[1], b_keys[1])
+
+    def _name(self, cluster, field, kind):
+        for row in cluster:
+            canonical = self.canonicalizer.lookup(row[field], kind)
+            if canonical:
+                return canonical
+        # No table entry: the most common spelling, the oldest on a tie
+        return Counter(row[field].strip() for row in cluster).most_common(1)[0][0]
+
+    def merged_values(self, cluster):
+        """
+        Returns the field values of the row a group of duplicates is merged into.
+        """
+        starts = [row["start_date"] for row in cluster if row["start_date"]]
+        ends = [row["end_date"] for row in cluster if row["end_date"]]
+        priced = next((row for row in cluster if row["price"] is not None), cluster[0])
+        newest = max(cluster, key=lambda row: row["updated_at"])
+        values = {
+            "platform_name": self._name(cluster, "platform_name", PLATFORM),
+            "service_name": self._name(cluster, "service_name", SERVICE),
+            "start_date": min(starts, default=None),
+            "end_date": max(ends, default=None),
+            "price": priced["price"],
+            "currency": priced["currency"],
+        }
+        for name in COALESCED_FIELDS:
+            values[name] = next((row[name] for row in cluster if row[name]), None)
+        for name in STATUS_FIELDS:
+            values[name] = newest[name]
+        return values
+
+    def merge(self, clusters):
+        kept = {}        # surviving pk -> merged values
+        survivor_of = {}  # deleted pk -> surviving pk
+        for cluster in clusters:
+            kept[cluster[0]["id"]] = self.merged_values(cluster)
+            for row in cluster[1:]:
+                survivor_of[row["id"]] = cluster[0]["id"]
+
+        with shard_atomic():
+            self._move_notifications(kept, survivor_of)
+            # Deleted without per-row signals: the rows they feed (search index, rollup, caches) are refreshed
+            # below for the whole batch, and nothing references the duplicates any more
+            Subscription.objects.filter(pk__in=survivor_of)._raw_delete(write_alias())
+            backend = get_search_backend()
+            for pk in survivor_of:
+                backend.remove(Subscription(pk=pk))
+
+            now = timezone.now()
+            survivors = []
+            for pk, values in kept.items():
+                values["email_message_id_id"] = values.pop("email_message_id")
+                survivors.append(Subscription(pk=pk, updated_at=now, **values))
+            Subscription.objects.bulk_update(survivors, MERGE_UPDATE_FIELDS, batch_size=self.batch_users)
+            backend.index_queryset(Subscription.objects.filter(pk__in=kept))
+            bulk_changed.send(sender=SubscriptionDeduplicator, model=Subscription,
+                              user_ids={cluster[0]["user_id"] for cluster in clusters})
+
+    def _move_notifications(self, kept, survivor_of):
+        notifications = RenewalNotification.objects.filter(subscription_id__in=[*kept, *survivor_of]).order_by(
+            "created_at").values_list("id", "subscription_id", "kind", "event_date", "window_days")
+        seen, moved, dropped = set(), [], []
+        for pk, subscription_id, *event in notifications:
+            survivor = survivor_of.get(subscription_id, subscription_id)
+            if (survivor, *event) in seen:
+                dropped.append(pk)  # The kept row already has this notification
+                continue
+            seen.add((survivor, *event))
+            if survivor != subscription_id:
+                moved.append(RenewalNotification(pk=pk, subscription_id=survivor))
+        RenewalNotification.objects.filter(pk__in=dropped).delete()
+        RenewalNotification.objects.bulk_update(moved, ["subscription"], batch_size=self.batch_users)
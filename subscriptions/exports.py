@@ -0,0 +1,170 @@
+# subscriptions/exports.py
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, time as dt_time
+from itertools import chain
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from SubFlo.sharding import across_shards, shard_of, sharding_enabled
+from subscriptions.models import Subscription, EmailMessage
+
+# Rows fetched per database round trip
+EXPORT_CHUNK_SIZE = 2000
+# Encoded output is handed over in pieces of about this many bytes
+FLUSH_SIZE = 64 * 1024
+
+EXPORT_MODELS = {"subscriptions": Subscription, "emails": EmailMessage}
+FORMATS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+# Exported columns; `user_id` is only part of exports spanning several users
+EXPORT_FIELDS = {
+    Subscription: (
+        "id", "user_id", "platform_name", "service_name", "start_date", "end_date", "is_trial", "already_canceled",
+        "price", "currency", "payment_method", "email_message_id", "unsubscribe_link", "notes", "next_renewal_date",
+        "created_at", "updated_at",
+    ),
+    EmailMessage: ("id", "user_id", "message_id", "subject", "sender", "received_date", "created_at", "updated_at"),
+}
+# Where the `parsed_data` column comes from (the LLM output of the email a subscription was extracted from)
+PARSED_DATA_LOOKUPS = {Subscription: "email_message_id__parsed_data", EmailMessage: "parsed_data"}
+# Field the `date_from`/`date_to` range applies to
+DATE_RANGE_FIELDS = {Subscription: "start_date", EmailMessage: "received_date"}
+
+
+def parse_filters(date_from=None, date_to=None, since=None):
+    """
+    Parses the textual export filters (dates as YYYY-MM-DD, `since` as an ISO 8601 date or datetime) into
+    keyword arguments of `export_rows`. Raises ValueError with a readable message.
+    """
+    filters = {}
+    for name, value in (("date_from", date_from), ("date_to", date_to)):
+        if value:
+            filters[name] = parse_date(value)
+            if filters[name] is None:
+                raise ValueError(f"{name} must be a date (YYYY-MM-DD)")
+    if since:
+        parsed = parse_datetime(since)
+        if parsed is None and parse_date(since) is not None:
+            parsed = datetime.combine(parse_date(since), dt_time.min)
+        if parsed is None:
+            raise ValueError("since must be an ISO 8601 date or datetime")
+        filters["since"] = timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+    return filters
+
+
+def export_rows(model, user_id=None, date_from=None, date_to=None, since=None, parsed_data=False):
+    """
+    Returns `(columns, rows)` for an export of `model`: the rows of one user (or of every user when `user_id`
+    is None) whose date falls in [`date_from`, `date_to`] and that were written after `since`.
+    Rows come in `updated_at` order (shard after shard for every user when sharded), so the largest
+    `updated_at` of an export is the `since` of the next one.
+    They are fetched lazily, `EXPORT_CHUNK_SIZE` at a time (with a server-side cursor where the database has one).
+    """
+    queryset = model.objects.all()
+    columns = list(EXPORT_FIELDS[model])
+    if user_id is not None:
+        queryset = queryset.filter(user_id=user_id)
+        columns.remove("user_id")
+    date_field = DATE_RANGE_FIELDS[model]
+    if date_from:
+        queryset = queryset.filter(**{f"{date_field}__gte": date_from})
+    if date_to:
+        if model._meta.get_field(date_field).get_internal_type() == "DateTimeField":
+            queryset = queryset.filter(**{f"{date_field}__date__lte": date_to})
+        else:
+            queryset = queryset.filter(**{f"{date_field}__lte": date_to})
+    if since:
+        queryset = queryset.filter(updated_at__gt=since)
+
+    lookups = list(columns)
+    if parsed_data:
+        columns.append("parsed_data")
+        lookups.append(PARSED_DATA_LOOKUPS[model])
+    if user_id is not None and sharding_enabled():
+        queryset = queryset.using(shard_of(user_id))
+    rows = chain.from_iterable(
+        shard_queryset.order_by("updated_at", "id").values_list(*lookups).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        for shard_queryset in across_shards(queryset)
+    )
+    return columns, rows
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, cls=DjangoJSONEncoder, separators=(",", ":"))
+    return str(value)
+
+
+def render_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def render_ndjson(columns, rows):
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    buffer, size = [], 0
+    for row in rows:
+        line = encoder.encode(dict(zip(columns, row))) + "\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= FLUSH_SIZE:
+            yield "".join(buffer).encode()
+            buffer, size = [], 0
+    yield "".join(buffer).encode()
+
+
+RENDERERS = {"csv": render_csv, "ndjson": render_ndjson}
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compresses a stream of byte chunks into one gzip file, without holding more than a chunk in memory.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(kind, fmt="csv", compress=False, **filters):
+    """
+    Yields an export of `kind` ("subscriptions" or "emails") as bytes, in `fmt` ("csv" or "ndjson"),
+    optionally gzipped. `filters` are the keyword arguments of `export_rows`.
+    Memory use does not depend on the number of rows.
+    """
+    columns, rows = export_rows(EXPORT_MODELS[kind], **filters)
+    chunks = RENDERERS[fmt](columns, rows)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+async def aiterate(chunks):
+    """
+    Async iterator over the sync iterator `chunks`, advanced one step at a time in a worker thread. Under ASGI
+    Django collects a sync streaming body into a list before sending anything; this one goes out chunk by chunk.
+    """
+    chunks = iter(chunks)
+    while True:
+        chunk = await sync_to_async(next)(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
@@ -0,0 +1,389 @@
+# subscriptions/extraction.py
+import asyncio
+import logging
+import re
+import statistics
+import time
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from SubFlo.sharding import data_aliases, on_shard, shard_atomic
+from subscriptions.dedup import Canonicalizer, SubscriptionDeduplicator
+from subscriptions.models import Subscription, EmailMessage
+from subscriptions.names import PLATFORM, SERVICE
+from subscriptions.prefilter import normalized_content_hash
+from subscriptions.search import get_search_backend
+from subscriptions.signals import bulk_changed
+
+DEFAULT_LLM_CLIENT = "subscriptions.extraction.StubLLMClient"
+
+logger = logging.getLogger(__name__)
+
+# Fields of `Subscription` an extraction result may fill
+SUBSCRIPTION_FIELDS = (
+    "platform_name", "service_name", "start_date", "end_date", "is_trial", "already_canceled",
+    "price", "currency", "payment_method", "unsubscribe_link", "notes",
+)
+UPSERT_UNIQUE_FIELDS = ("user", "platform_name", "service_name", "start_date", "end_date")
+UPSERT_KEY_ATTRIBUTES = ("user_id", "platform_name", "service_name", "start_date", "end_date")
+
+
+############################################################
+####################### LLM clients ########################
+############################################################
+
+class LLMClientError(Exception):
+    pass
+
+
+class BaseLLMClient:
+    """
+    Interface of an LLM backend.
+    `extract` receives one email as a dict (`id`, `subject`, `sender`, `received_date`, `raw_email_body`) and
+    returns the `parsed_data` to store: `{"is_subscription": False}` for unrelated mail, otherwise
+    `{"is_subscription": True, "subscription": {...}}` with keys from `SUBSCRIPTION_FIELDS` (dates as ISO strings).
+    A call that fails raises one of `errors`: `LLMClientError` for an error answer of the API, `OSError` for
+    the transport (timeouts included). Clients built on an HTTP library add its exception types.
+    """
+
+    errors = (LLMClientError, OSError)
+
+    async def extract(self, email):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class StubLLMClient(BaseLLMClient):
+    """
+    Offline stand-in for a real LLM, for local development and benchmarks.
+    It sleeps for `latency` seconds per call and extracts fields with simple regular expressions.
+    """
+
+    KEYWORDS = re.compile(r"\b(subscription|subscribed|receipt|renew\w*|trial|membership|plan|billing|invoice)\b", re.I)
+    PRICE = re.compile(r"([$€£])\s?(\d+(?:[.,]\d{2})?)")
+    SERVICE = re.compile(r"\b([A-Z][\w+]*)\s+(?:plan|membership|subscription|tier)\b")
+    LINK = re.compile(r"https?://\S*unsubscribe\S*", re.I)
+    CURRENCIES = {"$": "USD", "€": "EUR", "£": "GBP"}
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+
+    async def extract(self, email):
+        await asyncio.sleep(self.latency)
+        text = f"{email['subject']}\n{email['raw_email_body']}"
+        if not self.KEYWORDS.search(text):
+            return {"is_subscription": False}
+
+        domain = email["sender"].rsplit("@", 1)[-1].strip("> ").split(".")
+        platform_name = (domain[-2] if len(domain) > 1 else domain[0]).capitalize() or "Unknown"
+        service = self.SERVICE.search(text)
+        price = self.PRICE.search(text)
+        link = self.LINK.search(text)
+        start_date = email["received_date"].date()
+        return {
+            "is_subscription": True,
+            "subscription": {
+                "platform_name": platform_name,
+                "service_name": service.group(1) if service else "Subscription",
+                "start_date": start_date.isoformat(),
+                "end_date": (start_date + timedelta(days=30)).isoformat(),
+                "is_trial": "trial" in text.lower(),
+                "already_canceled": bool(re.search(r"\bcancel(l)?ed\b", text, re.I)),
+                "price": price.group(2).replace(",", ".") if price else None,
+                "currency": self.CURRENCIES[price.group(1)] if price else "USD",
+                "unsubscribe_link": link.group(0) if link else None,
+            },
+        }
+
+
+def get_llm_client(**kwargs):
+    """
+    Instantiates the client configured by `settings.LLM_CLIENT` (the offline stub by default).
+    """
+    return import_string(getattr(settings, "LLM_CLIENT", DEFAULT_LLM_CLIENT))(**kwargs)
+
+
+############################################################
+##################### Rate limiting ########################
+############################################################
+
+class TokenBucket:
+    """
+    Asyncio token bucket: allows `rate` acquisitions per second on average, with bursts up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+############################################################
+######################### Worker ###########################
+############################################################
+
+class ExtractionStats:
+
+    def __init__(self):
+        self.processed = 0
+        self.subscriptions = 0
+        self.failed = 0
+        self.failures = 0
+        self.skipped = 0
+        self.cache_hits = 0
+        self.llm_calls = 0
+        self.latencies = []
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def skip_rate(self):
+        return self.skipped / self.processed if self.processed else 0.0
+
+    @property
+    def cache_hit_rate(self):
+        lookups = self.cache_hits + self.llm_calls
+        return self.cache_hits / lookups if lookups else 0.0
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        if len(self.latencies) == 1:
+            return self.latencies[0]
+        return statistics.quantiles(self.latencies, n=100, method="inclusive")[p - 1]
+
+
+def result_error(result):
+    """
+    Returns why the worker cannot store the extraction `result`, or None when it can: the answer comes from an
+    LLM, so its dates may be anything ("March 2026").
+    """
+    if not isinstance(result, dict) or not isinstance(result.get("subscription") or {}, dict):
+        return "not an object"
+    values = result.get("subscription") or {}
+    for name in ("start_date", "end_date"):
+        if values.get(name) is not None:
+            try:
+                date.fromisoformat(values[name])
+            except (TypeError, ValueError):
+                return f"{name} {values[name]!r} is not an ISO date"
+    return None
+
+
+def _subscription_from_result(email, result, canonicalizer):
+    values = result.get("subscription") or {}
+    fields = {name: values[name] for name in SUBSCRIPTION_FIELDS if values.get(name) is not None}
+    if not fields.get("platform_name") or not fields.get("service_name"):
+        return None
+    fields["platform_name"] = canonicalizer.canonical(fields["platform_name"], PLATFORM)
+    fields["service_name"] = canonicalizer.canonical(fields["service_name"], SERVICE)
+    for name in ("start_date", "end_date"):
+        if name in fields:
+            fields[name] = date.fromisoformat(fields[name])
+    if "price" in fields:
+        try:
+            fields["price"] = Decimal(str(fields["price"]))
+        except InvalidOperation:
+            del fields["price"]
+    fields["platform_name"] = fields["platform_name"][:255]
+    fields["service_name"] = fields["service_name"][:255]
+    return Subscription(user_id=email["user_id"], email_message_id_id=email["id"], **fields)
+
+
+class ExtractionWorker:
+    """
+    Fills `EmailMessage.parsed_data` and the `Subscription` table from an LLM client.
+    Unparsed emails are pulled in primary-key order, one shard after the other, `batch_size` at a time. Every batch is sent to the client
+    with at most `concurrency` calls in flight and at most `rate` calls per second, then written back with
+    one `bulk_update` and one `bulk_create(update_conflicts=True)` upsert on `unique_user_platform_service_date`.
+    Names are canonicalized before the upsert and the users of every batch are deduplicated after it
+    (see `subscriptions.dedup`).
+    Emails whose call failed (the client raised one of its `errors`, or answered a result `result_error`
+    rejects; counted in `stats.failures` and logged) keep `parsed_data` empty and are retried by the next run;
+    any other exception stops the run.
+    A re-parsed email updates its previous row, or replaces it when the subscription moved to another upsert key.
+    An optional `prefilter` rejects unrelated mail without calling the client, and an optional `cache`
+    answers near-identical emails (templated receipts) from a previous extraction.
+    """
+
+    def __init__(self, client, batch_size=100, concurrency=8, rate=None, prefilter=None, cache=None):
+        self.client = client
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate = rate
+        self.prefilter = prefilter
+        self.cache = cache
+
+    def pending(self):
+        return EmailMessage.objects.filter(parsed_data__isnull=True).order_by("pk")
+
+    def run(self, limit=None):
+        stats = ExtractionStats()
+        # async_to_sync keeps the database work of `sync_to_async` on this thread (and its connection)
+        async_to_sync(self._run)(stats, limit)
+        return stats
+
+    async def _run(self, stats, limit):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        self._inflight = {}
+        bucket = TokenBucket(self.rate) if self.rate else None
+        try:
+            for alias in data_aliases():
+                # The shards are worked through one after the other; `sync_to_async` carries the shard along
+                with on_shard(alias):
+                    await self._run_shard(stats, limit, semaphore, bucket)
+        finally:
+            await self.client.close()
+
+    async def _run_shard(self, stats, limit, semaphore, bucket):
+        last_pk = None
+        while limit is None or stats.processed + stats.failed < limit:
+            size = self.batch_size if limit is None else min(self.batch_size, limit - stats.processed - stats.failed)
+            emails = await sync_to_async(self._fetch)(last_pk, size)
+            if not emails:
+                break
+            last_pk = emails[-1]["id"]
+            results = await asyncio.gather(*(self._call(email, semaphore, bucket, stats) for email in emails))
+            await sync_to_async(self._write)(emails, results, stats)
+
+    def _fetch(self, last_pk, size):
+        queryset = self.pending()
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+        emails = list(queryset.values("id", "user_id", "subject", "sender", "received_date", "body__content")[:size])
+        for email in emails:
+            email["raw_email_body"] = email.pop("body__content") or ""
+        return emails
+
+    async def _call(self, email, semaphore, bucket, stats):
+        if self.prefilter is not None and not self.prefilter.accepts(email):
+            stats.skipped += 1
+            return {"is_subscription": False, "skipped_by": "prefilter"}
+        key = event = None
+        if self.cache is not None:
+            key = normalized_content_hash(email)
+            while True:
+                result = self.cache.get(email, key)
+                if result is not None:
+                    stats.cache_hits += 1
+                    return result
+                if key not in self._inflight:
+                    break
+                # An identical email is being extracted right now: reuse its answer instead of a second call.
+                # When that call failed, the first waiter to wake up makes the next one and the others wait again
+                await self._inflight[key].wait()
+            event = self._inflight[key] = asyncio.Event()
+
+        try:
+            async with semaphore:
+                if bucket is not None:
+                    await bucket.acquire()
+                stats.llm_calls += 1
+                started = time.perf_counter()
+                try:
+                    result = await self.client.extract(email)
+                except self.client.errors as error:
+                    stats.failures += 1
+                    logger.warning("Extraction of email %s failed: %r", email["id"], error)
+                    return None
+                finally:
+                    stats.latencies.append(time.perf_counter() - started)
+
+            error = result_error(result)
+            if error is not None:
+                stats.failures += 1
+                logger.warning("Extraction of email %s failed: unusable result (%s)", email["id"], error)
+                return None
+            if self.cache is not None:
+                self.cache.set(email, result, key)
+            return result
+        finally:
+            if event is not None:
+                if self._inflight.get(key) is event:
+                    del self._inflight[key]
+                event.set()
+
+    def _write(self, emails, results, stats):
+        canonicalizer = Canonicalizer()
+        now = timezone.now()  # bulk_update does not fill `auto_now` fields
+        parsed, subscriptions = [], {}
+        for email, result in zip(emails, results):
+            if result is None:
+                stats.failed += 1
+                continue
+            stats.processed += 1
+            parsed.append(EmailMessage(id=email["id"], parsed_data=result, updated_at=now))
+            if result.get("is_subscription"):
+                subscription = _subscription_from_result(email, result, canonicalizer)
+                if subscription is not None:
+                    # One row per upsert key: a second copy in the same statement is an error, the last one wins
+                    subscriptions[tuple(getattr(subscription, field) for field in UPSERT_KEY_ATTRIBUTES)] = subscription
+        update_fields = [name for name in (*SUBSCRIPTION_FIELDS, "email_message_id", "updated_at")
+                         if name not in UPSERT_UNIQUE_FIELDS]
+
+        with shard_atomic():
+            EmailMessage.objects.bulk_update(parsed, ["parsed_data", "updated_at"], batch_size=self.batch_size)
+            if subscriptions:
+                # The row of an email is unique, so a re-parsed email must not insert a second one. With the same
+                # upsert key its previous row is updated in place (NULL dates never conflict, the upsert would
+                # insert); when re-parsing changed the service or dates, the previous row goes before the upsert
+                previous = {
+                    email_id: (pk, tuple(key)) for pk, email_id, *key in Subscription.objects
+                    .filter(email_message_id__in=[sub.email_message_id_id for sub in subscriptions.values()])
+                    .values_list("pk", "email_message_id", *UPSERT_KEY_ATTRIBUTES)
+                }
+                updated, created, stale = [], [], []
+                for key, subscription in subscriptions.items():
+                    pk, previous_key = previous.get(subscription.email_message_id_id, (None, None))
+                    if previous_key == key:
+                        subscription.pk, subscription.updated_at = pk, now
+                        updated.append(subscription)
+                    else:
+                        created.append(subscription)
+                        if pk is not None:
+                            stale.append(pk)
+                subscriptions = updated + created
+                if stale:
+                    Subscription.objects.filter(pk__in=stale).delete()
+                Subscription.objects.bulk_update(updated, update_fields, batch_size=self.batch_size)
+                Subscription.objects.bulk_create(
+                    created,
+                    batch_size=self.batch_size,
+                    update_conflicts=True,
+                    unique_fields=UPSERT_UNIQUE_FIELDS,
+                    update_fields=update_fields,
+                )
+                # Bulk writes send no post_save: refresh the search index and notify the caches explicitly
+                get_search_backend().index_queryset(
+                    Subscription.objects.filter(email_message_id__in=[sub.email_message_id_id for sub in subscriptions])
+                )
+                bulk_changed.send(sender=ExtractionWorker, model=Subscription,
+                                  user_ids={sub.user_id for sub in subscriptions})
+                # Spellings the lookup table does not know yet are merged by the fuzzy matcher
+                SubscriptionDeduplicator(canonicalizer=canonicalizer).run(user_ids={sub.user_id for sub in subscriptions})
+        stats.subscriptions += len(subscriptions)
@@ -0,0 +1,56 @@
+# subscriptions/fields.py
+import zlib
+from django.conf import settings
+from django.db import models
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always available
+    zstandard = None
+
+# Every stored value starts with a one-byte codec tag, so the codec can change without rewriting old rows
+ZLIB = b"z"
+ZSTD = b"s"
+
+
+def compress_text(text, codec=None):
+    data = text.encode("utf-8")
+    codec = codec or getattr(settings, "EMAIL_BODY_CODEC", "zlib")
+    if codec == "zstd" and zstandard is not None:
+        return ZSTD + zstandard.ZstdCompressor(level=9).compress(data)
+    return ZLIB + zlib.compress(data, 6)
+
+
+def decompress_text(value):
+    value = bytes(value)
+    tag, data = value[:1], value[1:]
+    if tag == ZSTD:
+        if zstandard is None:
+            raise ImportError("zstandard is required to read zstd-compressed values.")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+
+class CompressedTextField(models.BinaryField):
+    """
+    Text stored compressed in a BLOB column (zlib, or zstd when `settings.EMAIL_BODY_CODEC = "zstd"`).
+    Reads and writes plain `str`; it cannot be filtered on, since the database only sees compressed bytes.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return decompress_text(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return decompress_text(value)
+        return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, str):
+            value = compress_text(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj) or ""
@@ -0,0 +1,212 @@
+# subscriptions/imapstub.py
+import re
+import socketserver
+import threading
+import time
+from collections import Counter
+
+# What the stub understands: enough of IMAP4rev1 for `subscriptions.mailsync` and `imaplib`
+_COMMAND_RE = re.compile(rb"^(?P<tag>\S+) (?P<command>[A-Za-z]+)(?: (?P<args>.*))?$")
+_UID_COMMAND_RE = re.compile(rb"^(?P<command>[A-Za-z]+) (?P<set>\S+)(?: (?P<items>.*))?$")
+_HEADER_FIELDS_RE = re.compile(rb"HEADER\.FIELDS \(([^)]*)\)", re.I)
+_HEADER_END_RE = re.compile(rb"\r?\n\r?\n")
+
+
+class StubMailbox:
+    """The INBOX of one account: `(uid, raw message)` pairs in UID order."""
+
+    def __init__(self, password, uid_validity=1):
+        self.password = password
+        self.uid_validity = uid_validity
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def append(self, raw):
+        with self.lock:
+            uid = self.messages[-1][0] + 1 if self.messages else 1
+            self.messages.append((uid, raw))
+        return uid
+
+    def uids(self, uid_set):
+        """The UIDs of `uid_set` ("1,4:7,9:*") that exist, in order."""
+        with self.lock:
+            messages = list(self.messages)
+        largest = messages[-1][0] if messages else 0
+        wanted = []
+        for part in uid_set.split(","):
+            low, _, high = part.partition(":")
+            low = largest if low == "*" else int(low)
+            high = low if not high else largest if high == "*" else int(high)
+            wanted.append((min(low, high), max(low, high)))
+        return [uid for uid, _ in messages if any(low <= uid <= high for low, high in wanted)]
+
+    def get(self, uid):
+        with self.lock:
+            return next(raw for message_uid, raw in self.messages if message_uid == uid)
+
+
+def _header_fields(raw, names):
+    match = _HEADER_END_RE.search(raw)
+    headers = raw[:match.start()] if match else raw
+    wanted = {name.lower() for name in names}
+    lines, keep = [], False
+    for line in re.split(rb"\r?\n", headers):
+        if line[:1] in (b" ", b"\t"):
+            if keep:
+                lines.append(line)
+            continue
+        keep = line.split(b":", 1)[0].strip().lower() in wanted
+        if keep:
+            lines.append(line)
+    return b"\r\n".join(lines) + b"\r\n\r\n"
+
+
+def _unquote(value):
+    value = value.strip()
+    if value.startswith(b'"') and value.endswith(b'"'):
+        value = value[1:-1].replace(b'\\"', b'"').replace(b"\\\\", b"\\")
+    return value.decode()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def write(self, line):
+        self.wfile.write(line + b"\r\n")
+
+    def handle(self):
+        server = self.server.stub
+        server.connections += 1
+        self.mailbox = None
+        self.write(b"* OK IMAP4rev1 stub ready")
+        for line in self.rfile:
+            match = _COMMAND_RE.match(line.rstrip(b"\r\n"))
+            if match is None:
+                self.write(b"* BAD unparsable command")
+                continue
+            tag, command, args = match["tag"], match["command"].upper().decode(), match["args"] or b""
+            server.record(command, args)
+            if server.latency:
+                time.sleep(server.latency)
+            if command == "LOGOUT":
+                self.write(b"* BYE logging out")
+                self.write(tag + b" OK LOGOUT completed")
+                return
+            handler = getattr(self, f"do_{command.lower()}", None)
+            if handler is None:
+                self.write(tag + b" BAD unknown command")
+                continue
+            handler(tag, args)
+            self.wfile.flush()
+
+    def do_capability(self, tag, args):
+        self.write(b"* CAPABILITY IMAP4rev1")
+        self.write(tag + b" OK CAPABILITY completed")
+
+    def do_noop(self, tag, args):
+        self.write(tag + b" OK NOOP completed")
+
+    def do_login(self, tag, args):
+        username, _, password = args.partition(b" ")
+        mailbox = self.server.stub.mailboxes.get(_unquote(username))
+        if mailbox is None or mailbox.password != _unquote(password):
+            self.write(tag + b" NO [AUTHENTICATIONFAILED] invalid credentials")
+            return
+        self.server.stub.logins += 1
+        self.account = mailbox
+        self.write(tag + b" OK LOGIN completed")
+
+    def do_select(self, tag, args):
+        if _unquote(args).upper() != "INBOX" or not hasattr(self, "account"):
+            self.write(tag + b" NO no such mailbox")
+            return
+        self.mailbox = self.account
+        uids = self.mailbox.uids("1:*")
+        self.write(b"* %d EXISTS" % len(uids))
+        self.write(b"* OK [UIDVALIDITY %d] UIDs valid" % self.mailbox.uid_validity)
+        self.write(b"* OK [UIDNEXT %d] predicted next UID" % ((uids[-1] if uids else 0) + 1))
+        self.write(tag + b" OK [READ-ONLY] EXAMINE completed")
+
+    do_examine = do_select
+
+    def do_uid(self, tag, args):
+        match = _UID_COMMAND_RE.match(args)
+        if self.mailbox is None or match is None:
+            self.write(tag + b" BAD UID needs a selected mailbox and a UID set")
+            return
+        command, uid_set, items = match["command"].upper(), match["set"].decode(), match["items"] or b""
+        if command == b"SEARCH":
+            # Only the "UID <set>" criterion: `UID SEARCH UID 10:*`
+            uids = self.mailbox.uids(items.decode())
+            self.write(b"* SEARCH" + b"".join(b" %d" % uid for uid in uids))
+        elif command == b"FETCH":
+            all_uids = self.mailbox.uids("1:*")
+            fields = _HEADER_FIELDS_RE.search(items)
+            for uid in self.mailbox.uids(uid_set):
+                raw = self.mailbox.get(uid)
+                if fields:
+                    section = b"BODY[HEADER.FIELDS (%s)]" % fields[1]
+                    payload = _header_fields(raw, fields[1].split())
+                else:
+                    section, payload = b"BODY[]", raw
+                    self.server.stub.bodies_sent += 1
+                self.wfile.write(b"* %d FETCH (UID %d %s {%d}\r\n" % (all_uids.index(uid) + 1, uid, section, len(payload)))
+                self.wfile.write(payload + b")\r\n")
+        else:
+            self.write(tag + b" BAD unsupported UID command")
+            return
+        self.write(tag + b" OK UID completed")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StubIMAPServer:
+    """
+    In-process IMAP server for tests and benchmarks, listening on localhost (an ephemeral port by default).
+    Accounts are added with `add_mailbox`; every command can be delayed by `latency` seconds to imitate a
+    remote provider. Counts connections, logins, commands and message bodies sent.
+
+        with StubIMAPServer() as server:
+            server.add_mailbox("alice@example.com", "secret").append(raw_message)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.mailboxes = {}
+        self.latency = latency
+        self.connections = 0
+        self.logins = 0
+        self.bodies_sent = 0
+        self.commands = Counter()
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.stub = self
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def add_mailbox(self, username, password, uid_validity=1):
+        self.mailboxes[username] = StubMailbox(password, uid_validity)
+        return self.mailboxes[username]
+
+    def record(self, command, args):
+        with self._lock:
+            if command == "UID":
+                command = f"UID {args.split(b' ', 1)[0].upper().decode()}"
+            self.commands[command] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,213 @@
+# subscriptions/importer.py
+import hashlib
+import json
+import mailbox
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timezone as dt_timezone
+from email import policy
+from email.parser import BytesParser
+from email.utils import parsedate_to_datetime
+from itertools import islice
+from pathlib import Path
+from django.utils.dateparse import parse_datetime
+from SubFlo.sharding import for_user, shard_atomic
+from subscriptions.models import EmailMessage, EmailBody
+from subscriptions.search import get_search_backend
+from subscriptions.signals import bulk_changed
+
+MAX_HEADER_LENGTH = 255  # `subject`, `sender` and `message_id` are CharField(max_length=255)
+
+
+############################################################
+######################## Reading ###########################
+############################################################
+
+def read_sources(paths):
+    """
+    Streams raw messages from mbox, .eml and .jsonl files (directories are walked recursively).
+    Yields `(format, payload)` pairs; the payload stays unparsed so it can be shipped to a worker process.
+    """
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from read_sources(sorted(child for child in path.rglob("*") if child.is_file()))
+        elif path.suffix == ".eml":
+            yield "eml", path.read_bytes()
+        elif path.suffix in (".jsonl", ".ndjson"):
+            with path.open("rb") as lines:
+                for line in lines:
+                    if line.strip():
+                        yield "json", line
+        else:
+            box = mailbox.mbox(path, create=False)
+            try:
+                for key in box.iterkeys():
+                    yield "eml", box.get_bytes(key)
+            finally:
+                box.close()
+
+
+############################################################
+######################## Parsing ###########################
+############################################################
+
+def _content_hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8", "surrogateescape"))
+        digest.update(b"\0")
+    return f"sha256:{digest.hexdigest()}"
+
+
+def _aware(value):
+    if value is not None and value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return value
+
+
+def _parse_eml(raw):
+    message = BytesParser(policy=policy.default).parsebytes(raw)
+    body_part = message.get_body(preferencelist=("html", "plain"))
+    body = body_part.get_content() if body_part is not None else ""
+    return {
+        "message_id": (message.get("Message-ID") or "").strip().strip("<>"),
+        "subject": str(message.get("Subject") or ""),
+        "sender": str(message.get("From") or ""),
+        "received_date": parsedate_to_datetime(message["Date"]) if message["Date"] else None,
+        "raw_email_body": body,
+    }
+
+
+def _parse_json(raw):
+    data = json.loads(raw)
+    return {
+        "message_id": (data.get("message_id") or "").strip().strip("<>"),
+        "subject": data.get("subject") or "",
+        "sender": data.get("sender") or "",
+        "received_date": parse_datetime(data["received_date"]) if data.get("received_date") else None,
+        "raw_email_body": data.get("body") or data.get("raw_email_body") or "",
+    }
+
+
+def parse_message(item):
+    """
+    Parses one `(format, payload)` pair into `EmailMessage` field values, or returns None when it is unusable.
+    Runs in the worker processes, so it must not touch the database.
+    """
+    fmt, raw = item
+    try:
+        fields = _parse_eml(raw) if fmt == "eml" else _parse_json(raw)
+    except Exception:
+        return None
+    fields["received_date"] = _aware(fields["received_date"])
+    if fields["received_date"] is None:
+        return None
+    if not fields["message_id"]:
+        fields["message_id"] = _content_hash(
+            fields["sender"], fields["subject"], fields["received_date"].isoformat(), fields["raw_email_body"]
+        )
+    for name in ("message_id", "subject", "sender"):
+        fields[name] = fields[name][:MAX_HEADER_LENGTH]
+    return fields
+
+
+############################################################
+######################## Writing ###########################
+############################################################
+
+class ImportStats:
+
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.errors = 0
+        self.newest = None
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+
+class EmailImporter:
+    """
+    Imports parsed messages for one user.
+    Parsing is spread over a process pool while the previous batch is written, and every batch is one
+    `bulk_create(ignore_conflicts=True)` in its own transaction. Duplicates are dropped by the
+    `unique_user_message_id` constraint instead of a lookup per row.
+    Messages not newer than `UserProfile.last_processed_date` are skipped and the mark is moved to the
+    newest imported message at the end of a run, so repeated runs only touch new mail. Rows go to the
+    shard of the user.
+    """
+
+    def __init__(self, profile, batch_size=1000, workers=None, use_high_water_mark=True):
+        self.profile = profile
+        self.batch_size = batch_size
+        self.workers = workers
+        self.since = profile.last_processed_date if use_high_water_mark else None
+
+    def run(self, items):
+        stats = ImportStats()
+        items = iter(items)
+        batches = iter(lambda: list(islice(items, self.batch_size)), [])
+
+        if self.workers == 0:
+            for batch in batches:
+                self._write(map(parse_message, batch), stats)
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                # Parse batch N+1 in the pool while batch N is being written
+                pending = None
+                for batch in batches:
+                    parsed = pool.map(parse_message, batch, chunksize=max(1, len(batch) // 32))
+                    if pending is not None:
+                        self._write(pending, stats)
+                    pending = parsed
+                if pending is not None:
+                    self._write(pending, stats)
+
+        if stats.newest and (self.profile.last_processed_date is None or stats.newest > self.profile.last_processed_date):
+            self.profile.last_processed_date = stats.newest
+            self.profile.save(update_fields=["last_processed_date"])
+        return stats
+
+    def _write(self, parsed, stats):
+        messages = []
+        for fields in parsed:
+            stats.read += 1
+            if fields is None:
+                stats.errors += 1
+                continue
+            if self.since and fields["received_date"] <= self.since:
+                stats.skipped += 1
+                continue
+            if stats.newest is None or fields["received_date"] > stats.newest:
+                stats.newest = fields["received_date"]
+            messages.append(EmailMessage(id=uuid.uuid4(), user_id=self.profile.user_id, **fields))
+        if not messages:
+            return
+
+        with for_user(self.profile.user_id), shard_atomic():
+            EmailMessage.objects.bulk_create(messages, ignore_conflicts=True)
+            inserted_pks = set(
+                EmailMessage.objects.filter(pk__in=[message.pk for message in messages]).values_list("pk", flat=True)
+            )
+            EmailBody.objects.bulk_create(
+                EmailBody(email_message_id=message.pk, content=message.raw_email_body)
+                for message in messages if message.pk in inserted_pks
+            )
+            imported = len(inserted_pks)
+            inserted = EmailMessage.objects.filter(pk__in=inserted_pks)
+            # bulk_create sends no post_save: refresh the search index and notify the caches explicitly
+            get_search_backend().index_queryset(inserted)
+            if imported:
+                bulk_changed.send(sender=EmailImporter, model=EmailMessage, user_ids={self.profile.user_id})
+        stats.imported += imported
+        stats.duplicates += len(messages) - imported
@@ -0,0 +1,227 @@
+# subscriptions/linkcheck.py
+import asyncio
+import ipaddress
+import socket
+import ssl
+import time
+from datetime import timedelta
+from urllib.parse import quote, urljoin, urlsplit
+from django.conf import settings
+from django.utils import timezone
+from SubFlo.sharding import across_shards, data_aliases, on_shard
+from subscriptions.models import LinkCheck, Subscription, normalize_link
+from subscriptions.signals import bulk_changed
+
+DEFAULT_TTL = 60 * 60 * 24  # seconds a result is trusted before the link is checked again
+MAX_REDIRECTS = 5
+MAX_HEADER_LINES = 100
+USER_AGENT = "SubFlo-LinkChecker/1.0"
+# The links come from incoming emails: anyone can make the checker request them, so it only talks to public
+# web servers on the standard ports (no loopback, private, link-local or cloud metadata addresses)
+ALLOWED_PORTS = (80, 443)
+
+
+class BlockedURL(ValueError):
+    pass
+
+
+def is_public_address(address):
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not (
+        address.is_loopback or address.is_private or address.is_link_local or address.is_multicast
+        or address.is_reserved or address.is_unspecified
+    )
+
+
+def attach_link_checks(subscriptions):
+    """
+    Sets `link_check` (a `LinkCheck` or None) on every subscription of `subscriptions`, with one query.
+    """
+    subscriptions = list(subscriptions)
+    links = {subscription.unsubscribe_link for subscription in subscriptions if subscription.unsubscribe_link}
+    checks = {check.url: check for check in LinkCheck.objects.filter(url__in=links)} if links else {}
+    for subscription in subscriptions:
+        subscription.link_check = checks.get(subscription.unsubscribe_link)
+    return subscriptions
+
+
+class LinkCheckStats:
+
+    def __init__(self):
+        self.links = 0
+        self.checked = 0
+        self.ok = 0
+        self.dead = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.checked / self.elapsed if self.elapsed else 0.0
+
+
+class LinkChecker:
+    """
+    Checks the unsubscribe links of every subscription and stores the results in `LinkCheck`.
+
+    Links are collected from every shard and deduplicated (a link shared by many users is requested once),
+    and those checked less than `ttl` seconds ago are skipped. The others are requested `batch_size` at a
+    time on an asyncio loop: at most `concurrency` requests in flight, at most `per_host` of them to one
+    host, and `timeout` seconds per link, redirects included. A HEAD request is tried first (GET when the
+    server refuses HEAD); a final 2xx answer is OK, any other status is broken and no answer is unreachable.
+    Pages showing the links whose status changed are refreshed through `bulk_changed`.
+
+    Every request, redirects included, must go to one of `ALLOWED_PORTS`, and every address its host resolves
+    to must pass `is_public_address` (the connection then goes to one of those addresses, not to a new
+    lookup); other links are unreachable with a "Blocked" error. `trusted_hosts`, `(host, port)` pairs exempt
+    from these checks, is for stub servers.
+    """
+
+    def __init__(self, concurrency=20, per_host=2, timeout=10.0, batch_size=500, ttl=None, trusted_hosts=()):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.ttl = getattr(settings, "LINK_CHECK_TTL", DEFAULT_TTL) if ttl is None else ttl
+        self.trusted_hosts = set(trusted_hosts)
+
+    def run(self, recheck=False):
+        stats = LinkCheckStats()
+        links = set()
+        for queryset in across_shards(Subscription.objects.filter(unsubscribe_link__isnull=False)
+                                      .exclude(unsubscribe_link="").order_by().values_list("unsubscribe_link", flat=True)
+                                      .distinct()):
+            links.update(queryset)
+        if not recheck:
+            fresh = timezone.now() - timedelta(seconds=self.ttl)
+            links -= set(LinkCheck.objects.filter(checked_at__gte=fresh).values_list("url", flat=True))
+        stats.links = len(links)
+
+        # Links that only differ by their missing scheme are one URL
+        urls = {}
+        for link in sorted(links):
+            url = normalize_link(link)
+            if url is not None and urlsplit(url).scheme.lower() in ("http", "https"):
+                urls.setdefault(url, []).append(link)
+        pending = list(urls.items())
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            results = asyncio.run(self.check_many([url for url, _ in batch]))
+            self.save({link: results[url] for url, links in batch for link in links}, stats)
+        return stats
+
+    async def check_many(self, urls):
+        """Returns `{url: (status, status_code, error)}` for `urls`."""
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._hosts = {}
+        self._ssl = ssl.create_default_context()
+        results = await asyncio.gather(*(self.check(url) for url in urls))
+        return dict(zip(urls, results))
+
+    async def check(self, url):
+        try:
+            status_code = await asyncio.wait_for(self._follow(url), self.timeout)
+        except asyncio.TimeoutError:
+            return LinkCheck.UNREACHABLE, None, "Timed out"
+        except (OSError, ssl.SSLError, ValueError, UnicodeError) as error:
+            return LinkCheck.UNREACHABLE, None, (str(error) or type(error).__name__)[:255]
+        if status_code is None:
+            return LinkCheck.BROKEN, None, "Too many redirects"
+        return (LinkCheck.OK if 200 <= status_code < 300 else LinkCheck.BROKEN), status_code, ""
+
+    async def _follow(self, url):
+        for _ in range(MAX_REDIRECTS + 1):
+            status_code, location = await self._request(url, "HEAD")
+            if status_code in (405, 501):  # HEAD refused: ask again with GET, reading the headers only
+                status_code, location = await self._request(url, "GET")
+            if not 300 <= status_code < 400 or not location:
+                return status_code
+            url = urljoin(url, location)
+        return None
+
+    @staticmethod
+    async def _resolve(host, port):
+        """Returns an address of `host` to connect to, or raises `BlockedURL` unless all of them are public."""
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        # IPv6 addresses may carry a zone ("fe80::1%eth0")
+        addresses = [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+        if not addresses:
+            raise BlockedURL(f"Blocked: {host} does not resolve")
+        blocked = [address for address in addresses if not is_public_address(address)]
+        if blocked:
+            raise BlockedURL(f"Blocked: {host} resolves to {blocked[0]}")
+        return str(addresses[0])
+
+    async def _request(self, url, method):
+        parts = urlsplit(url)
+        if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+            raise BlockedURL("Blocked: not an http(s) URL")
+        https = parts.scheme.lower() == "https"
+        host = parts.hostname.encode("idna").decode()
+        port = parts.port or (443 if https else 80)
+        path = quote(parts.path or "/", safe="/%:@!$&'()*+,;=~-._") + (f"?{parts.query}" if parts.query else "")
+        per_host = self._hosts.setdefault((host, port), asyncio.Semaphore(self.per_host))
+        # The host's slot first: a request waiting on a busy host must not hold one of the global slots
+        async with per_host, self._slots:
+            if (host, port) in self.trusted_hosts:
+                address = host
+            elif port not in ALLOWED_PORTS:
+                raise BlockedURL(f"Blocked: port {port}")
+            else:
+                # Connecting to the checked address: resolving the name again could answer differently
+                address = await self._resolve(host, port)
+            reader, writer = await asyncio.open_connection(
+                address, port, ssl=self._ssl if https else None, server_hostname=host if https else None,
+            )
+            try:
+                writer.write(
+                    f"{method} {path} HTTP/1.1\r\nHost: {host}{'' if parts.port is None else f':{port}'}\r\n"
+                    f"User-Agent: {USER_AGENT}\r\nAccept: */*\r\nConnection: close\r\n\r\n".encode()
+                )
+                await writer.drain()
+                status_line = (await reader.readline()).decode("latin-1").split()
+                if len(status_line) < 2 or not status_line[1].isdigit():
+                    raise ValueError("Not an HTTP response")
+                location = None
+                for _ in range(MAX_HEADER_LINES):
+                    line = (await reader.readline()).decode("latin-1").strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(":")
+                    if name.strip().lower() == "location":
+                        location = value.strip()
+                return int(status_line[1]), location
+            finally:
+                writer.close()
+
+    def save(self, results, stats):
+        """
+        Stores `{link: (status, status_code, error)}` and refreshes the pages of the users whose links changed
+        status.
+        """
+        now = timezone.now()
+        previous = dict(LinkCheck.objects.filter(url__in=results).values_list("url", "status"))
+        LinkCheck.objects.bulk_create(
+            [LinkCheck(url=link, status=status, status_code=status_code, error=error, checked_at=now)
+             for link, (status, status_code, error) in results.items()],
+            update_conflicts=True,
+            unique_fields=["url"],
+            update_fields=["status", "status_code", "error", "checked_at"],
+        )
+        stats.checked += len(results)
+        stats.ok += sum(1 for status, _, _ in results.values() if status == LinkCheck.OK)
+        stats.dead += sum(1 for status, _, _ in results.values() if status != LinkCheck.OK)
+
+        changed = [link for link, (status, _, _) in results.items() if previous.get(link) != status]
+        if not changed:
+            return
+        for alias in data_aliases():
+            with on_shard(alias):
+                user_ids = set(Subscription.objects.filter(unsubscribe_link__in=changed).values_list("user_id", flat=True))
+                if user_ids:
+                    # Only the link status changed: no rollup or renewal date to recompute
+                    bulk_changed.send(sender=LinkChecker, model=Subscription, user_ids=user_ids, fields=set())
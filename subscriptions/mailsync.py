@@ -0,0 +1,302 @@
+# subscriptions/mailsync.py
+import imaplib
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from email import policy
+from email.parser import BytesParser
+from typing import NamedTuple
+from django.conf import settings
+from django.utils.module_loading import import_string
+from subscriptions.importer import EmailImporter
+from subscriptions.prefilter import SubscriptionPrefilter
+
+# Headers fetched for every new message; the body is only fetched for the candidates among them
+HEADER_FIELDS = ("FROM", "SUBJECT", "DATE", "MESSAGE-ID")
+# UIDs per FETCH command
+FETCH_CHUNK_SIZE = 500
+
+DEFAULT_CREDENTIALS = "subscriptions.mailsync.shared_password_credentials"
+
+_UID_RE = re.compile(rb"\bUID (\d+)")
+
+
+class MailboxAccount(NamedTuple):
+    host: str
+    port: int
+    ssl: bool
+    username: str
+    password: str
+
+
+def shared_password_credentials(profile):
+    """
+    Default `MAIL_SYNC_CREDENTIALS`: logs in as the user's email address with `MAIL_SYNC_IMAP_PASSWORD`
+    (a mail proxy or the stub server); users without an address are skipped.
+    """
+    if not profile.user.email:
+        return None
+    return profile.user.email, settings.MAIL_SYNC_IMAP_PASSWORD
+
+
+def get_account(profile):
+    """Returns the `MailboxAccount` of `profile`, or None when it has no mailbox to sync."""
+    credentials = import_string(getattr(settings, "MAIL_SYNC_CREDENTIALS", DEFAULT_CREDENTIALS))(profile)
+    if credentials is None:
+        return None
+    return MailboxAccount(settings.MAIL_SYNC_IMAP_HOST, settings.MAIL_SYNC_IMAP_PORT, settings.MAIL_SYNC_IMAP_SSL,
+                          *credentials)
+
+
+class IMAPConnectionPool:
+    """
+    Keeps logged-in IMAP connections per account between syncs, so a periodic sync does not pay a TLS
+    handshake and a LOGIN per user and per run. At most `max_idle` connections wait per account; idle ones
+    older than `idle_timeout` seconds are dropped, and the others are checked with a NOOP before reuse.
+    A connection that failed mid-command is closed instead of being returned.
+    """
+
+    def __init__(self, max_idle=2, idle_timeout=300, timeout=30):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    def _open(self, account):
+        cls = imaplib.IMAP4_SSL if account.ssl else imaplib.IMAP4
+        client = cls(account.host, account.port, timeout=self.timeout)
+        try:
+            client.login(account.username, account.password)
+        except Exception:
+            client.shutdown()
+            raise
+        with self.lock:
+            self.opened += 1
+        return client
+
+    def _take(self, account):
+        while True:
+            with self.lock:
+                idle = self.idle.get(account)
+                if not idle:
+                    return None
+                client, since = idle.pop()
+            if time.monotonic() - since < self.idle_timeout:
+                try:
+                    client.noop()
+                    return client
+                except (imaplib.IMAP4.error, OSError):
+                    pass
+            self._close(client)
+
+    @contextmanager
+    def connection(self, account):
+        client = self._take(account) or self._open(account)
+        try:
+            yield client
+        except BaseException:
+            self._close(client)
+            raise
+        with self.lock:
+            idle = self.idle.setdefault(account, deque())
+            if len(idle) < self.max_idle:
+                idle.append((client, time.monotonic()))
+                return
+        self._close(client)
+
+    @staticmethod
+    def _close(client):
+        try:
+            client.logout()
+        except Exception:
+            client.shutdown()
+
+    def close_all(self):
+        with self.lock:
+            clients = [client for idle in self.idle.values() for client, _ in idle]
+            self.idle.clear()
+        for client in clients:
+            self._close(client)
+
+
+class MailboxFetch(NamedTuple):
+    """One chunk of a mailbox: `headers` messages looked at, up to UID `last_uid`, and the candidates among them."""
+    uid_validity: int
+    last_uid: int
+    headers: int
+    messages: list
+
+
+class SyncStats:
+
+    def __init__(self):
+        self.users = 0
+        self.failed = 0
+        self.headers = 0
+        self.bodies = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.headers / self.elapsed if self.elapsed else 0.0
+
+
+class MailboxSyncer:
+    """
+    Incremental IMAP sync of the INBOX of every user who granted email access.
+
+    Every user resumes after `UserProfile.imap_last_uid` (from scratch when the mailbox's UIDVALIDITY
+    changed). The new messages are worked through `FETCH_CHUNK_SIZE` UIDs at a time: their headers are
+    fetched with one command, then the messages `candidate_filter` accepts on their sender and subject are
+    fetched in full with another; the others are never downloaded or stored. `candidate_filter=False`
+    downloads everything.
+    Up to `concurrency` mailboxes are fetched at once in threads, on connections from `pool`, and every chunk
+    is handed to the calling thread as soon as it arrives (at most `concurrency * 2` chunks wait). There it is
+    written by `EmailImporter`, `batch_size` per transaction, and the UID mark moves past the chunk: memory
+    does not grow with the size of a mailbox, and a sync that fails halfway resumes after the last stored chunk.
+    """
+
+    def __init__(self, pool=None, concurrency=8, batch_size=1000, candidate_filter=None, max_messages=None):
+        self.pool = pool or IMAPConnectionPool()
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.candidate_filter = SubscriptionPrefilter() if candidate_filter is None else candidate_filter
+        self.max_messages = max_messages
+
+    def run(self, profiles):
+        """
+        Syncs `profiles` (an iterable of `UserProfile`) and returns a `SyncStats`.
+        """
+        stats = SyncStats()
+        jobs = ((profile, get_account(profile)) for profile in profiles)
+        chunks = queue.Queue(maxsize=self.concurrency * 2)
+        cancelled = threading.Event()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            try:
+                in_flight = 0
+                for profile, account in jobs:
+                    if account is None:
+                        continue
+                    # A bounded number of mailboxes in flight keeps memory flat whatever the number of users
+                    while in_flight >= self.concurrency:
+                        in_flight -= self._collect(chunks, stats)
+                    executor.submit(self._fetch_into, chunks, cancelled, profile, account)
+                    in_flight += 1
+                while in_flight:
+                    in_flight -= self._collect(chunks, stats)
+            finally:
+                # Stops the fetches still running (they would wait on the queue forever) when storing failed
+                cancelled.set()
+        return stats
+
+    def _fetch_into(self, chunks, cancelled, profile, account):
+        """
+        Puts every chunk of the mailbox of `profile` on `chunks`, then `None` or the error that stopped the fetch.
+        """
+        def put(item):
+            while not cancelled.is_set():
+                try:
+                    chunks.put((profile, item), timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            # Closing the generator gives its connection back when the sync is cancelled
+            with closing(self.fetch(account, profile.imap_uid_validity, profile.imap_last_uid)) as fetched_chunks:
+                for fetched in fetched_chunks:
+                    if not put(fetched):
+                        return
+        except BaseException as error:
+            put(error)
+            return
+        put(None)
+
+    def _collect(self, chunks, stats):
+        """
+        Stores the next chunk waiting on `chunks`. Returns 1 when it was the end of a mailbox, 0 otherwise.
+        """
+        profile, item = chunks.get()
+        if isinstance(item, MailboxFetch):
+            self.store(profile, item, stats)
+            return 0
+        if isinstance(item, (imaplib.IMAP4.error, OSError)):
+            stats.failed += 1
+            stats.errors.append((profile.pk, str(item)))
+        elif item is not None:
+            raise item
+        else:
+            stats.users += 1
+        return 1
+
+    def fetch(self, account, uid_validity=None, last_uid=0):
+        """
+        Yields the messages of `account` newer than `last_uid`, as one `MailboxFetch` per `FETCH_CHUNK_SIZE`
+        UIDs (a single empty one when there is nothing new). Runs in a worker thread: no database access.
+        """
+        with self.pool.connection(account) as client:
+            self._check(client.select("INBOX", readonly=True))
+            current_validity = int(client.response("UIDVALIDITY")[1][0])
+            if current_validity != uid_validity:
+                last_uid = 0  # UIDs of another mailbox generation mean nothing
+            data = self._check(client.uid("SEARCH", None, f"UID {last_uid + 1}:*"))
+            # "n:*" always includes the last message, even when its UID is below n
+            uids = [uid for uid in map(int, data[0].split()) if uid > last_uid]
+            if self.max_messages is not None:
+                uids = uids[:self.max_messages]
+            if not uids:
+                yield MailboxFetch(current_validity, last_uid, 0, [])
+                return
+
+            items = f"(UID BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})])"
+            for start in range(0, len(uids), FETCH_CHUNK_SIZE):
+                chunk = uids[start:start + FETCH_CHUNK_SIZE]
+                candidates = [uid for uid, headers in self._fetch(client, chunk, items) if self._is_candidate(headers)]
+                messages = [raw for _, raw in self._fetch(client, candidates, "(UID BODY.PEEK[])")]
+                yield MailboxFetch(current_validity, chunk[-1], len(chunk), messages)
+
+    def _fetch(self, client, uids, items):
+        if not uids:
+            return []
+        data = self._check(client.uid("FETCH", ",".join(map(str, uids)), items))
+        return [(int(_UID_RE.search(part[0])[1]), part[1]) for part in data if isinstance(part, tuple)]
+
+    def _is_candidate(self, headers):
+        if not self.candidate_filter:
+            return True
+        message = BytesParser(policy=policy.default).parsebytes(headers, headersonly=True)
+        return self.candidate_filter.accepts({
+            "sender": str(message.get("From") or ""), "subject": str(message.get("Subject") or ""), "raw_email_body": "",
+        })
+
+    @staticmethod
+    def _check(response):
+        status, data = response
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"IMAP command failed: {data!r}")
+        return data
+
+    def store(self, profile, fetched, stats):
+        importer = EmailImporter(profile, batch_size=self.batch_size, workers=0, use_high_water_mark=False)
+        result = importer.run(("eml", raw) for raw in fetched.messages)
+        stats.headers += fetched.headers
+        stats.bodies += len(fetched.messages)
+        stats.imported += result.imported
+        stats.duplicates += result.duplicates
+        if (fetched.uid_validity, fetched.last_uid) != (profile.imap_uid_validity, profile.imap_last_uid):
+            profile.imap_uid_validity, profile.imap_last_uid = fetched.uid_validity, fetched.last_uid
+            profile.save(update_fields=["imap_uid_validity", "imap_last_uid"])
@@ -0,0 +1,90 @@
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from subscriptions.fields import compress_text
+from subscriptions.synthetic import fake_body
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the email storage layouts on throwaway SQLite files: bodies inline in the email table "
+        "versus compressed in a separate table. Reports database size (the full-text index, which keeps its own "
+        "uncompressed copy of every body whatever the layout, included and shown apart) and list/scan/detail "
+        "query times."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--emails", type=int, default=20_000, help="Number of synthetic emails.")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per timed query (best is reported).")
+        parser.add_argument("--seed", type=int, default=490)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        rows = [
+            ("%032x" % i, f"Your receipt #{i}", "billing@example.com", f"2026-01-01 00:{i % 60:02d}:00", fake_body(rng))
+            for i in range(options["emails"])
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            results = [
+                ("inline TEXT body", self.measure(os.path.join(directory, "inline.sqlite3"), rows, False, options["repeat"])),
+                ("compressed EmailBody", self.measure(os.path.join(directory, "split.sqlite3"), rows, True, options["repeat"])),
+            ]
+
+        self.stdout.write(f"{options['emails']} emails")
+        self.stdout.write(
+            f"{'layout':<22}{'size (MB)':>12}{'of it FTS':>12}{'list (ms)':>12}{'scan (ms)':>12}{'detail (ms)':>13}"
+        )
+        for name, (size, fts_size, list_ms, scan_ms, detail_ms) in results:
+            self.stdout.write(
+                f"{name:<22}{size / 2 ** 20:>12.1f}{fts_size / 2 ** 20:>12.1f}"
+                f"{list_ms:>12.2f}{scan_ms:>12.2f}{detail_ms:>13.3f}"
+            )
+
+    def measure(self, path, rows, split, repeat):
+        db = sqlite3.connect(path)
+        body_column = "" if split else ", raw_email_body TEXT NOT NULL"
+        db.execute(
+            "CREATE TABLE email (id CHAR(32) PRIMARY KEY, subject VARCHAR(255), sender VARCHAR(255), "
+            f"received_date DATETIME{body_column})"
+        )
+        db.execute("CREATE TABLE body (email_id CHAR(32) PRIMARY KEY, content BLOB NOT NULL)")
+        with db:
+            if split:
+                db.executemany("INSERT INTO email VALUES (?, ?, ?, ?)", [row[:4] for row in rows])
+                db.executemany("INSERT INTO body VALUES (?, ?)", [(row[0], compress_text(row[4], "zlib")) for row in rows])
+            else:
+                db.executemany("INSERT INTO email VALUES (?, ?, ?, ?, ?)", rows)
+        db.execute("VACUUM")
+        tables_size = os.path.getsize(path)
+
+        # The search index of the application (see SQLiteFTS5Backend), the same in both layouts
+        db.execute(
+            "CREATE VIRTUAL TABLE email_fts USING fts5(object_id UNINDEXED, user_id UNINDEXED, subject, sender, body, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        with db:
+            db.executemany("INSERT INTO email_fts VALUES (?, 1, ?, ?, ?)", [(row[0], row[1], row[2], row[4]) for row in rows])
+        db.execute("VACUUM")
+
+        def best(sql, params=()):
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                db.execute(sql, params).fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            return min(timings)
+
+        # Email list page, a full model scan (admin changelist / joins without .values()), one detail page
+        list_ms = best("SELECT id, subject, sender, received_date FROM email ORDER BY received_date DESC LIMIT 50")
+        scan_ms = best("SELECT * FROM email")
+        detail_id = rows[len(rows) // 2][0]
+        if split:
+            detail_ms = best("SELECT * FROM email LEFT JOIN body ON body.email_id = email.id WHERE email.id = ?", (detail_id,))
+        else:
+            detail_ms = best("SELECT * FROM email WHERE id = ?", (detail_id,))
+        db.close()
+        size = os.path.getsize(path)
+        return size, size - tables_size, list_ms, scan_ms, detail_ms
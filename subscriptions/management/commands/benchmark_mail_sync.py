@@ -0,0 +1,86 @@
+import random
+from datetime import timedelta
+from email.message import EmailMessage as MIMEMessage
+from email.utils import format_datetime, make_msgid
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+from accounts.models import UserProfile
+from accounts.onboarding import onboard_users
+from SubFlo.benchmarking import throwaway_environment
+from SubFlo.sharding import data_aliases, on_shard
+from subscriptions.imapstub import StubIMAPServer
+from subscriptions.mailsync import IMAPConnectionPool, MailboxSyncer
+from subscriptions.models import EmailMessage
+from subscriptions.synthetic import PLATFORMS, fake_body, platform_domain
+
+PASSWORD = "benchmark"
+
+
+def fake_message(rng, n):
+    """A raw email: a receipt from a known platform, or (one time in three) an unrelated newsletter."""
+    message = MIMEMessage()
+    if rng.random() < 2 / 3:
+        platform = rng.choice(PLATFORMS)
+        message["From"] = f"{platform} <billing@{platform_domain(platform)}>"
+        message["Subject"] = f"Your {platform} receipt"
+        message.set_content(fake_body(rng, platform), subtype="html")
+    else:
+        message["From"] = "Weekly Digest <news@digest.example.org>"
+        message["Subject"] = f"Issue #{n}: this week's stories"
+        message.set_content("<p>Stories you may like.</p>" * 200, subtype="html")
+    message["Date"] = format_datetime(timezone.now() - timedelta(minutes=n))
+    message["Message-ID"] = make_msgid(idstring=str(n), domain="benchmark.example")
+    return message.as_bytes()
+
+
+class Command(BaseCommand):
+    help = (
+        "Syncs synthetic mailboxes from an in-process IMAP stub server that delays every command, one mailbox "
+        "at a time, then in parallel, then again with nothing new (incremental run on pooled connections). "
+        "Runs on throwaway test databases."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20, help="Mailboxes.")
+        parser.add_argument("--messages", type=int, default=200, help="Messages per mailbox.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Mailboxes fetched at once in the parallel runs.")
+        parser.add_argument("--latency", type=float, default=0.02, help="Seconds the server waits per command.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["concurrency"] < 1:
+            raise CommandError("--users and --concurrency must be positive.")
+
+        rng = random.Random(options["seed"])
+        server = StubIMAPServer(latency=options["latency"])
+        for user in range(options["users"]):
+            mailbox = server.add_mailbox(f"bench{user}@example.com", PASSWORD)
+            for n in range(options["messages"]):
+                mailbox.append(fake_message(rng, n))
+
+        with throwaway_environment():
+            with server, override_settings(MAIL_SYNC_IMAP_HOST=server.host, MAIL_SYNC_IMAP_PORT=server.port,
+                                           MAIL_SYNC_IMAP_SSL=False, MAIL_SYNC_IMAP_PASSWORD=PASSWORD):
+                onboard_users({"username": f"bench{user}", "email": f"bench{user}@example.com",
+                               "email_access_granted": True} for user in range(options["users"]))
+                self.stdout.write(f"{options['users']} mailboxes of {options['messages']} messages, "
+                                  f"{options['latency'] * 1000:.0f} ms per IMAP command")
+                self.stdout.write(f"{'run':<14}{'seconds':>9}{'messages/s':>12}{'downloaded':>12}{'imported':>10}"
+                                  f"{'logins':>8}")
+                pool = IMAPConnectionPool()
+                runs = (("sequential", 1, True), ("parallel", options["concurrency"], True),
+                        ("incremental", options["concurrency"], False))
+                for name, concurrency, reset in runs:
+                    if reset:
+                        for alias in data_aliases():
+                            with on_shard(alias):
+                                EmailMessage.objects.all().delete()
+                        UserProfile.objects.update(imap_uid_validity=None, imap_last_uid=0, last_processed_date=None)
+                        pool.close_all()
+                    logins = server.logins
+                    stats = MailboxSyncer(pool, concurrency=concurrency).run(
+                        UserProfile.objects.select_related("user").order_by("user_id"))
+                    self.stdout.write(f"{name:<14}{stats.elapsed:>9.2f}{stats.rate:>12.0f}{stats.bodies:>12}"
+                                      f"{stats.imported:>10}{server.logins - logins:>8}")
+                pool.close_all()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from subscriptions.linkcheck import LinkChecker
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests the unsubscribe link of every subscription (each distinct link once) and records whether it "
+        "still works, for the dashboard to flag dead ones. Links checked within settings.LINK_CHECK_TTL are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=20, help="Requests in flight at once.")
+        parser.add_argument("--per-host", type=int, default=2, help="Requests in flight at once to one host.")
+        parser.add_argument("--timeout", type=float, default=10.0, help="Seconds per link, redirects included.")
+        parser.add_argument("--batch-size", type=int, default=500, help="Links checked and saved per batch.")
+        parser.add_argument("--all", action="store_true", help="Also check the links whose result is still fresh.")
+
+    def handle(self, *args, **options):
+        for name in ("concurrency", "per_host", "batch_size"):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be positive.")
+        if options["timeout"] <= 0:
+            raise CommandError("--timeout must be positive.")
+
+        checker = LinkChecker(
+            concurrency=options["concurrency"],
+            per_host=options["per_host"],
+            timeout=options["timeout"],
+            batch_size=options["batch_size"],
+        )
+        stats = checker.run(recheck=options["all"])
+        self.stdout.write(f"Checked {stats.checked} of {stats.links} links: {stats.ok} OK, {stats.dead} dead.")
+        self.stdout.write(self.style.SUCCESS(f"Done in {stats.elapsed:.2f}s ({stats.rate:.0f} links/s)."))
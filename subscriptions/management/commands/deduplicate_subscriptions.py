@@ -0,0 +1,41 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from subscriptions.dedup import DEFAULT_BATCH_USERS, DEFAULT_WINDOW, SubscriptionDeduplicator
+
+
+class Command(BaseCommand):
+    help = (
+        "Merges subscriptions recorded several times under different spellings (\"Netflix\"/\"NETFLIX Inc.\"). "
+        "Extraction already deduplicates the users it touches; run this after editing the canonical names "
+        "or importing subscriptions another way."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", action="append", dest="usernames", help="Only this user (repeatable).")
+        parser.add_argument("--similarity", type=float, help="Smallest name similarity, 0-1 (default: settings.SUBSCRIPTION_DEDUP_SIMILARITY).")
+        parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="Neighbours compared with every row.")
+        parser.add_argument("--batch-users", type=int, default=DEFAULT_BATCH_USERS, help="Users merged per transaction.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be merged.")
+
+    def handle(self, *args, **options):
+        if options["similarity"] is not None and not 0 < options["similarity"] <= 1:
+            raise CommandError("--similarity must be between 0 and 1.")
+        if options["window"] < 2:
+            raise CommandError("--window must be at least 2.")
+
+        user_ids = None
+        if options["usernames"]:
+            users = dict(User.objects.filter(username__in=options["usernames"]).values_list("username", "pk"))
+            missing = set(options["usernames"]) - set(users)
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}.")
+            user_ids = users.values()
+
+        deduplicator = SubscriptionDeduplicator(similarity=options["similarity"], window=options["window"],
+                                                batch_users=options["batch_users"], dry_run=options["dry_run"])
+        stats = deduplicator.run(user_ids)
+        verb = "Would merge" if options["dry_run"] else "Merged"
+        self.stdout.write(f"Scanned {stats.scanned} subscriptions of {stats.users} users in {stats.elapsed:.2f}s.")
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats.merged} duplicates into {stats.clusters} subscriptions."
+        ))
@@ -0,0 +1,57 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from subscriptions.exports import EXPORT_MODELS, FORMATS, parse_filters, stream_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams subscriptions or emails to a CSV or NDJSON file (stdout by default), optionally gzipped. "
+        "Memory use does not depend on the number of rows. Rows come in `updated_at` order, so the largest "
+        "`updated_at` of one export is the --since of the next."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(EXPORT_MODELS), help="What to export.")
+        parser.add_argument("--user", help="Only the rows of this user (default: every user, with a user_id column).")
+        parser.add_argument("--format", choices=sorted(FORMATS), default="csv", help="Output format.")
+        parser.add_argument("--from", dest="date_from", help="First start date (subscriptions) or received date (emails), YYYY-MM-DD.")
+        parser.add_argument("--to", dest="date_to", help="Last start date or received date, YYYY-MM-DD.")
+        parser.add_argument("--since", help="Only rows written after this ISO 8601 date or datetime.")
+        parser.add_argument("--parsed-data", action="store_true", help="Add the LLM output (parsed_data) column.")
+        parser.add_argument("--gzip", action="store_true", help="Gzip the output.")
+        parser.add_argument("--output", "-o", help="File to write (default: stdout).")
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_filters(options["date_from"], options["date_to"], options["since"])
+        except ValueError as error:
+            raise CommandError(str(error))
+        if options["user"]:
+            try:
+                filters["user_id"] = User.objects.get(username=options["user"]).pk
+            except User.DoesNotExist:
+                raise CommandError(f"Unknown user: {options['user']}.")
+
+        chunks = stream_export(options["kind"], options["format"], compress=options["gzip"],
+                               parsed_data=options["parsed_data"], **filters)
+        if options["output"]:
+            with open(options["output"], "wb") as output:
+                written = self._write(chunks, output.write)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}."))
+            return
+
+        stream = self.stdout._out
+        if hasattr(stream, "buffer"):
+            self._write(chunks, stream.buffer.write)
+            stream.buffer.flush()
+        elif options["gzip"]:
+            raise CommandError("This output only takes text: use --output to write gzipped data.")
+        else:
+            self._write((chunk.decode() for chunk in chunks), stream.write)
+
+    def _write(self, chunks, write):
+        written = 0
+        for chunk in chunks:
+            write(chunk)
+            written += len(chunk)
+        return written
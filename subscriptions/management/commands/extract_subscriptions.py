@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from subscriptions.extraction import ExtractionWorker, StubLLMClient, get_llm_client
+from subscriptions.prefilter import ExtractionCache, SubscriptionPrefilter
+
+
+class Command(BaseCommand):
+    help = "Runs the LLM over unparsed email messages and upserts the subscriptions it finds."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100, help="Emails fetched and written per batch.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Maximum LLM calls in flight.")
+        parser.add_argument("--rate", type=float, default=None, help="Maximum LLM calls per second.")
+        parser.add_argument("--limit", type=int, default=None, help="Stop after this many emails.")
+        parser.add_argument("--stub-latency", type=float, default=None,
+                            help="Use the offline stub client with this latency in seconds (benchmarking).")
+        parser.add_argument("--no-prefilter", action="store_true",
+                            help="Send every email to the LLM, even obviously unrelated ones.")
+        parser.add_argument("--cache-size", type=int, default=10_000,
+                            help="Extraction results kept for near-identical emails (0 disables the cache).")
+
+    def handle(self, *args, **options):
+        if options["stub_latency"] is not None:
+            client = StubLLMClient(latency=options["stub_latency"])
+        else:
+            client = get_llm_client()
+
+        worker = ExtractionWorker(
+            client,
+            batch_size=options["batch_size"],
+            concurrency=options["concurrency"],
+            rate=options["rate"],
+            prefilter=None if options["no_prefilter"] else SubscriptionPrefilter(),
+            cache=ExtractionCache(options["cache_size"]) if options["cache_size"] > 0 else None,
+        )
+        stats = worker.run(limit=options["limit"])
+
+        self.stdout.write(
+            f"Processed {stats.processed} emails ({stats.failed} failed), "
+            f"upserted {stats.subscriptions} subscriptions."
+        )
+        self.stdout.write(
+            f"Prefilter skipped {stats.skipped} ({stats.skip_rate:.1%}), "
+            f"cache hits {stats.cache_hits} ({stats.cache_hit_rate:.1%}), "
+            f"LLM calls {stats.llm_calls} ({stats.failures} failed)."
+        )
+        self.stdout.write(
+            f"LLM latency p50={stats.percentile(50) * 1000:.1f}ms p95={stats.percentile(95) * 1000:.1f}ms "
+            f"p99={stats.percentile(99) * 1000:.1f}ms"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Done in {stats.elapsed:.2f}s ({stats.rate:.1f} emails/s)."
+        ))
@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand
+from subscriptions.synthetic import SyntheticDataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a synthetic dataset for load and scale testing: users with profiles, subscriptions and "
+        "emails with realistic bodies. Running it again grows the existing synthetic dataset to --users."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100, help="Total number of synthetic users.")
+        parser.add_argument("--subscriptions", type=int, default=10, help="Subscriptions per user.")
+        parser.add_argument("--emails", type=int, default=50, help="Emails per user.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-users", type=int, default=100, help="Users written per transaction.")
+        parser.add_argument("--clear", action="store_true", help="Delete the existing synthetic dataset first.")
+
+    def handle(self, *args, **options):
+        dataset = SyntheticDataset(
+            subscriptions_per_user=options["subscriptions"],
+            emails_per_user=options["emails"],
+            seed=options["seed"],
+            batch_users=options["batch_users"],
+        )
+        if options["clear"]:
+            deleted, _ = dataset.delete()
+            self.stdout.write(f"Deleted {deleted} synthetic rows.")
+
+        started = time.perf_counter()
+        created = dataset.grow_to(options["users"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {created} users ({created * options['subscriptions']} subscriptions, "
+            f"{created * options['emails']} emails) in {time.perf_counter() - started:.2f}s."
+        ))
@@ -0,0 +1,39 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from accounts.models import UserProfile
+from subscriptions.importer import EmailImporter, read_sources
+
+
+class Command(BaseCommand):
+    help = "Imports a user's email messages from mbox, .eml and .jsonl files in batches, skipping duplicates."
+
+    def add_arguments(self, parser):
+        parser.add_argument("user_id", help="Profile UUID of the user who owns the messages.")
+        parser.add_argument("paths", nargs="+", help="mbox files, .eml/.jsonl files or directories.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Messages written per transaction.")
+        parser.add_argument("--workers", type=int, default=None,
+                            help="Parser processes (default: one per CPU, 0 parses in this process).")
+        parser.add_argument("--full", action="store_true",
+                            help="Ignore the user's last processed date and consider every message.")
+
+    def handle(self, *args, **options):
+        try:
+            profile = UserProfile.objects.get(id=options["user_id"])
+        except (UserProfile.DoesNotExist, ValidationError):
+            raise CommandError(f"This user_id ({options['user_id']}) does not exist.")
+
+        importer = EmailImporter(
+            profile,
+            batch_size=options["batch_size"],
+            workers=options["workers"],
+            use_high_water_mark=not options["full"],
+        )
+        stats = importer.run(read_sources(options["paths"]))
+
+        self.stdout.write(
+            f"Read {stats.read} messages: {stats.imported} imported, {stats.duplicates} duplicates, "
+            f"{stats.skipped} already processed, {stats.errors} unreadable."
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Done in {stats.elapsed:.2f}s ({stats.rate:.0f} messages/s)."
+        ))
@@ -0,0 +1,32 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from subscriptions.renewals import DEFAULT_BATCH_SIZE, RenewalNotifier
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes renewal, trial-end and expiry notifications for every subscription due within the notification "
+        "windows. Meant to run daily from a scheduler (cron, systemd timer); reruns never duplicate notifications."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--windows", help="Comma-separated days ahead (default: settings.RENEWAL_NOTIFICATION_WINDOWS).")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Subscriptions read per query.")
+        parser.add_argument("--today", help="Run as of this date (YYYY-MM-DD), e.g. to catch up on a missed day.")
+
+    def handle(self, *args, **options):
+        try:
+            windows = [int(window) for window in options["windows"].split(",")] if options["windows"] else None
+            today = date.fromisoformat(options["today"]) if options["today"] else None
+        except ValueError as error:
+            raise CommandError(str(error))
+        if windows is not None and min(windows) < 0:
+            raise CommandError("Windows must not be negative.")
+
+        notifier = RenewalNotifier(windows=windows, batch_size=options["batch_size"])
+        stats = notifier.run(today)
+        self.stdout.write(
+            f"Moved past renewal dates forward for {stats.advanced} users; {stats.scanned} subscriptions due "
+            f"within {max(notifier.windows)} days."
+        )
+        self.stdout.write(self.style.SUCCESS(f"Wrote {stats.notified} new notifications in {stats.elapsed:.2f}s."))
@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from accounts.models import UserProfile
+from SubFlo.sharding import placement, shard_aliases, sharding_enabled
+from subscriptions.rebalance import DEFAULT_CATCH_UP_PASSES, RebalanceError, ShardRebalancer
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves users between shards while the site keeps serving them. By default every user whose shard "
+        "differs from their placement among settings.DATABASE_SHARDS is moved (after a shard was added, or to "
+        "move the users created before sharding out of the catalog). Migrate new shard databases first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", action="append", dest="usernames", help="Only this user (repeatable).")
+        parser.add_argument("--to", help="Shard to move the selected users to (default: their placement).")
+        parser.add_argument("--limit", type=int, help="Move at most this many users.")
+        parser.add_argument("--batch-users", type=int, default=50, help="Users switched before each grace period.")
+        parser.add_argument("--grace", type=float, help="Seconds before the old copies are deleted (default: SHARD_DIRECTORY_TTL + 1).")
+        parser.add_argument("--catch-up-passes", type=int, default=DEFAULT_CATCH_UP_PASSES,
+                            help="Copies of the rows written during the move before the final, locked one.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report the users that would move.")
+
+    def handle(self, *args, **options):
+        if not sharding_enabled():
+            raise CommandError("Sharding is off: settings.DATABASE_SHARDS is empty.")
+        if options["to"] and options["to"] not in shard_aliases():
+            raise CommandError(f"Unknown shard {options['to']!r}; shards: {', '.join(shard_aliases())}.")
+        if options["batch_users"] < 1:
+            raise CommandError("--batch-users must be positive.")
+
+        profiles = UserProfile.objects.order_by("user_id")
+        if options["usernames"]:
+            found = set(User.objects.filter(username__in=options["usernames"]).values_list("username", flat=True))
+            missing = set(options["usernames"]) - found
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}.")
+            profiles = profiles.filter(user__username__in=options["usernames"])
+
+        moves = []
+        for user_id, profile_id, shard in profiles.values_list("user_id", "id", "shard").iterator():
+            target = options["to"] or placement(profile_id)
+            if shard != target:
+                moves.append((user_id, target))
+                if options["limit"] and len(moves) >= options["limit"]:
+                    break
+
+        if options["dry_run"]:
+            self.stdout.write(f"Would move {len(moves)} users.")
+            return
+        rebalancer = ShardRebalancer(grace=options["grace"], catch_up_passes=options["catch_up_passes"],
+                                     batch_users=options["batch_users"])
+        try:
+            stats = rebalancer.run(moves)
+        except RebalanceError as error:
+            raise CommandError(f"Rebalancing stopped, the source rows were kept: {error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {stats.users} users ({stats.rows} rows, {stats.late_rows} late writes) in {stats.elapsed:.2f}s."
+        ))
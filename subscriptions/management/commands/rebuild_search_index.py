@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from SubFlo.sharding import data_aliases, on_shard
+from subscriptions.search import SEARCH_DOCUMENTS, get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index of subscriptions and email messages from scratch (on every shard)."
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        aliases = data_aliases()
+        for alias in aliases:
+            where = f" in {alias}" if len(aliases) > 1 else ""
+            with on_shard(alias), transaction.atomic(using=alias):
+                for model in SEARCH_DOCUMENTS:
+                    count = backend.rebuild(model)
+                    self.stdout.write(f"Indexed {count} {model._meta.verbose_name_plural}{where}.")
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from SubFlo.sharding import data_aliases, on_shard
+from subscriptions.spending import rebuild_spending_rollup
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the spending rollup from scratch (after importing data with signals disabled or editing rates in SQL)."
+
+    def handle(self, *args, **options):
+        count = 0
+        for alias in data_aliases():
+            with on_shard(alias):
+                count += rebuild_spending_rollup()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the spending rollup: {count} rows."))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from accounts.models import UserProfile
+from subscriptions.mailsync import IMAPConnectionPool, MailboxSyncer
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetches the new messages of every user who granted email access from IMAP, resuming after the last "
+        "synced UID. Headers come first; only likely subscription mail is downloaded and stored."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", action="append", dest="usernames", help="Only this user (repeatable).")
+        parser.add_argument("--concurrency", type=int, default=8, help="Mailboxes fetched at once.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Messages written per transaction.")
+        parser.add_argument("--max-messages", type=int, default=None,
+                            help="New messages taken per mailbox and run (the rest waits for the next run).")
+        parser.add_argument("--no-prefilter", action="store_true",
+                            help="Download and store every message, not only likely subscription mail.")
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be positive.")
+
+        profiles = UserProfile.objects.filter(email_access_granted=True).select_related("user").order_by("user_id")
+        if options["usernames"]:
+            profiles = profiles.filter(user__username__in=options["usernames"])
+
+        pool = IMAPConnectionPool()
+        syncer = MailboxSyncer(
+            pool,
+            concurrency=options["concurrency"],
+            batch_size=options["batch_size"],
+            candidate_filter=False if options["no_prefilter"] else None,
+            max_messages=options["max_messages"],
+        )
+        try:
+            stats = syncer.run(profiles.iterator())
+        finally:
+            pool.close_all()
+
+        for profile_id, error in stats.errors:
+            self.stderr.write(f"{profile_id}: {error}")
+        self.stdout.write(
+            f"Synced {stats.users} mailboxes ({stats.failed} failed): {stats.headers} new messages, "
+            f"{stats.bodies} downloaded, {stats.imported} imported, {stats.duplicates} duplicates."
+        )
+        self.stdout.write(self.style.SUCCESS(f"Done in {stats.elapsed:.2f}s ({stats.rate:.0f} messages/s)."))
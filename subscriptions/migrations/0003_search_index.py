@@ -0,0 +1,37 @@
+# Creates the SQLite FTS5 tables used by `subscriptions.search.SQLiteFTS5Backend`
+
+from django.db import migrations
+
+FTS_TABLES = {
+    "subscriptions_subscription_fts": "platform_name, service_name, sender, notes",
+    "subscriptions_emailmessage_fts": "subject, sender, body",
+}
+
+
+def create_fts_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for table, columns in FTS_TABLES.items():
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+            f"object_id UNINDEXED, user_id UNINDEXED, {columns}, "
+            f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+
+
+def drop_fts_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for table in FTS_TABLES:
+        schema_editor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0002_subscription_is_trial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_tables, drop_fts_tables),
+    ]
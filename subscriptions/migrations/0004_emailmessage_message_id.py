@@ -0,0 +1,24 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0003_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='message_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Provider Message ID'),
+        ),
+        migrations.AddConstraint(
+            model_name='emailmessage',
+            constraint=models.UniqueConstraint(fields=('user', 'message_id'), name='unique_user_message_id'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:14
+
+import django.db.models.deletion
+import subscriptions.fields
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def move_bodies_to_email_body(apps, schema_editor):
+    EmailMessage = apps.get_model('subscriptions', 'EmailMessage')
+    EmailBody = apps.get_model('subscriptions', 'EmailBody')
+    db_alias = schema_editor.connection.alias
+    batch = []
+    for pk, raw_email_body in EmailMessage.objects.using(db_alias).values_list('pk', 'raw_email_body').iterator(chunk_size=BATCH_SIZE):
+        batch.append(EmailBody(email_message_id=pk, content=raw_email_body or ''))
+        if len(batch) >= BATCH_SIZE:
+            EmailBody.objects.using(db_alias).bulk_create(batch)
+            batch = []
+    EmailBody.objects.using(db_alias).bulk_create(batch)
+
+
+def move_bodies_back(apps, schema_editor):
+    EmailMessage = apps.get_model('subscriptions', 'EmailMessage')
+    EmailBody = apps.get_model('subscriptions', 'EmailBody')
+    db_alias = schema_editor.connection.alias
+    batch = []
+    for pk, content in EmailBody.objects.using(db_alias).values_list('pk', 'content').iterator(chunk_size=BATCH_SIZE):
+        batch.append(EmailMessage(pk=pk, raw_email_body=content))
+        if len(batch) >= BATCH_SIZE:
+            EmailMessage.objects.using(db_alias).bulk_update(batch, ['raw_email_body'])
+            batch = []
+    EmailMessage.objects.using(db_alias).bulk_update(batch, ['raw_email_body'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0004_emailmessage_message_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailBody',
+            fields=[
+                ('email_message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='body', serialize=False, to='subscriptions.emailmessage', verbose_name='Email Message')),
+                ('content', subscriptions.fields.CompressedTextField(verbose_name='Raw Email Body')),
+            ],
+            options={
+                'verbose_name': 'Email Body',
+                'verbose_name_plural': 'Email Bodies',
+            },
+        ),
+        migrations.RunPython(move_bodies_to_email_body, move_bodies_back),
+        migrations.AlterField(
+            model_name='emailmessage',
+            name='raw_email_body',
+            field=models.TextField(default='', verbose_name='Raw Email Body'),
+        ),
+        migrations.RemoveField(
+            model_name='emailmessage',
+            name='raw_email_body',
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0005_emailbody'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(fields=['user', '-received_date'], name='emailmessage_user_received_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(fields=['-received_date', '-id'], name='emailmessage_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(condition=models.Q(('already_canceled', False)), fields=['user', 'end_date'], name='subscription_user_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['user', 'updated_at'], name='subscription_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['-end_date', '-start_date', '-id'], name='subscription_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['payment_method', 'already_canceled', 'is_trial', 'end_date', 'price'], name='subscription_summary_idx'),
+        ),
+    ]
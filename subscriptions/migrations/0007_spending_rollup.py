@@ -0,0 +1,51 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:23
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0006_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='Exchange Rate ID')),
+                ('currency', models.CharField(max_length=10, unique=True, verbose_name='Currency')),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18, verbose_name='Rate to Base Currency')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'verbose_name': 'Exchange Rate',
+                'verbose_name_plural': 'Exchange Rates',
+                'ordering': ['currency'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SpendingRollup',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='Rollup ID')),
+                ('month', models.DateField(verbose_name='Month')),
+                ('payment_method', models.CharField(blank=True, default='', max_length=255, verbose_name='Payment Method')),
+                ('currency', models.CharField(max_length=10, verbose_name='Currency')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Total')),
+                ('total_base', models.DecimalField(blank=True, decimal_places=2, max_digits=16, null=True, verbose_name='Total in Base Currency')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Subscriptions')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spending_rollups', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Spending Rollup',
+                'verbose_name_plural': 'Spending Rollups',
+                'ordering': ['user', '-month', 'payment_method', 'currency'],
+                'indexes': [models.Index(fields=['month', 'payment_method'], name='spendingrollup_month_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'month', 'payment_method', 'currency'), name='unique_spending_rollup')],
+            },
+        ),
+    ]
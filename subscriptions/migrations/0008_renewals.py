@@ -0,0 +1,141 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:26
+
+import calendar
+import django.db.models.deletion
+import statistics
+import uuid
+from datetime import timedelta
+from itertools import groupby
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+BATCH_SIZE = 500
+
+# The renewal rules of subscriptions.renewals as they were when this migration was written: a migration must
+# give the same result whatever the application code has become
+BILLING_PERIODS = (
+    ("weekly", 7, {"days": 7}),
+    ("monthly", 30, {"months": 1}),
+    ("quarterly", 91, {"months": 3}),
+    ("yearly", 365, {"months": 12}),
+)
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    year, month = day.year + month // 12, month % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def infer_billing_period(periods):
+    lengths = [(end_date - start_date).days for start_date, end_date in periods
+               if start_date is not None and end_date is not None and end_date > start_date]
+    if not lengths:
+        starts = sorted({start_date for start_date, _ in periods if start_date is not None})
+        lengths = [(later - earlier).days for earlier, later in zip(starts, starts[1:])]
+    if not lengths:
+        return BILLING_PERIODS[1]
+    length = statistics.median(lengths)
+    return min(BILLING_PERIODS, key=lambda period: abs(period[1] - length))
+
+
+def compute_next_renewal_date(start_date, end_date, already_canceled, today, history):
+    if end_date is not None:
+        return end_date if end_date >= today else None
+    if start_date is None or already_canceled:
+        return None
+    period = infer_billing_period(history)
+    if "days" in period[2]:
+        cycles = max(0, -(-(today - start_date).days // period[2]["days"]))
+        return start_date + timedelta(days=cycles * period[2]["days"])
+    months = period[2]["months"]
+    cycles = max(0, ((today.year - start_date.year) * 12 + today.month - start_date.month) // months)
+    day = add_months(start_date, cycles * months)
+    if day < today:
+        day = add_months(start_date, (cycles + 1) * months)
+    return day
+
+
+def fill_next_renewal_date(apps, schema_editor):
+    Subscription = apps.get_model('subscriptions', 'Subscription')
+    db_alias = schema_editor.connection.alias
+    today = timezone.localdate()
+    batch = []
+    # One subscription (its rows: every renewal is one) at a time, for the billing period of the open-ended ones
+    rows = Subscription.objects.using(db_alias).order_by('user_id', 'platform_name', 'service_name').values_list(
+        'user_id', 'platform_name', 'service_name', 'pk', 'start_date', 'end_date', 'already_canceled')
+    for _, group in groupby(rows.iterator(chunk_size=BATCH_SIZE), key=lambda row: row[:3]):
+        group = list(group)
+        history = [(start_date, end_date) for *_, start_date, end_date, _ in group]
+        for *_, pk, start_date, end_date, already_canceled in group:
+            next_renewal_date = compute_next_renewal_date(start_date, end_date, already_canceled, today, history)
+            if next_renewal_date is not None:
+                batch.append(Subscription(pk=pk, next_renewal_date=next_renewal_date))
+        if len(batch) >= BATCH_SIZE:
+            Subscription.objects.using(db_alias).bulk_update(batch, ['next_renewal_date'])
+            batch = []
+    Subscription.objects.using(db_alias).bulk_update(batch, ['next_renewal_date'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0007_spending_rollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenewalNotification',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='Notification ID')),
+                ('kind', models.CharField(choices=[('renewal', 'Renewal'), ('trial_end', 'Trial End'), ('expiry', 'Expiry')], max_length=20, verbose_name='Kind')),
+                ('event_date', models.DateField(verbose_name='Event Date')),
+                ('window_days', models.PositiveIntegerField(verbose_name='Window (days)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Sent At')),
+            ],
+            options={
+                'verbose_name': 'Renewal Notification',
+                'verbose_name_plural': 'Renewal Notifications',
+                'ordering': ['event_date', 'user'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='subscription',
+            name='subscription_summary_idx',
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='next_renewal_date',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='Next Renewal Date'),
+        ),
+        migrations.RunPython(fill_next_renewal_date, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['already_canceled', 'is_trial', 'end_date', 'next_renewal_date'], name='subscription_summary_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(condition=models.Q(('next_renewal_date__isnull', False)), fields=['next_renewal_date', 'id'], name='subscription_renewal_idx'),
+        ),
+        migrations.AddField(
+            model_name='renewalnotification',
+            name='subscription',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renewal_notifications', to='subscriptions.subscription', verbose_name='Subscription'),
+        ),
+        migrations.AddField(
+            model_name='renewalnotification',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renewal_notifications', to=settings.AUTH_USER_MODEL, verbose_name='User'),
+        ),
+        migrations.AddIndex(
+            model_name='renewalnotification',
+            index=models.Index(condition=models.Q(('sent_at__isnull', True)), fields=['created_at'], name='renewalnotification_unsent_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='renewalnotification',
+            constraint=models.UniqueConstraint(fields=('subscription', 'kind', 'event_date', 'window_days'), name='unique_renewal_notification'),
+        ),
+    ]
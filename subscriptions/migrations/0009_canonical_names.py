@@ -0,0 +1,65 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:38
+
+import uuid
+from django.db import migrations, models
+from subscriptions.names import PLATFORM, SERVICE, normalize_name
+
+# Spellings seen in receipts of the most common services; more can be added in the admin
+CANONICAL_NAMES = {
+    PLATFORM: {
+        "Netflix": ["Netflix"],
+        "Spotify": ["Spotify", "Spotify AB", "Spotify USA"],
+        "Disney+": ["Disney+", "DisneyPlus"],  # "Disney Plus" normalizes like "Disney+"
+        "Max": ["HBO Max", "HBOMax", "Max"],
+        "Prime Video": ["Prime Video", "Amazon Prime Video", "PrimeVideo"],
+        "YouTube": ["YouTube", "YouTube Premium"],
+        "Apple": ["Apple", "iTunes", "Apple Services"],
+        "Hulu": ["Hulu"],
+    },
+    SERVICE: {
+        "Premium": ["Premium"],
+        "Standard": ["Standard"],
+        "Basic": ["Basic"],
+        "Family": ["Family"],
+        "Individual": ["Individual"],
+        "Student": ["Student"],
+        "Duo": ["Duo"],
+    },
+}
+
+
+def add_canonical_names(apps, schema_editor):
+    CanonicalName = apps.get_model('subscriptions', 'CanonicalName')
+    db_alias = schema_editor.connection.alias
+    CanonicalName.objects.using(db_alias).bulk_create(
+        CanonicalName(kind=kind, alias=normalize_name(alias, kind), canonical=canonical)
+        for kind, names in CANONICAL_NAMES.items()
+        for canonical, aliases in names.items()
+        for alias in aliases
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0008_renewals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CanonicalName',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='Canonical Name ID')),
+                ('kind', models.CharField(choices=[('platform', 'Platform'), ('service', 'Service')], max_length=20, verbose_name='Kind')),
+                ('alias', models.CharField(max_length=255, verbose_name='Alias')),
+                ('canonical', models.CharField(max_length=255, verbose_name='Canonical Name')),
+            ],
+            options={
+                'verbose_name': 'Canonical Name',
+                'verbose_name_plural': 'Canonical Names',
+                'ordering': ['kind', 'canonical', 'alias'],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'alias'), name='unique_canonical_name_alias')],
+            },
+        ),
+        migrations.RunPython(add_canonical_names, migrations.RunPython.noop, hints={'model_name': 'canonicalname'}),
+    ]
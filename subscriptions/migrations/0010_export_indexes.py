@@ -0,0 +1,41 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:41
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created_at(apps, schema_editor):
+    # Existing messages were last written when they were created (or had their `parsed_data` filled)
+    EmailMessage = apps.get_model('subscriptions', 'EmailMessage')
+    db_alias = schema_editor.connection.alias
+    EmailMessage.objects.using(db_alias).update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0009_canonical_names'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Updated At'),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(fields=['user', 'updated_at'], name='emailmessage_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(fields=['updated_at', 'id'], name='emailmessage_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['updated_at', 'id'], name='subscription_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0.1 on 2026-10-18 14:06
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0011_sharded_user_foreign_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LinkCheck',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='Link Check ID')),
+                ('url', models.TextField(unique=True, verbose_name='URL')),
+                ('status', models.CharField(choices=[('ok', 'OK'), ('broken', 'Broken'), ('unreachable', 'Unreachable')], max_length=20, verbose_name='Status')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Status Code')),
+                ('error', models.CharField(blank=True, default='', max_length=255, verbose_name='Error')),
+                ('checked_at', models.DateTimeField(verbose_name='Checked At')),
+            ],
+            options={
+                'verbose_name': 'Link Check',
+                'verbose_name_plural': 'Link Checks',
+                'ordering': ['url'],
+            },
+        ),
+    ]
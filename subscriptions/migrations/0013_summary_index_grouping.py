@@ -0,0 +1,21 @@
+# Generated by Django 6.0.1 on 2026-10-18 14:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0012_linkcheck'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='subscription',
+            name='subscription_summary_idx',
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['payment_method', 'currency', 'already_canceled', 'is_trial', 'end_date', 'next_renewal_date', 'price'], name='subscription_summary_idx'),
+        ),
+    ]
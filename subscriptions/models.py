@@ -1,8 +1,43 @@
 # subscriptions/models.py
 from django.db import models
 from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
 from django.urls import reverse
+from subscriptions.fields import CompressedTextField
+from subscriptions.names import PLATFORM, SERVICE, normalize_name
+from SubFlo.sharding import ShardedQuerySet, on_shard, shard_of
+import re
 import uuid
+from urllib.parse import urlsplit
+
+# A scheme, as opposed to the port of a link without one ("netflix.com:8443/cancel")
+_SCHEME_RE = re.compile(r"^([a-z][a-z0-9+.-]*):(?!\d)", re.I)
+
+
+def normalize_link(link):
+    """
+    Returns `link` as an absolute http(s) or mailto URL: extracted links often lack the scheme, which is
+    then https. Returns None for an empty link or any other scheme (e.g. `javascript:`).
+    """
+    link = (link or "").strip()
+    if not link:
+        return None
+    scheme = _SCHEME_RE.match(link)
+    if scheme and scheme[1].lower() == "mailto":
+        return link
+    if scheme and scheme[1].lower() not in ("http", "https"):
+        return None
+    if link.startswith("//"):
+        link = "https:" + link
+    elif "://" not in link:
+        link = "https://" + link
+    parts = urlsplit(link)
+    if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+        return None
+    return link
+
 
 class Subscription(models.Model):
     """
@@ -13,7 +48,7 @@ class Subscription(models.Model):
     Ensure that each user can subscribe to only "one" service from a specific platform during a given period.
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, verbose_name="Subscription ID")
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions', verbose_name="User")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions', db_constraint=False, verbose_name="User")
     platform_name = models.CharField(max_length=255, verbose_name="Platform Name")
     service_name = models.CharField(max_length=255, verbose_name="Service Name")
     start_date = models.DateField(null=True, blank=True, verbose_name="Start Date")
@@ -26,12 +61,20 @@ class Subscription(models.Model):
     email_message_id = models.OneToOneField("EmailMessage", on_delete=models.SET_NULL, related_name='subscription', null=True, blank=True, verbose_name="Email Message ID")
     unsubscribe_link = models.TextField(null=True, blank=True, verbose_name="Unsubscribe Link")
     notes = models.TextField(null=True, blank=True, verbose_name="Notes")
+    next_renewal_date = models.DateField(null=True, blank=True, editable=False, verbose_name="Next Renewal Date")  # Kept by `subscriptions.renewals`
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
 
+    objects = ShardedQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.platform_name} ({self.service_name}) - {self.user.username}"
 
+    @property
+    def unsubscribe_url(self):
+        """`unsubscribe_link` as a URL a page can link to, or None (see `normalize_link`)."""
+        return normalize_link(self.unsubscribe_link)
+
     class Meta:
         verbose_name = "Subscription"
         verbose_name_plural = "Subscriptions"
@@ -41,6 +84,21 @@ class Subscription(models.Model):
                 name="unique_user_platform_service_date",
             )
         ]
+        indexes = [
+            # Active subscriptions of a user (external API, per-user summary)
+            models.Index(fields=["user", "end_date"], condition=models.Q(already_canceled=False), name="subscription_user_active_idx"),
+            # Newest change of a user (ETag of the external API)
+            models.Index(fields=["user", "updated_at"], name="subscription_user_updated_idx"),
+            # Incremental exports across users
+            models.Index(fields=["updated_at", "id"], name="subscription_updated_idx"),
+            # Dashboard listing order (keyset pagination)
+            models.Index(fields=["-end_date", "-start_date", "-id"], name="subscription_listing_idx"),
+            # Covers the dashboard summary aggregate in its grouping order, so it never reads the table itself
+            models.Index(fields=["payment_method", "currency", "already_canceled", "is_trial", "end_date", "next_renewal_date", "price"],
+                         name="subscription_summary_idx"),
+            # Renewal notification job (one range scan over the upcoming dates, keyset batches)
+            models.Index(fields=["next_renewal_date", "id"], condition=models.Q(next_renewal_date__isnull=False), name="subscription_renewal_idx"),
+        ]
         ordering = ["user", "-end_date", "-start_date", "platform_name", "service_name"]
     
     def get_absolute_url(self):
@@ -52,16 +110,38 @@ class EmailMessage(models.Model):
     """
     Represents a user's email message.
     Ensure that `message_id` is unique for every user.
+    `message_id` is the provider's Message-ID header, or a content hash when the header is missing.
     `parsed_data` and `created_at` will be filled after the LLM processes emails.
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, verbose_name="Message ID")
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='email_messages', verbose_name="User")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='email_messages', db_constraint=False, verbose_name="User")
+    message_id = models.CharField(max_length=255, null=True, blank=True, verbose_name="Provider Message ID")
     subject = models.CharField(max_length=255, verbose_name="Subject")
     sender = models.CharField(max_length=255, verbose_name="Sender")
     received_date = models.DateTimeField(verbose_name="Received Date")
-    raw_email_body = models.TextField(verbose_name="Raw Email Body")
     parsed_data = models.JSONField(null=True, blank=True, verbose_name="Parsed Data")  # Store the LLM output
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")    # Time when `parsed_data` is filled
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")        # Incremental exports
+
+    objects = ShardedQuerySet.as_manager()
+
+    @property
+    def raw_email_body(self):
+        """
+        The raw body lives compressed in `EmailBody`; it is only queried when this property is read.
+        Use `select_related("body")` to load it along with the message.
+        """
+        if hasattr(self, "_pending_body"):
+            return self._pending_body
+        try:
+            return self.body.content
+        except EmailBody.DoesNotExist:
+            return ""
+
+    @raw_email_body.setter
+    def raw_email_body(self, value):
+        # Written to `EmailBody` by `save_email_body` once the message itself is saved
+        self._pending_body = value
 
     def __str__(self):
         return str(self.id)
@@ -71,4 +151,213 @@ class EmailMessage(models.Model):
     class Meta:
         verbose_name = "Email Message"
         verbose_name_plural = "Email Messages"
-        ordering = ["user", "-received_date"]
\ No newline at end of file
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "message_id"],
+                name="unique_user_message_id",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["user", "-received_date"], name="emailmessage_user_received_idx"),
+            # "All Emails" listing order (keyset pagination)
+            models.Index(fields=["-received_date", "-id"], name="emailmessage_listing_idx"),
+            # Incremental exports (`updated_at` since), per user and across users
+            models.Index(fields=["user", "updated_at"], name="emailmessage_user_updated_idx"),
+            models.Index(fields=["updated_at", "id"], name="emailmessage_updated_idx"),
+        ]
+        ordering = ["user", "-received_date"]
+
+class EmailBody(models.Model):
+    """
+    Stores the raw body of an `EmailMessage`, compressed, outside of the main email table.
+    Keeping multi-KB HTML bodies out of `subscriptions_emailmessage` keeps list pages, admin changelists and
+    `Subscription.email_message_id` joins small; the body is read through `EmailMessage.raw_email_body`.
+    """
+    email_message = models.OneToOneField(EmailMessage, on_delete=models.CASCADE, primary_key=True, related_name='body', verbose_name="Email Message")
+    content = CompressedTextField(verbose_name="Raw Email Body")
+
+    objects = ShardedQuerySet.as_manager()
+
+    def __str__(self):
+        return str(self.email_message_id)
+
+    class Meta:
+        verbose_name = "Email Body"
+        verbose_name_plural = "Email Bodies"
+
+# Signal to store the body assigned through `EmailMessage.raw_email_body`
+@receiver(post_save, sender=EmailMessage)
+def save_email_body(sender, instance, using=None, **kwargs):
+    if hasattr(instance, "_pending_body"):
+        body = EmailBody(email_message=instance, content=instance._pending_body)
+        body.save(using=using)
+        instance.body = body
+        del instance._pending_body
+
+class ExchangeRate(models.Model):
+    """
+    Locally stored FX rate table used to normalize prices to `settings.SPENDING_BASE_CURRENCY`.
+    `rate` is the value of one unit of `currency` in the base currency; the base currency itself needs no row.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, verbose_name="Exchange Rate ID")
+    currency = models.CharField(max_length=10, unique=True, verbose_name="Currency")
+    rate = models.DecimalField(max_digits=18, decimal_places=8, verbose_name="Rate to Base Currency")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
+
+    def __str__(self):
+        return f"{self.currency} = {self.rate}"
+
+    class Meta:
+        verbose_name = "Exchange Rate"
+        verbose_name_plural = "Exchange Rates"
+        ordering = ["currency"]
+
+class SpendingRollup(models.Model):
+    """
+    Spend per user, month, payment method and currency, maintained incrementally from `Subscription` writes.
+    Every non-trial subscription with a price counts once, in the month of its `start_date` (or of its creation
+    when the start date is unknown). `total` is in `currency`; `total_base` is `total` converted with the
+    `ExchangeRate` table, or NULL while the currency has no rate. A missing payment method is stored as "".
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, verbose_name="Rollup ID")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='spending_rollups', db_constraint=False, verbose_name="User")
+    month = models.DateField(verbose_name="Month")  # First day of the month
+    payment_method = models.CharField(max_length=255, blank=True, default="", verbose_name="Payment Method")
+    currency = models.CharField(max_length=10, verbose_name="Currency")
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Total")
+    total_base = models.DecimalField(max_digits=16, decimal_places=2, null=True, blank=True, verbose_name="Total in Base Currency")
+    count = models.PositiveIntegerField(default=0, verbose_name="Subscriptions")
+
+    objects = ShardedQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.user_id} {self.month:%Y-%m} {self.payment_method or '-'} {self.total} {self.currency}"
+
+    class Meta:
+        verbose_name = "Spending Rollup"
+        verbose_name_plural = "Spending Rollups"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "month", "payment_method", "currency"],
+                name="unique_spending_rollup",
+            )
+        ]
+        indexes = [
+            # Spending of one month across every user
+            models.Index(fields=["month", "payment_method"], name="spendingrollup_month_idx"),
+        ]
+        ordering = ["user", "-month", "payment_method", "currency"]
+
+class RenewalNotification(models.Model):
+    """
+    A renewal, trial end or expiry of a subscription that falls within one of the notification windows.
+    Ensure that a subscription gets one notification per event and window, so the job can be rerun safely.
+    `sent_at` is filled by whatever delivers the notification.
+    """
+    RENEWAL = "renewal"
+    TRIAL_END = "trial_end"
+    EXPIRY = "expiry"
+    KIND_CHOICES = [(RENEWAL, "Renewal"), (TRIAL_END, "Trial End"), (EXPIRY, "Expiry")]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, verbose_name="Notification ID")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='renewal_notifications', db_constraint=False, verbose_name="User")
+    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE, related_name='renewal_notifications', verbose_name="Subscription")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name="Kind")
+    event_date = models.DateField(verbose_name="Event Date")
+    window_days = models.PositiveIntegerField(verbose_name="Window (days)")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Sent At")
+
+    objects = ShardedQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.get_kind_display()} of {self.subscription_id} on {self.event_date}"
+
+    class Meta:
+        verbose_name = "Renewal Notification"
+        verbose_name_plural = "Renewal Notifications"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["subscription", "kind", "event_date", "window_days"],
+                name="unique_renewal_notification",
+            )
+        ]
+        indexes = [
+            # Unsent notifications, oldest first (delivery queue)
+            models.Index(fields=["created_at"], condition=models.Q(sent_at__isnull=True), name="renewalnotification_unsent_idx"),
+        ]
+        ordering = ["event_date", "user"]
+
+class CanonicalName(models.Model):
+    """
+    Lookup table of the canonical spelling of platform and service names, used by `subscriptions.dedup`.
+    `alias` is stored normalized (see `subscriptions.names.normalize_name`), so one row covers every spelling
+    that normalizes the same way ("NETFLIX Inc.", "netflix.com", ...).
+    """
+    KIND_CHOICES = [(PLATFORM, "Platform"), (SERVICE, "Service")]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, verbose_name="Canonical Name ID")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name="Kind")
+    alias = models.CharField(max_length=255, verbose_name="Alias")
+    canonical = models.CharField(max_length=255, verbose_name="Canonical Name")
+
+    def __str__(self):
+        return f"{self.alias} -> {self.canonical}"
+
+    def save(self, *args, **kwargs):
+        self.alias = normalize_name(self.alias, self.kind)
+        super().save(*args, **kwargs)
+
+    class Meta:
+        verbose_name = "Canonical Name"
+        verbose_name_plural = "Canonical Names"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "alias"],
+                name="unique_canonical_name_alias",
+            )
+        ]
+        ordering = ["kind", "canonical", "alias"]
+
+
+class LinkCheck(models.Model):
+    """
+    Last health check of an unsubscribe link (see `subscriptions.linkcheck`).
+    `url` is the link as stored in `Subscription.unsubscribe_link`, so every subscription with the same link
+    shares one row and a page of subscriptions reads its results with a single `url__in` query.
+    """
+    OK = "ok"
+    BROKEN = "broken"            # The server answered with an error status
+    UNREACHABLE = "unreachable"  # No answer: DNS, connection, TLS or timeout error
+    STATUS_CHOICES = [(OK, "OK"), (BROKEN, "Broken"), (UNREACHABLE, "Unreachable")]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, verbose_name="Link Check ID")
+    url = models.TextField(unique=True, verbose_name="URL")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, verbose_name="Status")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Status Code")  # Of the last response, after redirects
+    error = models.CharField(max_length=255, blank=True, default="", verbose_name="Error")
+    checked_at = models.DateTimeField(verbose_name="Checked At")
+
+    def __str__(self):
+        return f"{self.url} ({self.status})"
+
+    @property
+    def is_dead(self):
+        return self.status != self.OK
+
+    class Meta:
+        verbose_name = "Link Check"
+        verbose_name_plural = "Link Checks"
+        ordering = ["url"]
+
+
+# Signal to delete the rows a user has on a shard: the deletion of a `User` only cascades within the catalog
+# (the foreign keys to the user carry no constraint, see `SubFlo.sharding`)
+@receiver(pre_delete, sender=User)
+def delete_sharded_user_data(sender, instance, **kwargs):
+    alias = shard_of(instance.pk)
+    if alias == DEFAULT_DB_ALIAS:
+        return
+    with on_shard(alias):
+        for model in (Subscription, EmailMessage, SpendingRollup):
+            model.objects.filter(user_id=instance.pk).delete()
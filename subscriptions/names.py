@@ -0,0 +1,33 @@
+# subscriptions/names.py
+import re
+import unicodedata
+
+PLATFORM = "platform"
+SERVICE = "service"
+
+# Words that do not tell two names apart: company suffixes and domains for platforms, packaging for services
+NOISE_WORDS = {
+    PLATFORM: frozenset({
+        "inc", "llc", "ltd", "limited", "corp", "corporation", "co", "company", "gmbh", "sa", "ag", "plc", "bv",
+        "com", "net", "org", "io", "tv", "www",
+    }),
+    SERVICE: frozenset({"plan", "subscription", "membership", "tier", "package", "account", "the"}),
+}
+
+_SYMBOLS = (("+", " plus "), ("&", " and "))
+_NON_WORD_RE = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_name(name, kind):
+    """
+    Reduces a platform or service name to the key names are compared on:
+    accents, case and punctuation are dropped, and so are the `NOISE_WORDS` of `kind`
+    ("NETFLIX Inc." -> "netflix", "Premium Plan" -> "premium", "Disney+" -> "disney plus").
+    A name made of noise words only keeps them, so it never becomes empty.
+    """
+    text = unicodedata.normalize("NFKD", name or "")
+    text = "".join(char for char in text if not unicodedata.combining(char)).casefold()
+    for symbol, word in _SYMBOLS:
+        text = text.replace(symbol, word)
+    words = _NON_WORD_RE.sub(" ", text).split()
+    return " ".join(word for word in words if word not in NOISE_WORDS[kind]) or " ".join(words)
@@ -0,0 +1,142 @@
+# subscriptions/prefilter.py
+import copy
+import hashlib
+import re
+from collections import OrderedDict
+from datetime import date, timedelta
+
+# Senders that only ever mail about subscriptions, billing or accounts
+KNOWN_SUBSCRIPTION_DOMAINS = frozenset({
+    "netflix.com", "spotify.com", "hulu.com", "disneyplus.com", "hbomax.com", "max.com", "primevideo.com",
+    "amazon.com", "apple.com", "youtube.com", "google.com", "microsoft.com", "adobe.com", "dropbox.com",
+    "paramountplus.com", "peacocktv.com", "audible.com", "nytimes.com", "wsj.com", "patreon.com",
+    "github.com", "notion.so", "slack.com", "zoom.us", "canva.com", "duolingo.com", "headspace.com",
+    "paypal.com", "stripe.com", "chargebee.com", "recurly.com", "paddle.com",
+})
+
+SUBSCRIPTION_KEYWORDS = (
+    "subscription", "subscribed", "receipt", "invoice", "renewal", "renews", "renewed", "auto-renew",
+    "free trial", "trial ends", "trial period", "membership", "billing", "payment", "charged", "your plan",
+    "cancel anytime", "unsubscribe from this plan", "next payment", "order confirmation",
+)
+
+# How much of a body the keyword rules look at: receipts state what they are near the top
+BODY_SCAN_LIMIT = 4096
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_URL_QUERY_RE = re.compile(r"(https?://[^\s?#\"'<>]+)[?#][^\s\"'<>]*")
+_DATE_RE = re.compile(
+    r"\b(\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{2,4}|"
+    r"(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.? \d{1,2}(st|nd|rd|th)?,? \d{4})\b"
+)
+_ID_RE = re.compile(r"\b(?=[0-9a-f-]*\d)[0-9a-f-]{8,}\b|\b\d{6,}\b")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def sender_domain(sender):
+    """
+    Returns the lowercase domain of a From header ("Netflix <info@mailer.netflix.com>" -> "mailer.netflix.com").
+    """
+    address = sender.rsplit("<", 1)[-1].rstrip("> ").strip()
+    return address.rsplit("@", 1)[-1].lower()
+
+
+class SubscriptionPrefilter:
+    """
+    Cheap rule-based gate run before the LLM.
+    An email passes when its sender domain (or a parent domain) is in the domain index, or when its subject
+    or the start of its body matches a subscription keyword or one of the extra regular expressions.
+    Everything is precompiled, so rejecting a message costs a few set lookups and one regex scan.
+    """
+
+    def __init__(self, domains=KNOWN_SUBSCRIPTION_DOMAINS, keywords=SUBSCRIPTION_KEYWORDS, patterns=()):
+        self.domains = frozenset(domain.lower() for domain in domains)
+        alternatives = [re.escape(keyword) for keyword in keywords] + list(patterns)
+        self.rules = re.compile(r"\b(?:" + "|".join(alternatives) + r")\b", re.I)
+
+    def domain_matches(self, domain):
+        parts = domain.split(".")
+        return any(".".join(parts[i:]) in self.domains for i in range(len(parts) - 1))
+
+    def accepts(self, email):
+        if self.domain_matches(sender_domain(email["sender"])):
+            return True
+        if self.rules.search(email["subject"]):
+            return True
+        return self.rules.search(email["raw_email_body"], 0, BODY_SCAN_LIMIT) is not None
+
+
+def normalized_content_hash(email):
+    """
+    Hashes an email after removing what changes between two copies of the same template:
+    markup, case, whitespace, URL query strings (tracking tokens), dates and order/reference numbers.
+    Prices are kept, so a price change is a different template. The user is part of the key, so answers
+    (which may hold personal links or notes) are never shared between users.
+    """
+    body = _TAG_RE.sub(" ", email["raw_email_body"]).lower()
+    body = _URL_QUERY_RE.sub(r"\1", body)
+    body = _ID_RE.sub("#", _DATE_RE.sub("<date>", body))
+    subject = _ID_RE.sub("#", _DATE_RE.sub("<date>", email["subject"].lower()))
+    text = "\0".join((str(email["user_id"]), sender_domain(email["sender"]), subject, body))
+    return hashlib.sha256(_SPACE_RE.sub(" ", text).encode()).hexdigest()
+
+
+class ExtractionCache:
+    """
+    LRU cache of extraction results keyed by `normalized_content_hash`.
+    Subscription dates are stored relative to the email's received date and re-anchored on a hit, so next
+    month's copy of a receipt gets next month's dates.
+    """
+
+    DATE_FIELDS = ("start_date", "end_date")
+
+    def __init__(self, max_size=10_000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, email, key=None):
+        key = key or normalized_content_hash(email)
+        template = self.entries.get(key)
+        if template is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return self._anchor(template, email["received_date"].date())
+
+    def set(self, email, result, key=None):
+        if self.max_size <= 0:
+            return
+        key = key or normalized_content_hash(email)
+        try:
+            template = self._template(result, email["received_date"].date())
+        except (TypeError, ValueError):
+            # A date that is not an ISO date: the result is unusable, nothing worth answering other emails with
+            return
+        self.entries[key] = template
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def _template(self, result, received):
+        template = copy.deepcopy(result)
+        values = template.get("subscription") or {}
+        for name in self.DATE_FIELDS:
+            if values.get(name):
+                values[name] = (date.fromisoformat(values[name]) - received).days
+        return template
+
+    def _anchor(self, template, received):
+        result = copy.deepcopy(template)
+        values = result.get("subscription") or {}
+        for name in self.DATE_FIELDS:
+            if values.get(name) is not None:
+                values[name] = (received + timedelta(days=values[name])).isoformat()
+        return result
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -0,0 +1,219 @@
+# subscriptions/rebalance.py
+import time
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+from accounts.models import UserProfile
+from SubFlo.sharding import on_shard, shard_directory
+from subscriptions.models import EmailBody, EmailMessage, RenewalNotification, SpendingRollup, Subscription
+from subscriptions.search import get_search_backend
+from subscriptions.signals import bulk_changed
+from subscriptions.spending import rebuild_spending_rollup
+
+# Copied in this order so that every foreign key finds its row: emails, their bodies, the subscriptions
+# extracted from them, then the notifications of those subscriptions. The spending rollup is rebuilt instead.
+COPY_MODELS = (EmailMessage, EmailBody, Subscription, RenewalNotification)
+# How the rows of a user are selected, and how the rows written since a point in time are (None: every row)
+USER_LOOKUPS = {
+    EmailMessage: "user_id", EmailBody: "email_message__user_id",
+    Subscription: "user_id", RenewalNotification: "user_id",
+}
+CHANGED_LOOKUPS = {
+    EmailMessage: "updated_at__gte", EmailBody: "email_message__updated_at__gte",
+    Subscription: "updated_at__gte", RenewalNotification: None,
+}
+
+DEFAULT_CATCH_UP_PASSES = 3
+COPY_BATCH_SIZE = 500
+
+
+class RebalanceError(Exception):
+    pass
+
+
+class RebalanceStats:
+
+    def __init__(self):
+        self.users = 0
+        self.rows = 0
+        self.late_rows = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.users / self.elapsed if self.elapsed else 0.0
+
+
+class ShardRebalancer:
+    """
+    Moves users to another shard while they keep being served.
+
+    The rows of a user are copied to the target while the source stays live, then up to `catch_up_passes`
+    passes copy the rows written in the meantime (by `updated_at`), which keeps the last pass short. That
+    last pass runs with the user's rows locked on the source (`select_for_update`; SQLite shards take the
+    database write lock, their transactions being IMMEDIATE in production) and copies every row of the user
+    again: writes that leave `updated_at` alone (`QuerySet.update()`, bulk updates) or that committed after
+    a pass started are not missed. It drops from the target the rows deleted since, checks that both sides
+    hold the same rows, rebuilds the spending rollup and the search index there and points
+    `UserProfile.shard` at the target, all before the lock is released. Other processes may keep using their
+    cached copy of the directory for `SHARD_DIRECTORY_TTL` seconds: the old rows are only deleted after
+    `grace` seconds, once every batch of users, and the writes that landed on the source meanwhile are copied
+    over first. When the check fails, `RebalanceError` is raised before the switch: the user stays on the
+    source and nothing is deleted.
+    """
+
+    def __init__(self, grace=None, catch_up_passes=DEFAULT_CATCH_UP_PASSES, batch_users=50):
+        self.grace = shard_directory.ttl + 1 if grace is None else grace
+        self.catch_up_passes = catch_up_passes
+        self.batch_users = batch_users
+
+    def run(self, moves):
+        """
+        Moves users per `moves`, an iterable of `(user_id, target)`, and returns a `RebalanceStats`.
+        """
+        stats = RebalanceStats()
+        moves = list(moves)
+        for start in range(0, len(moves), self.batch_users):
+            batch = moves[start:start + self.batch_users]
+            switched = []
+            for user_id, target in batch:
+                source, switched_at = self.move(user_id, target, stats)
+                if switched_at is not None:
+                    switched.append((user_id, source, target, switched_at))
+            if switched:
+                time.sleep(self.grace)
+            for user_id, source, target, switched_at in switched:
+                self.drop_source(user_id, source, target, switched_at, stats)
+        return stats
+
+    def move(self, user_id, target, stats):
+        """
+        Copies the rows of `user_id` to `target` and switches the user over. Returns the shard the user left
+        and the time of the switch (None when the user already was on `target`).
+        """
+        shard_directory.forget(user_id)
+        source = shard_directory.lookup(user_id)
+        if source == target:
+            return source, None
+
+        since = timezone.now()
+        with transaction.atomic(using=target):
+            self._delete(user_id, target)  # Leftovers of an interrupted move
+            stats.rows += self._copy(user_id, source, target)
+        for _ in range(self.catch_up_passes):
+            started = timezone.now()
+            with transaction.atomic(using=target):
+                copied = self._copy(user_id, source, target, since)
+            since = started
+            if not copied:
+                break
+
+        with transaction.atomic(using=source), transaction.atomic(using=target), \
+                transaction.atomic(using=DEFAULT_DB_ALIAS):
+            switched_at = timezone.now()
+            self._lock(user_id, source)
+            self._copy(user_id, source, target)
+            self._prune(user_id, source, target)
+            self._verify(user_id, source, target)
+            self._refresh(user_id, target)
+            UserProfile.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id).update(shard=target)
+        shard_directory.forget(user_id)
+        stats.users += 1
+        return source, switched_at
+
+    def drop_source(self, user_id, source, target, switched_at, stats):
+        """
+        Copies the writes that reached `source` after the switch, then deletes the rows of `user_id` there.
+        """
+        with transaction.atomic(using=source), transaction.atomic(using=target):
+            self._lock(user_id, source)
+            late_rows = self._copy(user_id, source, target, switched_at)
+            if late_rows:
+                self._refresh(user_id, target)
+            self._delete(user_id, source)
+        stats.late_rows += late_rows
+        with on_shard(target):
+            # Nothing changed for the user, but cached pages may still point at the old shard's rows
+            bulk_changed.send(sender=ShardRebalancer, model=Subscription, user_ids={user_id}, fields=set())
+
+    @staticmethod
+    def _refresh(user_id, alias):
+        # The copies were bulk-written: rebuild what signals would have maintained
+        with on_shard(alias):
+            rebuild_spending_rollup([user_id])
+            backend = get_search_backend()
+            backend.index_queryset(EmailMessage.objects.filter(user_id=user_id))
+            backend.index_queryset(Subscription.objects.filter(user_id=user_id))
+
+    @staticmethod
+    def _lock(user_id, source):
+        for model in (EmailMessage, Subscription):
+            list(model.objects.using(source).select_for_update().filter(user_id=user_id).values_list("pk", flat=True))
+
+    @staticmethod
+    def _pks(model, user_id, alias):
+        return set(model.objects.using(alias).filter(**{USER_LOOKUPS[model]: user_id}).values_list("pk", flat=True))
+
+    @staticmethod
+    def _copy(user_id, source, target, since=None):
+        """
+        Upserts into `target` the rows of `user_id` on `source` (only those written since `since`, when given).
+        """
+        copied = 0
+        for model in COPY_MODELS:
+            rows = model.objects.using(source).filter(**{USER_LOOKUPS[model]: user_id})
+            if since is not None and CHANGED_LOOKUPS[model]:
+                rows = rows.filter(**{CHANGED_LOOKUPS[model]: since})
+            rows = list(rows)
+            if not rows:
+                continue
+            # bulk_create stamps `auto_now`/`auto_now_add` fields with the current time: the copies keep the
+            # original ones, restored with a bulk_update
+            stamped = [field.attname for field in model._meta.concrete_fields
+                       if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)]
+            stamps = [[getattr(row, name) for name in stamped] for row in rows]
+            pk = model._meta.pk
+            model.objects.using(target).bulk_create(
+                rows,
+                batch_size=COPY_BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=[pk.name],
+                update_fields=[field.name for field in model._meta.concrete_fields if field is not pk],
+            )
+            if stamped:
+                for row, values in zip(rows, stamps):
+                    for name, value in zip(stamped, values):
+                        setattr(row, name, value)
+                model.objects.using(target).bulk_update(rows, stamped, batch_size=COPY_BATCH_SIZE)
+            copied += len(rows)
+        return copied
+
+    @classmethod
+    def _prune(cls, user_id, source, target):
+        """Deletes from `target` the rows of `user_id` that no longer exist on `source`."""
+        for model in reversed(COPY_MODELS):
+            stale = cls._pks(model, user_id, target) - cls._pks(model, user_id, source)
+            if stale:
+                model.objects.using(target).filter(pk__in=stale).delete()
+
+    @classmethod
+    def _verify(cls, user_id, source, target):
+        """Raises `RebalanceError` unless `source` and `target` hold the same rows of `user_id`."""
+        for model in COPY_MODELS:
+            on_source, on_target = cls._pks(model, user_id, source), cls._pks(model, user_id, target)
+            if on_source != on_target:
+                raise RebalanceError(
+                    f"User {user_id}: {len(on_source)} {model._meta.verbose_name_plural} on {source}, "
+                    f"{len(on_target)} on {target} ({len(on_source - on_target)} missing)."
+                )
+
+    @staticmethod
+    def _delete(user_id, alias):
+        # Through the collector: signals take the rows out of the search index of `alias` as well
+        with on_shard(alias):
+            Subscription.objects.using(alias).filter(user_id=user_id).delete()
+            EmailMessage.objects.using(alias).filter(user_id=user_id).delete()
+            SpendingRollup.objects.using(alias).filter(user_id=user_id).delete()
@@ -0,0 +1,238 @@
+# subscriptions/renewals.py
+import calendar
+import statistics
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from subscriptions.models import Subscription, RenewalNotification
+from subscriptions.signals import bulk_changed
+from SubFlo.sharding import data_aliases, on_shard, on_signal_database, shard_atomic
+
+DEFAULT_NOTIFICATION_WINDOWS = (7, 1)
+DEFAULT_BATCH_SIZE = 2000
+
+# Billing periods a subscription's own dates are snapped to: (name, length in days, step in months or days)
+BILLING_PERIODS = (
+    ("weekly", 7, {"days": 7}),
+    ("monthly", 30, {"months": 1}),
+    ("quarterly", 91, {"months": 3}),
+    ("yearly", 365, {"months": 12}),
+)
+# Fields `next_renewal_date` is derived from (the names tell which rows are the history of a subscription)
+RENEWAL_FIELDS = {"start_date", "end_date", "already_canceled", "platform_name", "service_name"}
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    year, month = day.year + month // 12, month % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def infer_billing_period(start_date, end_date):
+    """
+    Returns the `BILLING_PERIODS` entry closest to the length of a period (monthly when it is unknown).
+    """
+    if start_date is None or end_date is None or end_date <= start_date:
+        return BILLING_PERIODS[1]
+    length = (end_date - start_date).days
+    return min(BILLING_PERIODS, key=lambda period: abs(period[1] - length))
+
+
+def infer_billing_period_from_history(periods):
+    """
+    Returns the `BILLING_PERIODS` entry of a subscription from the `(start_date, end_date)` of its rows (every
+    renewal is a row): the median length of its dated periods, or else the median gap between its start dates.
+    Monthly when neither is known.
+    """
+    periods = list(periods)
+    lengths = [(end_date - start_date).days for start_date, end_date in periods
+               if start_date is not None and end_date is not None and end_date > start_date]
+    if not lengths:
+        starts = sorted({start_date for start_date, _ in periods if start_date is not None})
+        lengths = [(later - earlier).days for earlier, later in zip(starts, starts[1:])]
+    if not lengths:
+        return BILLING_PERIODS[1]
+    length = statistics.median(lengths)
+    return min(BILLING_PERIODS, key=lambda period: abs(period[1] - length))
+
+
+def billing_histories(keys):
+    """
+    Returns `{(user_id, platform_name, service_name): [(start_date, end_date), ...]}` for `keys`, with one query.
+    """
+    keys = set(keys)
+    histories = {key: [] for key in keys}
+    if not keys:
+        return histories
+    rows = Subscription.objects.filter(
+        user_id__in={key[0] for key in keys}, platform_name__in={key[1] for key in keys},
+        service_name__in={key[2] for key in keys},
+    ).order_by().values_list("user_id", "platform_name", "service_name", "start_date", "end_date")
+    for user_id, platform_name, service_name, start_date, end_date in rows:
+        if (user_id, platform_name, service_name) in histories:
+            histories[user_id, platform_name, service_name].append((start_date, end_date))
+    return histories
+
+
+def compute_next_renewal_date(start_date, end_date, already_canceled, today=None, history=()):
+    """
+    Returns the next date something happens to a subscription, or None when nothing will:
+    - a period with an end date renews (or, once canceled, expires) on that end date, as long as it is not past.
+      A renewed period arrives as a new `Subscription` row, so a past period is never rolled forward;
+    - an open-ended subscription renews every billing period from its start date, the period being inferred
+      from `history`, the `(start_date, end_date)` of the subscription's rows (monthly when it tells nothing).
+    """
+    today = today or timezone.localdate()
+    if end_date is not None:
+        return end_date if end_date >= today else None
+    if start_date is None or already_canceled:
+        return None
+    period = infer_billing_period_from_history([(start_date, end_date), *history])
+    # Every renewal is counted from the start date (not from the previous one), so a 31st stays a 31st
+    if "days" in period[2]:
+        cycles = max(0, -(-(today - start_date).days // period[2]["days"]))
+        return start_date + timedelta(days=cycles * period[2]["days"])
+    months = period[2]["months"]
+    cycles = max(0, ((today.year - start_date.year) * 12 + today.month - start_date.month) // months)
+    day = add_months(start_date, cycles * months)
+    if day < today:
+        day = add_months(start_date, (cycles + 1) * months)
+    return day
+
+
+def refresh_next_renewal_dates(queryset, today=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Recomputes `next_renewal_date` for every subscription of `queryset` in primary-key batches (bounded memory)
+    and writes the changed ones with `bulk_update`, `updated_at` included (change tracking such as the shard
+    rebalancer relies on it). Returns the ids of the users whose subscriptions changed.
+    """
+    today = today or timezone.localdate()
+    user_ids = set()
+    last_pk = None
+    while True:
+        batch = queryset.order_by("pk")
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        rows = list(batch.values_list("pk", "user_id", "platform_name", "service_name", "start_date", "end_date",
+                                      "already_canceled", "next_renewal_date")[:batch_size])
+        if not rows:
+            return user_ids
+        last_pk = rows[-1][0]
+        # The history of the open-ended subscriptions, whose billing period is inferred from it
+        histories = billing_histories(
+            (user_id, platform_name, service_name)
+            for _, user_id, platform_name, service_name, start_date, end_date, already_canceled, _ in rows
+            if end_date is None and start_date is not None and not already_canceled
+        )
+        now = timezone.now()  # bulk_update does not fill `auto_now` fields
+        changed = []
+        for pk, user_id, platform_name, service_name, start_date, end_date, already_canceled, current in rows:
+            next_renewal_date = compute_next_renewal_date(
+                start_date, end_date, already_canceled, today, histories.get((user_id, platform_name, service_name), ()),
+            )
+            if next_renewal_date != current:
+                changed.append(Subscription(pk=pk, next_renewal_date=next_renewal_date, updated_at=now))
+                user_ids.add(user_id)
+        Subscription.objects.bulk_update(changed, ["next_renewal_date", "updated_at"])
+
+
+class RenewalStats:
+
+    def __init__(self):
+        self.advanced = 0
+        self.scanned = 0
+        self.notified = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+class RenewalNotifier:
+    """
+    Writes a `RenewalNotification` for every subscription renewing, ending its trial or expiring within one
+    of the `windows` (days ahead), for all users at once (one shard after the other).
+    First, dates that went by since the last run are moved forward. Then the upcoming dates are read in one
+    range scan of `subscription_renewal_idx`, `batch_size` rows at a time (keyset on `(next_renewal_date, id)`),
+    so memory stays bounded however many subscriptions there are. Each subscription is notified for the
+    smallest window it falls in; `bulk_create(ignore_conflicts=True)` on `unique_renewal_notification`
+    makes reruns (even on the same day) harmless.
+    """
+
+    def __init__(self, windows=None, batch_size=DEFAULT_BATCH_SIZE):
+        windows = windows or getattr(settings, "RENEWAL_NOTIFICATION_WINDOWS", DEFAULT_NOTIFICATION_WINDOWS)
+        self.windows = sorted(set(windows))
+        self.batch_size = batch_size
+
+    def run(self, today=None):
+        today = today or timezone.localdate()
+        stats = RenewalStats()
+        for alias in data_aliases():
+            with on_shard(alias):
+                self._run_shard(stats, today)
+        return stats
+
+    def _run_shard(self, stats, today):
+        user_ids = refresh_next_renewal_dates(
+            Subscription.objects.filter(next_renewal_date__lt=today), today, self.batch_size
+        )
+        stats.advanced += len(user_ids)
+        if user_ids:
+            bulk_changed.send(sender=RenewalNotifier, model=Subscription, user_ids=user_ids, fields={"next_renewal_date"})
+
+        horizon = today + timedelta(days=self.windows[-1])
+        upcoming = Subscription.objects.filter(next_renewal_date__gte=today, next_renewal_date__lte=horizon)
+        last = None
+        while True:
+            batch = upcoming.order_by("next_renewal_date", "id")
+            if last is not None:
+                batch = batch.filter(Q(next_renewal_date__gt=last[0]) | Q(next_renewal_date=last[0], id__gt=last[1]))
+            rows = list(batch.values_list("next_renewal_date", "id", "user_id", "is_trial", "already_canceled")[:self.batch_size])
+            if not rows:
+                return
+            last = rows[-1][:2]
+            stats.scanned += len(rows)
+            stats.notified += self._write(rows, today)
+
+    def _write(self, rows, today):
+        notifications = []
+        for event_date, pk, user_id, is_trial, already_canceled in rows:
+            days = (event_date - today).days
+            window = next(window for window in self.windows if days <= window)
+            kind = (RenewalNotification.EXPIRY if already_canceled
+                    else RenewalNotification.TRIAL_END if is_trial else RenewalNotification.RENEWAL)
+            notifications.append(RenewalNotification(
+                user_id=user_id, subscription_id=pk, kind=kind, event_date=event_date, window_days=window,
+            ))
+        with shard_atomic():
+            before = RenewalNotification.objects.filter(subscription_id__in=[row[1] for row in rows]).count()
+            RenewalNotification.objects.bulk_create(notifications, ignore_conflicts=True)
+            after = RenewalNotification.objects.filter(subscription_id__in=[row[1] for row in rows]).count()
+        return after - before
+
+
+# Signals to keep `next_renewal_date` in sync with `Subscription` writes
+@receiver(pre_save, sender=Subscription)
+@on_signal_database
+def set_next_renewal_date(sender, instance, raw=False, **kwargs):
+    history = ()
+    if instance.end_date is None and instance.start_date is not None and not instance.already_canceled:
+        # The other rows of the subscription (only open-ended ones need them)
+        history = Subscription.objects.filter(
+            user_id=instance.user_id, platform_name=instance.platform_name, service_name=instance.service_name,
+        ).exclude(pk=instance.pk).order_by().values_list("start_date", "end_date")
+    instance.next_renewal_date = compute_next_renewal_date(
+        instance.start_date, instance.end_date, instance.already_canceled, history=history,
+    )
+
+
+@receiver(bulk_changed)
+def refresh_renewals_on_bulk_change(sender, model, user_ids, fields=None, **kwargs):
+    # Bulk writes skip `pre_save`: recompute the affected users, unless only unrelated fields changed
+    if model is Subscription and user_ids and (fields is None or fields & RENEWAL_FIELDS):
+        refresh_next_renewal_dates(Subscription.objects.filter(user_id__in=user_ids))
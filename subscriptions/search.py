@@ -0,0 +1,266 @@
+# subscriptions/search.py
+import re
+import uuid
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from subscriptions.models import Subscription, EmailMessage
+
+# Searchable documents: for every model, the index column -> the ORM lookup it is filled from.
+SEARCH_DOCUMENTS = {
+    Subscription: {
+        "platform_name": "platform_name",
+        "service_name": "service_name",
+        "sender": "email_message_id__sender",
+        "notes": "notes",
+    },
+    EmailMessage: {
+        "subject": "subject",
+        "sender": "sender",
+        "body": "body__content",
+    },
+}
+
+DEFAULT_SEARCH_BACKEND = "subscriptions.search.SQLiteFTS5Backend"
+REBUILD_CHUNK_SIZE = 2000
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class BaseSearchBackend:
+    """
+    Interface of a search backend.
+    `fields` are index columns from `SEARCH_DOCUMENTS`; when omitted, every column of the model is searched.
+    """
+
+    def setup(self, using=None):
+        """Creates whatever storage the backend needs in the database `using` (idempotent)."""
+
+    def index(self, instance):
+        """Adds or refreshes a single object in the index."""
+
+    def index_queryset(self, queryset):
+        """Adds or refreshes every object of `queryset` (used after bulk writes, which send no signals)."""
+
+    def remove(self, instance):
+        """Removes a single object from the index."""
+
+    def rebuild(self, model):
+        """Re-indexes every row of `model` (in the current shard) and returns the number of indexed rows."""
+        return 0
+
+    def filter(self, queryset, query, fields=None):
+        """Restricts `queryset` to the objects matching `query`."""
+        raise NotImplementedError
+
+    def rank(self, queryset, query, fields=None):
+        """Like `filter`, and annotates every object with `search_rank`: order by it for the best matches first."""
+        raise NotImplementedError
+
+    def search(self, model, query, fields=None, user=None, limit=20):
+        """Returns the primary keys of the objects matching `query`, best match first."""
+        raise NotImplementedError
+
+
+class IContainsSearchBackend(BaseSearchBackend):
+    """
+    Index-less backend using `icontains` lookups (full table scan).
+    Works on every database; results are returned in the model's default ordering and are not ranked
+    (every `search_rank` is 0).
+    """
+
+    # Compressed columns cannot be matched by the database
+    UNFILTERABLE_LOOKUPS = {"body__content"}
+
+    def _q(self, model, query, fields):
+        lookups = SEARCH_DOCUMENTS[model]
+        return reduce(or_, (
+            Q(**{f"{lookups[field]}__icontains": query})
+            for field in fields or lookups
+            if lookups[field] not in self.UNFILTERABLE_LOOKUPS
+        ), Q(pk__in=[]))
+
+    def filter(self, queryset, query, fields=None):
+        return queryset.filter(self._q(queryset.model, query, fields))
+
+    def rank(self, queryset, query, fields=None):
+        return self.filter(queryset, query, fields).annotate(search_rank=Value(0.0))
+
+    def search(self, model, query, fields=None, user=None, limit=20):
+        queryset = model.objects.filter(self._q(model, query, fields))
+        if user is not None:
+            queryset = queryset.filter(user=user)
+        return list(queryset.values_list("pk", flat=True)[:limit])
+
+
+class SQLiteFTS5Backend(BaseSearchBackend):
+    """
+    SQLite FTS5 backend.
+    Every indexed model gets a `<db_table>_fts` virtual table holding the document columns plus
+    the object's primary key and user id. The FTS rowid is derived from the UUID primary key, so a
+    single object can be replaced or removed by rowid without scanning the index.
+    Every search term is matched as a prefix and ranked results are ordered by bm25 (FTS5's `rank`).
+    The index of a row lives in the database of the row (its shard, see `SubFlo.sharding`).
+    FTS5 keeps its own uncompressed copy of every document, email bodies included (`benchmark_email_storage`
+    reports its size): a contentless table would avoid it, but deleting from one needs SQLite 3.43.
+    """
+
+    def table_name(self, model):
+        return f"{model._meta.db_table}_fts"
+
+    @staticmethod
+    def rowid(pk):
+        # First 64 bits of the UUID as a signed integer (collisions are negligible at our scale)
+        return int.from_bytes(pk.bytes[:8], "big", signed=True)
+
+    @staticmethod
+    def match_expression(query, fields=None):
+        """
+        Turns free text into a safe FTS5 query: every word becomes a quoted prefix term,
+        optionally restricted to `fields` with a column filter.
+        Returns None when the text has nothing to search for.
+        """
+        terms = " ".join(f'"{token}"*' for token in _TOKEN_RE.findall(query))
+        if not terms:
+            return None
+        if fields:
+            return f"{{{' '.join(fields)}}} : ({terms})"
+        return terms
+
+    def setup(self, using=None):
+        with connections[using or router.db_for_write(Subscription)].cursor() as cursor:
+            for model, columns in SEARCH_DOCUMENTS.items():
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table_name(model)} USING fts5("
+                    f"object_id UNINDEXED, user_id UNINDEXED, {', '.join(columns)}, "
+                    f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+                )
+
+    def _rows(self, queryset):
+        lookups = SEARCH_DOCUMENTS[queryset.model]
+        values = queryset.order_by().values_list("pk", "user_id", *lookups.values())
+        for pk, user_id, *document in values.iterator(chunk_size=REBUILD_CHUNK_SIZE):
+            yield (self.rowid(pk), pk.hex, user_id, *(value or "" for value in document))
+
+    def _insert_sql(self, model):
+        columns = ["rowid", "object_id", "user_id", *SEARCH_DOCUMENTS[model]]
+        return (
+            f"INSERT INTO {self.table_name(model)} ({', '.join(columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))})"
+        )
+
+    @staticmethod
+    def _write_alias(queryset):
+        return queryset._db or router.db_for_write(queryset.model, **queryset._hints)
+
+    def _write(self, queryset):
+        model = queryset.model
+        rows = list(self._rows(queryset))
+        with connections[queryset.db].cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table_name(model)} WHERE rowid = %s", [row[:1] for row in rows])
+            cursor.executemany(self._insert_sql(model), rows)
+
+    def index(self, instance):
+        self.index_queryset(type(instance).objects.using(instance._state.db).filter(pk=instance.pk))
+
+    def index_queryset(self, queryset):
+        # Rows are read back from the database they were written to, not from a replica
+        queryset = queryset.using(self._write_alias(queryset))
+        self._write(queryset)
+        if queryset.model is EmailMessage:
+            # The subscription document embeds the sender of its email
+            self._write(Subscription.objects.using(queryset.db).filter(email_message_id__in=queryset.values("pk")))
+
+    def remove(self, instance):
+        with connections[router.db_for_write(type(instance), instance=instance)].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table_name(type(instance))} WHERE rowid = %s", [self.rowid(instance.pk)])
+
+    def rebuild(self, model):
+        alias = router.db_for_write(model)
+        self.setup(alias)
+        count = 0
+        rows = self._rows(model.objects.using(alias))
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table_name(model)}")
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= REBUILD_CHUNK_SIZE:
+                    cursor.executemany(self._insert_sql(model), chunk)
+                    count += len(chunk)
+                    chunk = []
+            if chunk:
+                cursor.executemany(self._insert_sql(model), chunk)
+                count += len(chunk)
+        return count
+
+    def filter(self, queryset, query, fields=None):
+        expression = self.match_expression(query, fields)
+        if expression is None:
+            return queryset.none()
+        table = self.table_name(queryset.model)
+        return queryset.filter(
+            pk__in=RawSQL(f"SELECT object_id FROM {table} WHERE {table} MATCH %s", (expression,))
+        )
+
+    def rank(self, queryset, query, fields=None):
+        expression = self.match_expression(query, fields)
+        if expression is None:
+            return queryset.none()
+        table = self.table_name(queryset.model)
+        quote = connections[queryset.db].ops.quote_name
+        pk = f"{quote(queryset.model._meta.db_table)}.{quote(queryset.model._meta.pk.column)}"
+        # Joined rather than filtered on `pk__in`, so the rank of every match can be read: the index is the outer
+        # loop of the join and the rows are fetched by primary key
+        return queryset.extra(
+            tables=[table], where=[f"{table} MATCH %s", f"{table}.object_id = {pk}"], params=[expression],
+        ).annotate(search_rank=RawSQL(f"{table}.rank", ()))
+
+    def search(self, model, query, fields=None, user=None, limit=20):
+        expression = self.match_expression(query, fields)
+        if expression is None:
+            return []
+        table = self.table_name(model)
+        sql = f"SELECT object_id FROM {table} WHERE {table} MATCH %s"
+        params = [expression]
+        if user is not None:
+            sql += " AND user_id = %s"
+            params.append(user.pk)
+        sql += " ORDER BY rank LIMIT %s"
+        params.append(limit)
+        hints = {"instance": user} if user is not None else {}
+        with connections[router.db_for_read(model, **hints)].cursor() as cursor:
+            cursor.execute(sql, params)
+            return [uuid.UUID(object_id) for (object_id,) in cursor.fetchall()]
+
+
+_backend = None
+
+
+def get_search_backend():
+    """
+    Returns the backend configured by `settings.SEARCH_BACKEND` (SQLite FTS5 by default).
+    """
+    global _backend
+    if _backend is None:
+        _backend = import_string(getattr(settings, "SEARCH_BACKEND", DEFAULT_SEARCH_BACKEND))()
+    return _backend
+
+
+# Signals to keep the search index in sync with `Subscription` and `EmailMessage` writes
+@receiver(post_save, sender=Subscription)
+@receiver(post_save, sender=EmailMessage)
+def index_search_document(sender, instance, **kwargs):
+    get_search_backend().index(instance)
+
+
+@receiver(post_delete, sender=Subscription)
+@receiver(post_delete, sender=EmailMessage)
+def remove_search_document(sender, instance, **kwargs):
+    get_search_backend().remove(instance)
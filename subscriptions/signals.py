@@ -0,0 +1,7 @@
+# subscriptions/signals.py
+from django.dispatch import Signal
+
+# Sent after bulk writes that bypass `post_save`/`post_delete` (bulk_create, bulk_update, queryset updates).
+# Arguments: `model` (Subscription, EmailMessage or UserProfile), `user_ids` (set of affected user ids) and optionally
+# `fields` (set of the only fields written; when omitted, any field may have changed).
+bulk_changed = Signal()
@@ -0,0 +1,208 @@
+# subscriptions/spending.py
+from datetime import date
+from decimal import Decimal
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Count, DateField, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from subscriptions.models import Subscription, SpendingRollup, ExchangeRate
+from subscriptions.signals import bulk_changed
+from SubFlo.sharding import data_aliases, on_shard, on_signal_database, shard_atomic
+
+DEFAULT_BASE_CURRENCY = "USD"
+CENT = Decimal("0.01")
+# Fields a subscription's rollup row and amount are derived from
+ROLLUP_FIELDS = {"user", "start_date", "is_trial", "price", "payment_method", "currency"}
+
+
+def base_currency():
+    return getattr(settings, "SPENDING_BASE_CURRENCY", DEFAULT_BASE_CURRENCY)
+
+
+def exchange_rate(currency):
+    """
+    Returns the rate of `currency` to the base currency, or None when the FX table has no rate for it.
+    """
+    if currency == base_currency():
+        return Decimal(1)
+    return ExchangeRate.objects.filter(currency=currency).values_list("rate", flat=True).first()
+
+
+def exchange_rates(currencies=None):
+    """
+    Returns `{currency: rate to the base currency}` for `currencies` (every currency of the FX table by default).
+    Currencies without a rate are left out; the FX table is not queried when only the base currency is asked for.
+    """
+    rates = {base_currency(): Decimal(1)}
+    if currencies is None:
+        rates.update(ExchangeRate.objects.values_list("currency", "rate"))
+    elif set(currencies) - set(rates):
+        rates.update(ExchangeRate.objects.filter(currency__in=set(currencies) - set(rates)).values_list("currency", "rate"))
+    return rates
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def rollup_key(values):
+    """
+    Returns the `(user_id, month, payment_method, currency)` row a subscription counts in and its price,
+    or None when it does not count as spend (trials and subscriptions without a price).
+    `values` is a `Subscription` or a dict of its field values.
+    """
+    get = values.get if isinstance(values, dict) else lambda name: getattr(values, name)
+    if get("is_trial") or get("price") is None:
+        return None
+    day = get("start_date") or timezone.localdate(get("created_at") or timezone.now())
+    return (get("user_id"), month_start(day), get("payment_method") or "", get("currency")), Decimal(get("price"))
+
+
+def apply_delta(key, amount, count):
+    """
+    Adds `amount` and `count` to one rollup row with a single UPDATE, creating the row on the first
+    subscription and deleting it when its last subscription is gone.
+    """
+    user_id, month, payment_method, currency = key
+    rows = SpendingRollup.objects.filter(user_id=user_id, month=month, payment_method=payment_method, currency=currency)
+    rate = exchange_rate(currency)
+    total_base = ((F("total") + amount) * rate) if rate is not None else Value(None)
+    with shard_atomic():
+        if rows.update(total=F("total") + amount, count=F("count") + count, total_base=total_base):
+            rows.filter(count=0).delete()
+            return
+        if count <= 0:
+            # Nothing to subtract from (the rows of a deleted user are already gone)
+            return
+        try:
+            with shard_atomic():
+                SpendingRollup.objects.create(
+                    user_id=user_id, month=month, payment_method=payment_method, currency=currency,
+                    total=amount, count=count, total_base=(amount * rate).quantize(CENT) if rate is not None else None,
+                )
+        except IntegrityError:
+            # Created concurrently since our UPDATE: add to it instead
+            rows.update(total=F("total") + amount, count=F("count") + count, total_base=total_base)
+
+
+def rebuild_spending_rollup(user_ids=None):
+    """
+    Recomputes the rollup from `Subscription` in one aggregate query, for `user_ids` or for every user.
+    Returns the number of rollup rows written.
+    """
+    subscriptions = Subscription.objects.filter(is_trial=False, price__isnull=False)
+    rollups = SpendingRollup.objects.all()
+    if user_ids is not None:
+        subscriptions = subscriptions.filter(user_id__in=user_ids)
+        rollups = rollups.filter(user_id__in=user_ids)
+
+    groups = (
+        subscriptions
+        .annotate(
+            month=Coalesce(TruncMonth("start_date"), TruncMonth("created_at", output_field=DateField())),
+            method=Coalesce("payment_method", Value("")),
+        )
+        .values("user_id", "month", "method", "currency")
+        .annotate(total=Sum("price"), count=Count("pk"))
+        .order_by()
+    )
+    rates = exchange_rates()
+    rows = [
+        SpendingRollup(
+            user_id=group["user_id"], month=group["month"], payment_method=group["method"],
+            currency=group["currency"], total=group["total"], count=group["count"],
+            total_base=(group["total"] * rates[group["currency"]]).quantize(CENT) if group["currency"] in rates else None,
+        )
+        for group in groups
+    ]
+    with shard_atomic():
+        rollups.delete()
+        SpendingRollup.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
+
+
+def spending_history(user_id, months=12, today=None):
+    """
+    Monthly spend of one user over the last `months` months, oldest first, read from the rollup.
+    Every month has its base-currency total, a breakdown per payment method and the totals per original currency.
+    """
+    today = today or timezone.localdate()
+    first = month_start(today)
+    for _ in range(months - 1):
+        first = month_start(date.fromordinal(first.toordinal() - 1))
+
+    history = {}
+    rows = SpendingRollup.objects.filter(user_id=user_id, month__gte=first, month__lte=today).order_by("month")
+    for row in rows.values("month", "payment_method", "currency", "total", "total_base", "count"):
+        month = history.setdefault(row["month"], {
+            "month": row["month"].strftime("%Y-%m"), "total": Decimal(0), "subscriptions": 0,
+            "by_payment_method": {}, "by_currency": {}, "unconverted_currencies": [],
+        })
+        month["subscriptions"] += row["count"]
+        month["by_currency"][row["currency"]] = month["by_currency"].get(row["currency"], Decimal(0)) + row["total"]
+        if row["total_base"] is None:
+            if row["currency"] not in month["unconverted_currencies"]:
+                month["unconverted_currencies"].append(row["currency"])
+            continue
+        method = row["payment_method"] or "Unknown"
+        month["total"] += row["total_base"]
+        month["by_payment_method"][method] = month["by_payment_method"].get(method, Decimal(0)) + row["total_base"]
+    return list(history.values())
+
+
+# Signals to keep the rollup in sync with `Subscription` writes
+@receiver(pre_save, sender=Subscription)
+@on_signal_database
+def remember_rollup_key(sender, instance, raw=False, **kwargs):
+    # What the row counted for before this save, to move its price out of the old rollup row
+    instance._previous_rollup = None
+    if not raw and not instance._state.adding:
+        previous = Subscription.objects.filter(pk=instance.pk).values(
+            "user_id", "start_date", "created_at", "is_trial", "price", "payment_method", "currency"
+        ).first()
+        instance._previous_rollup = rollup_key(previous) if previous else None
+
+
+@receiver(post_save, sender=Subscription)
+@on_signal_database
+def update_rollup_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous, current = getattr(instance, "_previous_rollup", None), rollup_key(instance)
+    if previous == current:
+        return
+    if previous is not None:
+        apply_delta(previous[0], -previous[1], -1)
+    if current is not None:
+        apply_delta(current[0], current[1], 1)
+
+
+@receiver(post_delete, sender=Subscription)
+@on_signal_database
+def update_rollup_on_delete(sender, instance, **kwargs):
+    current = rollup_key(instance)
+    if current is not None:
+        apply_delta(current[0], -current[1], -1)
+
+
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+def update_rollup_on_rate_change(sender, instance, **kwargs):
+    for alias in data_aliases():
+        with on_shard(alias):
+            rows = SpendingRollup.objects.filter(currency=instance.currency)
+            if kwargs.get("created") is None:
+                # Deleted: the currency can no longer be converted
+                rows.update(total_base=None)
+            else:
+                rows.update(total_base=F("total") * Decimal(instance.rate))
+
+
+@receiver(bulk_changed)
+def rebuild_rollup_on_bulk_change(sender, model, user_ids, fields=None, **kwargs):
+    # Bulk writes carry no previous values: recompute the affected users, unless only unrelated fields changed
+    if model is Subscription and user_ids and (fields is None or fields & ROLLUP_FIELDS):
+        rebuild_spending_rollup(user_ids)
@@ -0,0 +1,163 @@
+# subscriptions/synthetic.py
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from accounts.onboarding import onboard_users
+from SubFlo.sharding import on_shard, shard_atomic, users_by_shard
+from subscriptions.models import Subscription, EmailMessage, EmailBody
+from subscriptions.search import get_search_backend
+from subscriptions.signals import bulk_changed
+
+# Every generated user is named `<USERNAME_PREFIX><n>`, so a dataset can be grown or deleted later
+USERNAME_PREFIX = "synthetic-"
+
+PLATFORMS = ["Netflix", "Spotify", "Hulu", "Disney+", "YouTube", "Adobe", "Dropbox", "Audible"]
+PLANS = ["Basic", "Standard", "Premium", "Family"]
+PAYMENT_METHODS = ["Visa", "Mastercard", "PayPal", "Apple Pay", None]
+CURRENCIES = ["USD", "USD", "USD", "EUR", "GBP"]
+
+BODY_TEMPLATE = """<html><head><style>{style}</style></head><body>
+<table width="100%" cellpadding="0" cellspacing="0"><tr><td class="header"><img src="https://cdn.{domain}/logo.png"></td></tr>
+<tr><td class="content"><h1>Thanks for your payment</h1><p>Hi {name},</p>
+<p>Your {platform} {plan} plan has been renewed. We charged ${price} to your card ending in {card}.</p>
+<p>Order number: {order}. Your next billing date is {next_date}.</p>{filler}
+<p><a href="https://{domain}/account/unsubscribe?token={token}">Manage or cancel your subscription</a></p></td></tr>
+<tr><td class="footer">{platform} Inc. &middot; 123 Market Street &middot; San Francisco, CA</td></tr></table></body></html>"""
+
+STYLE = "body{font-family:Helvetica,Arial,sans-serif;color:#222}td.header{background:#000;padding:24px}" * 12
+
+
+def platform_domain(platform):
+    return f"{platform.lower().rstrip('+')}.com"
+
+
+def fake_body(rng, platform=None, plan=None, price=None):
+    """
+    Returns a receipt-style HTML email body of a few kilobytes, like the ones the importer sees.
+    """
+    platform = platform or rng.choice(PLATFORMS)
+    return BODY_TEMPLATE.format(
+        style=STYLE,
+        domain=platform_domain(platform),
+        name=rng.choice(["Alex", "Sam", "Jordan", "Taylor"]),
+        platform=platform,
+        plan=plan or rng.choice(PLANS),
+        price=price or f"{rng.uniform(4, 30):.2f}",
+        card=rng.randint(1000, 9999),
+        order=rng.randint(10 ** 9, 10 ** 10),
+        next_date=f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        filler="<p>Questions? Visit our help center.</p>" * rng.randint(5, 40),
+        token="%032x" % rng.getrandbits(128),
+    )
+
+
+class SyntheticDataset:
+    """
+    Generates users (with their `UserProfile`, through `onboard_users`), subscriptions and emails with
+    realistic bodies. Rows are written with `bulk_create`, `batch_users` users per transaction, and the search index and the
+    caches are refreshed per batch like the importer does. Generation is deterministic for a given seed and
+    continues after the last synthetic user, so `grow_to` can enlarge an existing dataset. The rows of each user are
+    written to the user's shard.
+    """
+
+    def __init__(self, subscriptions_per_user=10, emails_per_user=50, seed=0, batch_users=100):
+        self.subscriptions_per_user = subscriptions_per_user
+        self.emails_per_user = emails_per_user
+        self.seed = seed
+        self.batch_users = batch_users
+
+    @staticmethod
+    def users():
+        return User.objects.filter(username__startswith=USERNAME_PREFIX)
+
+    def grow_to(self, users):
+        """
+        Adds synthetic users until there are `users` of them. Returns the number of users created.
+        """
+        existing = self.users().count()
+        for start in range(existing, users, self.batch_users):
+            self.generate(start, min(start + self.batch_users, users))
+        return max(0, users - existing)
+
+    def delete(self):
+        return self.users().delete()
+
+    @transaction.atomic
+    def generate(self, start, stop):
+        now = timezone.now()
+        stats = onboard_users(
+            ({"username": f"{USERNAME_PREFIX}{n}", "email": f"user{n}@example.com", "email_access_granted": True}
+             for n in range(start, stop)),
+            batch_size=self.batch_users,
+        )
+        users = {user.pk: user for user in User.objects.filter(pk__in=stats.user_ids)}
+        for alias, user_ids in users_by_shard(users).items():
+            with on_shard(alias), shard_atomic():
+                self._write([users[user_id] for user_id in user_ids], now)
+
+    def _write(self, users, now):
+        emails, bodies, subscriptions = [], [], []
+        for user in users:
+            rng = random.Random(f"{self.seed}:{user.username}")
+            user_emails = self._emails(rng, user, now)
+            emails += user_emails
+            bodies += [EmailBody(email_message_id=email.pk, content=email.raw_email_body) for email in user_emails]
+            subscriptions += self._subscriptions(rng, user, user_emails, now.date())
+
+        EmailMessage.objects.bulk_create(emails, batch_size=500)
+        EmailBody.objects.bulk_create(bodies, batch_size=500)
+        Subscription.objects.bulk_create(subscriptions, batch_size=500)
+
+        # Bulk writes send no post_save: refresh the search index and notify the caches explicitly
+        user_ids = {user.pk for user in users}
+        backend = get_search_backend()
+        backend.index_queryset(EmailMessage.objects.filter(user_id__in=user_ids))
+        backend.index_queryset(Subscription.objects.filter(user_id__in=user_ids))
+        bulk_changed.send(sender=SyntheticDataset, model=EmailMessage, user_ids=user_ids)
+        bulk_changed.send(sender=SyntheticDataset, model=Subscription, user_ids=user_ids)
+
+    def _emails(self, rng, user, now):
+        emails = []
+        for i in range(self.emails_per_user):
+            platform, plan = rng.choice(PLATFORMS), rng.choice(PLANS)
+            price = f"{rng.uniform(4, 30):.2f}"
+            emails.append(EmailMessage(
+                id=uuid.UUID(int=rng.getrandbits(128), version=4),
+                user=user,
+                message_id=f"{rng.getrandbits(64):016x}@{platform_domain(platform)}",
+                subject=rng.choice([f"Your {platform} receipt", f"{platform} {plan} renewal",
+                                    f"Your {platform} free trial ends soon", "Weekly newsletter"]),
+                sender=f"{platform} <billing@{platform_domain(platform)}>",
+                received_date=now - timedelta(days=i * 365 / max(self.emails_per_user, 1), minutes=rng.randint(0, 1440)),
+                raw_email_body=fake_body(rng, platform, plan, price),
+                parsed_data={"is_subscription": True} if rng.random() < 0.8 else None,
+            ))
+        return emails
+
+    def _subscriptions(self, rng, user, emails, today):
+        subscriptions = []
+        for i in range(self.subscriptions_per_user):
+            platform = rng.choice(PLATFORMS)
+            # Distinct start dates keep `unique_user_platform_service_date` satisfied
+            start_date = today - timedelta(days=i * 3 + rng.randint(0, 2))
+            subscriptions.append(Subscription(
+                id=uuid.UUID(int=rng.getrandbits(128), version=4),
+                user=user,
+                platform_name=platform,
+                service_name=rng.choice(PLANS),
+                start_date=start_date,
+                end_date=None if rng.random() < 0.1 else start_date + timedelta(days=rng.choice([7, 30, 30, 30, 365])),
+                is_trial=rng.random() < 0.15,
+                already_canceled=rng.random() < 0.2,
+                price=Decimal(f"{rng.uniform(2, 40):.2f}") if rng.random() < 0.9 else None,
+                currency=rng.choice(CURRENCIES),
+                payment_method=rng.choice(PAYMENT_METHODS),
+                email_message_id=emails[i] if i < len(emails) else None,
+                unsubscribe_link=f"https://{platform_domain(platform)}/account/unsubscribe",
+                notes=rng.choice([None, None, "shared with family", "work expense", "cancel before renewal"]),
+            ))
+        return subscriptions
@@ -1,3 +1,1054 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import mailbox
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+from email.message import EmailMessage as MIMEMessage
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from accounts.models import UserProfile
+from dashboard.pagination import KeysetPaginator
+from SubFlo.sharding import placement, shard_aliases, shard_directory, shard_of
+from subscriptions.models import (Subscription, EmailMessage, ExchangeRate, RenewalNotification, SpendingRollup,
+                                  CanonicalName, LinkCheck, normalize_link)
+from subscriptions.admin import EstimatedCountPaginator, estimated_row_count
+from subscriptions.dedup import Canonicalizer, SubscriptionDeduplicator
+from subscriptions.extraction import ExtractionWorker, StubLLMClient, TokenBucket
+from subscriptions.imapstub import StubIMAPServer
+from subscriptions.linkcheck import LinkChecker
+from subscriptions.mailsync import IMAPConnectionPool, MailboxSyncer
+from subscriptions.rebalance import ShardRebalancer
+from subscriptions.prefilter import ExtractionCache, SubscriptionPrefilter
+from subscriptions.renewals import RenewalNotifier, compute_next_renewal_date, infer_billing_period
+from subscriptions.names import PLATFORM, SERVICE, normalize_name
+from subscriptions.search import get_search_backend
+from subscriptions.signals import bulk_changed
+from subscriptions.spending import spending_history
 
-# Create your tests here.
+
+class SearchIndexTests(TestCase):
+
+    def setUp(self):
+        self.backend = get_search_backend()
+        self.user = User.objects.create_user(username="alice")
+        self.email = EmailMessage.objects.create(user=self.user, subject="Your Netflix receipt", sender="info@netflix.com",
+                                                 received_date=timezone.now(), raw_email_body="Thanks for renewing Premium.")
+        self.netflix = Subscription.objects.create(user=self.user, platform_name="Netflix", service_name="Premium",
+                                                   email_message_id=self.email, notes="shared with family")
+        self.spotify = Subscription.objects.create(user=self.user, platform_name="Spotify", service_name="Family")
+
+    def search(self, query, fields=None, model=Subscription):
+        return set(self.backend.filter(model.objects.all(), query, fields).values_list("pk", flat=True))
+
+    def test_prefix_matching(self):
+        self.assertEqual(self.search("netf"), {self.netflix.pk})
+        self.assertEqual(self.search("NETFLIX prem"), {self.netflix.pk})
+        self.assertEqual(self.search("netflix basic"), set())
+
+    def test_column_filter(self):
+        self.assertEqual(self.search("family", fields=("platform_name", "service_name", "sender")), {self.spotify.pk})
+        self.assertEqual(self.search("family", fields=("notes",)), {self.netflix.pk})
+
+    def test_ranked_search(self):
+        family_link = Subscription.objects.create(user=self.user, platform_name="Family Link", service_name="Family",
+                                                  notes="family family")
+        results = self.backend.search(Subscription, "family")
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0], family_link.pk)
+        self.assertEqual(self.backend.search(Subscription, "family", user=User.objects.create_user("bob")), [])
+
+    def test_index_follows_writes(self):
+        self.spotify.platform_name = "Deezer"
+        self.spotify.save()
+        self.assertEqual(self.search("spotify"), set())
+        self.assertEqual(self.search("deezer"), {self.spotify.pk})
+
+        self.email.sender = "billing@example.org"
+        self.email.save()
+        self.assertEqual(self.search("billing", fields=("sender",)), {self.netflix.pk})
+        self.assertEqual(self.search("renewing", model=EmailMessage), {self.email.pk})
+
+        self.netflix.delete()
+        self.assertEqual(self.search("netflix"), set())
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM subscriptions_subscription_fts")
+        self.assertEqual(self.search("spotify"), set())
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(self.search("spotify"), {self.spotify.pk})
+
+
+class ImportEmailsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice")
+        self.profile = self.user.profile
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.root = Path(self.directory.name)
+        self.now = timezone.now().replace(microsecond=0)
+
+        box = mailbox.mbox(self.root / "inbox.mbox")
+        for i in range(5):
+            box.add(self.mime(f"<receipt-{i}@netflix.com>", f"Netflix receipt {i}", self.now - timedelta(days=i)))
+        box.close()
+        # No Message-ID header: deduplicated by content hash
+        (self.root / "welcome.eml").write_bytes(bytes(self.mime(None, "Welcome to Spotify", self.now)))
+        with open(self.root / "export.jsonl", "w") as lines:
+            lines.write(json.dumps({"message_id": "hulu-1", "subject": "Hulu trial", "sender": "hulu@hulu.com",
+                                    "received_date": self.now.isoformat(), "body": "Your trial ends soon"}) + "\n")
+            lines.write("{not json}\n")
+
+    def mime(self, message_id, subject, date):
+        message = MIMEMessage()
+        if message_id:
+            message["Message-ID"] = message_id
+        message["Subject"] = subject
+        message["From"] = "billing@example.com"
+        message["Date"] = format_datetime(date)
+        message.set_content(f"<p>{subject}</p>", subtype="html")
+        return message
+
+    def run_import(self, *args):
+        stdout = StringIO()
+        call_command("import_emails", str(self.profile.id), str(self.root), "--batch-size", "3", *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_import_is_idempotent(self):
+        output = self.run_import("--workers", "2")
+        self.assertIn("7 imported", output)
+        self.assertIn("1 unreadable", output)
+        self.assertIn("messages/s", output)
+        self.assertEqual(EmailMessage.objects.filter(user=self.user).count(), 7)
+        email = EmailMessage.objects.get(message_id="receipt-1@netflix.com")
+        self.assertEqual(email.received_date, self.now - timedelta(days=1))
+        self.assertIn("<p>Netflix receipt 1</p>", email.raw_email_body)
+        self.assertTrue(EmailMessage.objects.get(subject="Welcome to Spotify").message_id.startswith("sha256:"))
+        self.assertEqual(self.search_backend_hits("hulu"), 1)
+
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.last_processed_date, self.now)
+
+        # Everything is behind the high-water mark now
+        self.assertIn("0 imported, 0 duplicates, 7 already processed", self.run_import("--workers", "0"))
+        # Ignoring the mark, every message is a duplicate
+        self.assertIn("0 imported, 7 duplicates", self.run_import("--workers", "0", "--full"))
+        self.assertEqual(EmailMessage.objects.filter(user=self.user).count(), 7)
+
+    def search_backend_hits(self, query):
+        return get_search_backend().filter(EmailMessage.objects.all(), query).count()
+
+
+class MailboxSyncTests(TestCase):
+
+    def setUp(self):
+        self.server = StubIMAPServer().start()
+        self.addCleanup(self.server.stop)
+        self.enterContext(override_settings(MAIL_SYNC_IMAP_HOST=self.server.host, MAIL_SYNC_IMAP_PORT=self.server.port,
+                                            MAIL_SYNC_IMAP_SSL=False, MAIL_SYNC_IMAP_PASSWORD="secret"))
+        self.user = User.objects.create_user(username="alice", email="alice@example.com")
+        self.user.profile.email_access_granted = True
+        self.user.profile.save()
+        self.mailbox = self.server.add_mailbox("alice@example.com", "secret")
+        self.now = timezone.now().replace(microsecond=0)
+        self.mailbox.append(self.mime("<r1@netflix.com>", "Your Netflix receipt", "Netflix <info@netflix.com>"))
+        self.mailbox.append(self.mime("<n1@digest.org>", "This week's stories", "Digest <news@digest.org>"))
+        self.mailbox.append(self.mime("<r2@spotify.com>", "Spotify Premium renewal", "Spotify <no-reply@spotify.com>"))
+        self.pool = IMAPConnectionPool()
+        self.addCleanup(self.pool.close_all)
+
+    def mime(self, message_id, subject, sender):
+        message = MIMEMessage()
+        message["Message-ID"] = message_id
+        message["Subject"] = subject
+        message["From"] = sender
+        message["Date"] = format_datetime(self.now)
+        message.set_content(f"<p>{subject}</p>", subtype="html")
+        return message.as_bytes()
+
+    def sync(self):
+        return MailboxSyncer(self.pool, concurrency=2).run(UserProfile.objects.select_related("user"))
+
+    def test_incremental_sync_downloads_candidates_only(self):
+        stats = self.sync()
+        self.assertEqual((stats.users, stats.headers, stats.bodies, stats.imported), (1, 3, 2, 2))
+        self.assertEqual(self.server.bodies_sent, 2)
+        self.assertEqual(set(EmailMessage.objects.values_list("message_id", flat=True)), {"r1@netflix.com", "r2@spotify.com"})
+        self.assertIn("<p>Your Netflix receipt</p>", EmailMessage.objects.get(message_id="r1@netflix.com").raw_email_body)
+        self.user.profile.refresh_from_db()
+        self.assertEqual((self.user.profile.imap_uid_validity, self.user.profile.imap_last_uid), (1, 3))
+        self.assertEqual(self.user.profile.last_processed_date, self.now)
+
+        # Only the new message is looked at, on the pooled connection
+        self.mailbox.append(self.mime("<r3@hulu.com>", "Hulu receipt", "Hulu <billing@hulu.com>"))
+        stats = self.sync()
+        self.assertEqual((stats.headers, stats.bodies, stats.imported), (1, 1, 1))
+        self.assertEqual(self.sync().headers, 0)
+        self.assertEqual((self.server.logins, self.pool.opened), (1, 1))
+
+    def test_new_uid_validity_resyncs_without_duplicates(self):
+        self.sync()
+        self.mailbox.uid_validity = 2
+        stats = self.sync()
+        self.assertEqual((stats.headers, stats.imported, stats.duplicates), (3, 0, 2))
+        self.assertEqual(EmailMessage.objects.count(), 2)
+
+    def test_chunks_are_stored_as_they_arrive(self):
+        fetch, calls = MailboxSyncer._fetch, []
+
+        def fail_on_third_command(syncer, client, uids, items):
+            # Headers and bodies of the first chunk, then the connection drops
+            calls.append(uids)
+            if len(calls) == 3:
+                raise OSError("connection reset")
+            return fetch(syncer, client, uids, items)
+
+        with mock.patch("subscriptions.mailsync.FETCH_CHUNK_SIZE", 2), \
+                mock.patch.object(MailboxSyncer, "_fetch", fail_on_third_command):
+            stats = self.sync()
+        self.assertEqual((stats.users, stats.failed, stats.imported), (0, 1, 1))
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.imap_last_uid, 2)
+
+        # The next sync resumes after the stored chunk
+        stats = self.sync()
+        self.assertEqual((stats.users, stats.headers, stats.imported), (1, 1, 1))
+        self.assertEqual(EmailMessage.objects.count(), 2)
+
+    def test_command_syncs_users_in_parallel(self):
+        for name in ("bob", "carol"):
+            user = User.objects.create_user(username=name, email=f"{name}@example.com")
+            user.profile.email_access_granted = True
+            user.profile.save()
+            self.server.add_mailbox(f"{name}@example.com", "secret" if name == "bob" else "wrong").append(
+                self.mime(f"<{name}@netflix.com>", "Netflix receipt", "info@netflix.com"))
+        out, err = StringIO(), StringIO()
+        call_command("sync_mailboxes", concurrency=3, stdout=out, stderr=err)
+        self.assertIn("Synced 2 mailboxes (1 failed)", out.getvalue())
+        self.assertIn("invalid credentials", err.getvalue())
+        self.assertEqual(EmailMessage.objects.filter(user__username="bob").count(), 1)
+        self.assertEqual(EmailMessage.objects.count(), 3)
+
+
+class StubLinkHandler(BaseHTTPRequestHandler):
+    """Answers by path: /ok, /gone (404), /moved (redirect to /ok), /get-only (405 to HEAD), /slow."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def answer(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            if self.path.startswith("/slow"):
+                time.sleep(server.delay)
+            if self.path == "/gone":
+                self.send_response(404)
+            elif self.path == "/moved":
+                self.send_response(302)
+                self.send_header("Location", "/ok")
+            elif self.path.startswith("/escape"):
+                # The same server under another name, or a cloud metadata address
+                self.send_response(302)
+                self.send_header("Location", f"http://localhost:{server.server_address[1]}/ok"
+                                 if self.path == "/escape" else "http://169.254.169.254/latest/meta-data/")
+            elif self.path == "/get-only" and self.command == "HEAD":
+                self.send_response(405)
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    do_HEAD = do_GET = answer
+
+
+class LinkCheckTests(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubLinkHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests, self.server.in_flight, self.server.max_in_flight, self.server.delay = [], 0, 0, 0.2
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.trusted_hosts = {("127.0.0.1", self.server.server_address[1])}
+        self.alice = User.objects.create_user(username="alice")
+        self.bob = User.objects.create_user(username="bob")
+
+    def subscribe(self, user, link):
+        return Subscription.objects.create(user=user, platform_name="Netflix", service_name="Premium",
+                                           unsubscribe_link=link)
+
+    def checker(self, **options):
+        return LinkChecker(trusted_hosts=self.trusted_hosts, **options)
+
+    def statuses(self):
+        return {check.url[len(self.base):]: (check.status, check.status_code) for check in LinkCheck.objects.all()}
+
+    def test_normalize_link(self):
+        self.assertEqual(normalize_link(" netflix.com/cancel "), "https://netflix.com/cancel")
+        self.assertEqual(normalize_link("//netflix.com/cancel"), "https://netflix.com/cancel")
+        self.assertEqual(normalize_link("http://netflix.com"), "http://netflix.com")
+        self.assertEqual(normalize_link("mailto:stop@netflix.com"), "mailto:stop@netflix.com")
+        self.assertEqual(normalize_link("netflix.com:8443/cancel"), "https://netflix.com:8443/cancel")
+        self.assertIsNone(normalize_link("javascript:alert(1)"))
+        self.assertIsNone(normalize_link(""))
+        self.assertIsNone(normalize_link(None))
+
+    def test_checks_each_link_once_and_caches_the_result(self):
+        for path in ("/ok", "/gone", "/moved", "/get-only"):
+            self.subscribe(self.alice, self.base + path)
+            self.subscribe(self.bob, self.base + path)
+        self.subscribe(self.bob, "mailto:stop@netflix.com")
+        stats = self.checker(timeout=5).run()
+        self.assertEqual((stats.checked, stats.ok, stats.dead), (4, 3, 1))
+        self.assertEqual(self.statuses(), {
+            "/ok": (LinkCheck.OK, 200), "/gone": (LinkCheck.BROKEN, 404),
+            "/moved": (LinkCheck.OK, 200), "/get-only": (LinkCheck.OK, 200),
+        })
+        self.assertEqual(sorted(self.server.requests), sorted([
+            ("HEAD", "/ok"), ("HEAD", "/gone"), ("HEAD", "/moved"), ("HEAD", "/ok"),
+            ("HEAD", "/get-only"), ("GET", "/get-only"),
+        ]))
+
+        # Fresh results are not requested again, unless asked
+        self.assertEqual(self.checker().run().checked, 0)
+        self.assertEqual(self.checker(timeout=5).run(recheck=True).checked, 4)
+
+    def test_private_addresses_and_ports_are_blocked(self):
+        port = self.server.server_address[1]
+        links = [f"http://localhost:{port}/ok", "http://127.0.0.1/ok", "http://10.0.0.1/", "http://[::ffff:127.0.0.1]/",
+                 "http://169.254.169.254/latest/meta-data/", "http://example.com:8080/", self.base + "/escape",
+                 self.base + "/escape-metadata"]
+        for link in links:
+            self.subscribe(self.alice, link)
+        stats = self.checker(timeout=5).run()
+        self.assertEqual((stats.checked, stats.dead), (8, 8))
+        for check in LinkCheck.objects.all():
+            self.assertEqual(check.status, LinkCheck.UNREACHABLE)
+            self.assertTrue(check.error.startswith("Blocked"), check.error)
+        # Only the trusted stub was contacted, and not through the redirects
+        self.assertEqual(sorted(self.server.requests), [("HEAD", "/escape"), ("HEAD", "/escape-metadata")])
+
+    def test_timeout_and_per_host_limit(self):
+        for i in range(6):
+            self.subscribe(self.alice, f"{self.base}/slow/{i}")
+        stats = self.checker(concurrency=10, per_host=2, timeout=5).run()
+        self.assertEqual(stats.ok, 6)
+        self.assertEqual(self.server.max_in_flight, 2)
+
+        self.subscribe(self.alice, f"{self.base}/slow/late")
+        self.assertEqual(self.checker(timeout=0.05).run().dead, 1)
+        check = LinkCheck.objects.get(url=f"{self.base}/slow/late")
+        self.assertEqual((check.status, check.error), (LinkCheck.UNREACHABLE, "Timed out"))
+
+    def test_pages_read_the_results_in_one_query(self):
+        dead = self.subscribe(self.alice, self.base + "/gone")
+        dead.email_message_id = EmailMessage.objects.create(user=self.alice, subject="Receipt", sender="info@netflix.com",
+                                                            received_date=timezone.now(), raw_email_body="...")
+        dead.save()
+        self.subscribe(self.alice, self.base + "/ok")
+        self.checker(timeout=5).run()
+        response = self.client.get(reverse("subscription-list-url"))
+        self.assertEqual({sub.pk: sub.link_check.is_dead for sub in response.context["subscriptions"]}.get(dead.pk), True)
+        self.assertContains(response, "Link may be broken", count=1)
+        self.assertContains(self.client.get(dead.get_absolute_url()), "may be broken")
+
+
+class FlakyLLMClient(StubLLMClient):
+
+    async def extract(self, email):
+        if "flaky" in email["subject"]:
+            raise TimeoutError
+        return await super().extract(email)
+
+
+class ExtractionWorkerTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice")
+        now = timezone.now()
+        self.emails = [
+            EmailMessage.objects.create(user=self.user, subject=subject, sender=sender, received_date=now,
+                                        raw_email_body=body)
+            for subject, sender, body in [
+                ("Your Netflix receipt", "info@netflix.com", "Premium plan renewed: $15.49"),
+                ("Spotify Family plan", "no-reply@spotify.com", "Your subscription costs €16.99"),
+                ("Lunch on Friday?", "bob@example.com", "See you there"),
+                ("flaky receipt", "billing@hulu.com", "Basic plan $7.99"),
+            ]
+        ]
+
+    def run_worker(self, **kwargs):
+        # The flaky email fails on every run
+        with self.assertLogs("subscriptions.extraction", "WARNING") as self.logs:
+            return ExtractionWorker(FlakyLLMClient(latency=0), batch_size=2, **kwargs).run()
+
+    def test_extracts_and_upserts(self):
+        stats = self.run_worker(concurrency=2)
+        self.assertEqual((stats.processed, stats.failed, stats.failures, stats.subscriptions), (3, 1, 1, 2))
+        self.assertIn(f"email {self.emails[3].pk} failed", self.logs.output[0])
+
+        netflix = Subscription.objects.get(platform_name="Netflix")
+        self.assertEqual(netflix.service_name, "Premium")
+        self.assertEqual(str(netflix.price), "15.49")
+        self.assertEqual(netflix.email_message_id, self.emails[0])
+        self.assertEqual(Subscription.objects.get(platform_name="Spotify").currency, "EUR")
+        self.assertEqual(EmailMessage.objects.get(pk=self.emails[2].pk).parsed_data, {"is_subscription": False})
+        # The failed call is left for the next run
+        self.assertEqual(list(ExtractionWorker(None).pending()), [self.emails[3]])
+        self.assertEqual(get_search_backend().filter(Subscription.objects.all(), "netflix").count(), 1)
+
+    def test_upsert_updates_existing_subscription(self):
+        self.run_worker()
+        email = self.emails[0]
+        email.parsed_data = None
+        email.raw_email_body = "Premium plan renewed: $17.99"
+        email.save()
+        self.run_worker()
+        netflix = Subscription.objects.get(platform_name="Netflix")
+        self.assertEqual(str(netflix.price), "17.99")
+        self.assertEqual(Subscription.objects.count(), 2)
+
+    def test_reparse_moving_to_another_key(self):
+        self.run_worker()
+        email = self.emails[0]
+        email.parsed_data = None
+        email.raw_email_body = "Basic plan renewed: $9.99"
+        email.save()
+        self.run_worker()
+        netflix = Subscription.objects.get(platform_name="Netflix")
+        self.assertEqual((netflix.service_name, netflix.email_message_id), ("Basic", email))
+        self.assertEqual(Subscription.objects.count(), 2)
+
+    def test_reparse_undated_result(self):
+        class UndatedClient(FlakyLLMClient):
+            async def extract(self, email):
+                result = await super().extract(email)
+                if result["is_subscription"]:
+                    result["subscription"].update(start_date=None, end_date=None)
+                return result
+
+        for _ in range(2):
+            EmailMessage.objects.filter(pk=self.emails[0].pk).update(parsed_data=None)
+            with self.assertLogs("subscriptions.extraction", "WARNING"):
+                ExtractionWorker(UndatedClient(latency=0)).run()
+        netflix = Subscription.objects.get(platform_name="Netflix")
+        self.assertEqual((netflix.start_date, netflix.email_message_id), (None, self.emails[0]))
+        self.assertEqual(Subscription.objects.count(), 2)
+
+    def test_unusable_results_are_failures(self):
+        class BadDateClient(FlakyLLMClient):
+            async def extract(self, email):
+                result = await super().extract(email)
+                if "Spotify" in email["subject"]:
+                    result["subscription"]["start_date"] = "March 2026"
+                return result
+
+        cache = ExtractionCache()
+        with self.assertLogs("subscriptions.extraction", "WARNING") as logs:
+            stats = ExtractionWorker(BadDateClient(latency=0), cache=cache).run()
+        self.assertEqual((stats.processed, stats.failed, stats.failures, stats.subscriptions), (2, 2, 2, 1))
+        self.assertIn("'March 2026' is not an ISO date", "".join(logs.output))
+        self.assertEqual(set(ExtractionWorker(None).pending()), {self.emails[1], self.emails[3]})
+        self.assertEqual(len(cache.entries), 2)
+        cache.set({"user_id": self.user.pk, "subject": "Receipt", "sender": "a@b.com", "raw_email_body": "",
+                   "received_date": timezone.now()}, {"is_subscription": True, "subscription": {"end_date": "soon"}})
+        self.assertEqual(len(cache.entries), 2)
+
+    def test_unexpected_errors_are_not_swallowed(self):
+        class BrokenClient(StubLLMClient):
+            async def extract(self, email):
+                raise KeyError("subject")
+
+        with self.assertRaises(KeyError):
+            ExtractionWorker(BrokenClient(latency=0)).run()
+
+    def test_token_bucket_limits_rate(self):
+        async def acquire_all(bucket, count):
+            for _ in range(count):
+                await bucket.acquire()
+
+        started = time.monotonic()
+        asyncio.run(acquire_all(TokenBucket(rate=50, capacity=1), 6))
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+
+class PrefilterTests(TestCase):
+
+    def email(self, subject, sender="bob@example.com", body="", user_id=1, days_ago=0):
+        return {"user_id": user_id, "subject": subject, "sender": sender, "raw_email_body": body,
+                "received_date": timezone.now() - timedelta(days=days_ago)}
+
+    def test_prefilter_rules(self):
+        prefilter = SubscriptionPrefilter(patterns=[r"order #\d+"])
+        self.assertTrue(prefilter.accepts(self.email("Hello", sender="Netflix <info@mailer.netflix.com>")))
+        self.assertTrue(prefilter.accepts(self.email("Your free trial ends tomorrow")))
+        self.assertTrue(prefilter.accepts(self.email("Thanks", body="<p>Order #1234 shipped</p>")))
+        self.assertFalse(prefilter.accepts(self.email("Lunch on Friday?", body="See you at noon")))
+        self.assertFalse(prefilter.accepts(self.email("Hello", sender="alice@notnetflix.com")))
+
+    def test_cache_reuses_templated_receipts(self):
+        cache = ExtractionCache(max_size=2)
+        march = self.email("Your receipt", body="Order 12345678 on 2026-03-01: $9.99 "
+                                                 "https://x.com/unsubscribe?token=abc", days_ago=30)
+        april = self.email("Your receipt", body="Order 87654321 on 2026-04-01: $9.99 "
+                                                 "https://x.com/unsubscribe?token=def")
+        start = march["received_date"].date()
+        cache.set(march, {"is_subscription": True, "subscription": {
+            "platform_name": "X", "start_date": start.isoformat(),
+            "end_date": (start + timedelta(days=30)).isoformat()}})
+
+        result = cache.get(april)
+        self.assertEqual(result["subscription"]["start_date"], april["received_date"].date().isoformat())
+        self.assertEqual(cache.get(dict(april, body="...", raw_email_body="$19.99")), None)
+        self.assertEqual(cache.get(dict(april, user_id=2)), None)
+        self.assertAlmostEqual(cache.hit_rate, 1 / 3)
+
+        cache.set(self.email("a"), {"is_subscription": False})
+        cache.set(self.email("b"), {"is_subscription": False})
+        self.assertIsNone(cache.get(april))
+
+    def test_worker_reports_skips_and_hits(self):
+        user = User.objects.create_user(username="alice")
+        now = timezone.now()
+        for i in range(3):
+            EmailMessage.objects.create(user=user, subject="Your Netflix receipt", sender="info@netflix.com",
+                                        received_date=now - timedelta(days=30 * i),
+                                        raw_email_body=f"Premium plan renewed: $15.49, order {1000000 + i}")
+        EmailMessage.objects.create(user=user, subject="Lunch?", sender="bob@example.com", received_date=now,
+                                    raw_email_body="See you")
+        worker = ExtractionWorker(StubLLMClient(latency=0), concurrency=1,
+                                  prefilter=SubscriptionPrefilter(), cache=ExtractionCache())
+        stats = worker.run()
+        self.assertEqual((stats.processed, stats.skipped, stats.cache_hits, stats.llm_calls), (4, 1, 2, 1))
+        self.assertEqual(Subscription.objects.filter(platform_name="Netflix").count(), 3)
+
+    def test_failed_call_is_retried_by_one_waiter(self):
+        class FailingOnceClient(StubLLMClient):
+            calls = 0
+
+            async def extract(self, email):
+                self.calls += 1
+                if self.calls == 1:
+                    await asyncio.sleep(0.01)
+                    raise TimeoutError
+                return await super().extract(email)
+
+        user = User.objects.create_user(username="alice")
+        for _ in range(4):
+            EmailMessage.objects.create(user=user, subject="Your Netflix receipt", sender="info@netflix.com",
+                                        received_date=timezone.now(), raw_email_body="Premium plan renewed: $15.49")
+        worker = ExtractionWorker(FailingOnceClient(latency=0.01), concurrency=4, cache=ExtractionCache())
+        with self.assertLogs("subscriptions.extraction", "WARNING"):
+            stats = worker.run()
+        self.assertEqual((stats.processed, stats.failed, stats.llm_calls, stats.cache_hits), (3, 1, 2, 2))
+
+
+class EmailBodyStorageTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice")
+        self.body = "<p>Your Netflix Premium plan renewed.</p>" * 200
+        self.email = EmailMessage.objects.create(user=self.user, subject="Receipt", sender="info@netflix.com",
+                                                 received_date=timezone.now(), raw_email_body=self.body)
+
+    def test_body_is_stored_compressed(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT content FROM subscriptions_emailbody WHERE email_message_id = %s", [self.email.pk.hex])
+            stored = bytes(cursor.fetchone()[0])
+        self.assertLess(len(stored), len(self.body) / 10)
+        self.assertEqual(EmailMessage.objects.get(pk=self.email.pk).raw_email_body, self.body)
+
+    def test_body_is_loaded_lazily(self):
+        with self.assertNumQueries(1):
+            email = EmailMessage.objects.get(pk=self.email.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(email.raw_email_body, self.body)
+        with self.assertNumQueries(1):
+            self.assertEqual(EmailMessage.objects.select_related("body").get(pk=self.email.pk).raw_email_body, self.body)
+
+    def test_body_update(self):
+        self.email.raw_email_body = "updated"
+        self.email.save()
+        self.assertEqual(EmailMessage.objects.get(pk=self.email.pk).raw_email_body, "updated")
+        self.assertEqual(EmailMessage.objects.create(user=self.user, subject="No body", sender="x",
+                                                     received_date=timezone.now()).raw_email_body, "")
+
+
+class SyntheticDatasetTests(TestCase):
+
+    def test_generates_and_grows_dataset(self):
+        out = StringIO()
+        call_command("generate_dataset", users=3, subscriptions=4, emails=5, batch_users=2, stdout=out)
+        self.assertIn("Created 3 users", out.getvalue())
+        self.assertEqual(UserProfile.objects.count(), 3)
+        self.assertEqual(Subscription.objects.count(), 12)
+        self.assertEqual(EmailMessage.objects.filter(body__isnull=False).count(), 15)
+        self.assertIn("renewed", EmailMessage.objects.first().raw_email_body)
+        self.assertTrue(get_search_backend().search(Subscription, Subscription.objects.first().platform_name))
+
+        # A second run only adds the missing users
+        call_command("generate_dataset", users=4, subscriptions=4, emails=5, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 4)
+        self.assertEqual(Subscription.objects.count(), 16)
+
+        call_command("generate_dataset", users=1, subscriptions=1, emails=1, clear=True, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 1)
+        self.assertEqual(EmailMessage.objects.count(), 1)
+
+
+class SpendingRollupTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice")
+        ExchangeRate.objects.create(currency="EUR", rate=Decimal("1.10"))
+        self.month = date(2026, 3, 1)
+
+    def subscribe(self, platform, price, currency="USD", payment_method="Visa", **fields):
+        return Subscription.objects.create(user=self.user, platform_name=platform, service_name="Premium",
+                                           start_date=date(2026, 3, 5), price=Decimal(price), currency=currency,
+                                           payment_method=payment_method, **fields)
+
+    def rollup(self):
+        return sorted(SpendingRollup.objects.values_list("month", "payment_method", "currency", "total", "total_base", "count"))
+
+    def test_incremental_updates_match_a_rebuild(self):
+        netflix = self.subscribe("Netflix", "15.49")
+        self.subscribe("Spotify", "10.00", currency="EUR")
+        self.subscribe("Hulu", "7.99", is_trial=True)
+        self.subscribe("Max", "9.99", payment_method=None)
+        self.assertEqual(self.rollup(), [
+            (self.month, "", "USD", Decimal("9.99"), Decimal("9.99"), 1),
+            (self.month, "Visa", "EUR", Decimal("10.00"), Decimal("11.00"), 1),
+            (self.month, "Visa", "USD", Decimal("15.49"), Decimal("15.49"), 1),
+        ])
+
+        # Moving a subscription to another month and payment method moves its price
+        netflix.payment_method = "PayPal"
+        netflix.start_date = date(2026, 4, 2)
+        netflix.save()
+        netflix.refresh_from_db()
+        Subscription.objects.get(platform_name="Max").delete()
+        incremental = self.rollup()
+        self.assertIn((date(2026, 4, 1), "PayPal", "USD", Decimal("15.49"), Decimal("15.49"), 1), incremental)
+        self.assertEqual(len(incremental), 2)
+
+        call_command("rebuild_spending_rollup", stdout=StringIO())
+        self.assertEqual(self.rollup(), incremental)
+
+    def test_rate_changes_and_unknown_currencies(self):
+        self.subscribe("Spotify", "10.00", currency="EUR")
+        self.subscribe("Deezer", "5.00", currency="XYZ")
+        rate = ExchangeRate.objects.get(currency="EUR")
+        rate.rate = Decimal("1.20")
+        rate.save()
+        self.assertEqual(SpendingRollup.objects.get(currency="EUR").total_base, Decimal("12.00"))
+        self.assertIsNone(SpendingRollup.objects.get(currency="XYZ").total_base)
+
+        history = spending_history(self.user.pk, months=2, today=date(2026, 4, 15))
+        self.assertEqual(len(history), 1)
+        self.assertEqual(history[0]["month"], "2026-03")
+        self.assertEqual(history[0]["total"], Decimal("12.00"))
+        self.assertEqual(history[0]["unconverted_currencies"], ["XYZ"])
+        self.assertEqual(history[0]["by_currency"], {"EUR": Decimal("10.00"), "XYZ": Decimal("5.00")})
+
+    def test_bulk_writes_rebuild_the_user(self):
+        Subscription.objects.bulk_create([
+            Subscription(user=self.user, platform_name="Netflix", service_name="Premium", start_date=date(2026, 3, 5),
+                         price=Decimal("15.49"))
+        ])
+        self.assertFalse(SpendingRollup.objects.exists())
+        bulk_changed.send(sender=None, model=Subscription, user_ids={self.user.pk})
+        self.assertEqual(SpendingRollup.objects.get().total, Decimal("15.49"))
+
+
+class RenewalTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice")
+        self.today = timezone.localdate()
+
+    def subscribe(self, platform, **fields):
+        return Subscription.objects.create(user=self.user, platform_name=platform, service_name="Premium", **fields)
+
+    def test_next_renewal_date(self):
+        today = date(2026, 3, 15)
+        # Period end (renewal or, once canceled, expiry); a past period is superseded by its renewal row
+        self.assertEqual(compute_next_renewal_date(date(2026, 3, 1), date(2026, 3, 31), False, today), date(2026, 3, 31))
+        self.assertEqual(compute_next_renewal_date(date(2026, 3, 1), date(2026, 3, 31), True, today), date(2026, 3, 31))
+        self.assertIsNone(compute_next_renewal_date(date(2026, 2, 1), date(2026, 3, 1), False, today))
+        # Open-ended: every month from the start date (clamped to short months)
+        self.assertEqual(compute_next_renewal_date(date(2025, 1, 31), None, False, today), date(2026, 3, 31))
+        self.assertEqual(compute_next_renewal_date(date(2026, 3, 15), None, False, today), date(2026, 3, 15))
+        self.assertIsNone(compute_next_renewal_date(date(2026, 1, 1), None, True, today))
+        self.assertEqual(infer_billing_period(date(2026, 1, 1), date(2027, 1, 1))[0], "yearly")
+        self.assertEqual(infer_billing_period(date(2026, 1, 1), date(2026, 1, 8))[0], "weekly")
+        # The billing period of an open-ended subscription comes from its other rows
+        yearly = [(date(2024, 3, 20), date(2025, 3, 19)), (date(2025, 3, 20), date(2026, 3, 19))]
+        self.assertEqual(compute_next_renewal_date(date(2026, 3, 20), None, False, today, yearly), date(2026, 3, 20))
+        self.assertEqual(compute_next_renewal_date(date(2025, 3, 20), None, False, today, yearly), date(2026, 3, 20))
+        quarterly_starts = [(date(2025, 6, 1), None), (date(2025, 9, 1), None)]
+        self.assertEqual(compute_next_renewal_date(date(2025, 12, 1), None, False, today, quarterly_starts),
+                         date(2026, 6, 1))
+
+    def test_open_ended_subscription_follows_its_history(self):
+        for year in (2023, 2024):
+            self.subscribe("Netflix", start_date=date(year, 1, 10), end_date=date(year + 1, 1, 9))
+        current = self.subscribe("Netflix", start_date=date(2025, 1, 10))
+        self.assertEqual((current.next_renewal_date.month, current.next_renewal_date.day), (1, 10))
+
+    def test_notification_job_is_idempotent(self):
+        renewing = self.subscribe("Netflix", end_date=self.today + timedelta(days=5))
+        trial = self.subscribe("Hulu", end_date=self.today + timedelta(days=1), is_trial=True)
+        expiring = self.subscribe("Max", end_date=self.today, already_canceled=True)
+        self.subscribe("Spotify", end_date=self.today + timedelta(days=30))
+        self.assertEqual(renewing.next_renewal_date, self.today + timedelta(days=5))
+
+        out = StringIO()
+        call_command("notify_renewals", windows="7,1", batch_size=2, stdout=out)
+        self.assertIn("Wrote 3 new notifications", out.getvalue())
+        self.assertEqual(
+            set(RenewalNotification.objects.values_list("subscription_id", "kind", "window_days")),
+            {(renewing.pk, "renewal", 7), (trial.pk, "trial_end", 1), (expiring.pk, "expiry", 1)},
+        )
+        call_command("notify_renewals", windows="7,1", stdout=out)
+        self.assertIn("Wrote 0 new notifications", out.getvalue())
+
+        # Four days later the renewal enters the 1-day window
+        stats = RenewalNotifier(windows=[7, 1]).run(self.today + timedelta(days=4))
+        self.assertEqual(stats.notified, 1)
+        self.assertTrue(RenewalNotification.objects.filter(subscription=renewing, window_days=1).exists())
+
+    def test_job_moves_past_dates_forward(self):
+        monthly = self.subscribe("Netflix", start_date=self.today - timedelta(days=40))
+        ended = self.subscribe("Hulu", end_date=self.today + timedelta(days=1))
+        later = self.today + timedelta(days=45)
+        RenewalNotifier().run(later)
+        monthly.refresh_from_db()
+        ended.refresh_from_db()
+        self.assertGreaterEqual(monthly.next_renewal_date, later)
+        self.assertIsNone(ended.next_renewal_date)
+
+    def test_bulk_writes_refresh_renewal_dates(self):
+        subscription = self.subscribe("Netflix", end_date=self.today + timedelta(days=3))
+        Subscription.objects.filter(pk=subscription.pk).update(end_date=self.today + timedelta(days=9))
+        bulk_changed.send(sender=None, model=Subscription, user_ids={self.user.pk}, fields={"end_date"})
+        refreshed = Subscription.objects.get(pk=subscription.pk)
+        self.assertEqual(refreshed.next_renewal_date, self.today + timedelta(days=9))
+        # Visible to change tracking (exports since a date, shard rebalancing)
+        self.assertGreater(refreshed.updated_at, subscription.updated_at)
+
+    def test_upcoming_scan_uses_the_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            RenewalNotifier().run()
+        scan = next(query["sql"] for query in queries.captured_queries if "next_renewal_date\" >=" in query["sql"])
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + scan)
+            plan = " ".join(row[3] for row in cursor.fetchall())
+        self.assertIn("subscription_renewal_idx", plan)
+
+
+class DeduplicationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice")
+        self.start = date(2026, 3, 1)
+        self.end = date(2026, 3, 31)
+
+    def subscribe(self, platform, service, start_date=None, end_date=None, **fields):
+        return Subscription.objects.create(user=self.user, platform_name=platform, service_name=service,
+                                           start_date=start_date or self.start, end_date=end_date or self.end,
+                                           **fields)
+
+    def test_names_are_canonicalized(self):
+        self.assertEqual(normalize_name("NETFLIX Inc.", PLATFORM), "netflix")
+        self.assertEqual(normalize_name("Premium Plan", SERVICE), "premium")
+        CanonicalName.objects.create(kind=PLATFORM, alias="HBO Now", canonical="Max")
+        canonicalizer = Canonicalizer()
+        self.assertEqual(canonicalizer.canonical("hbo-now", PLATFORM), "Max")
+        self.assertEqual(canonicalizer.canonical("Disney Plus", PLATFORM), "Disney+")  # Shipped with the migration
+        self.assertEqual(canonicalizer.canonical(" Acme Streaming ", PLATFORM), "Acme Streaming")
+
+    def test_undated_rows_do_not_bridge_periods(self):
+        periods = [(date(2026, 1, 1), date(2026, 1, 31)), (None, None),
+                   (date(2026, 2, 1), date(2026, 2, 28)), (date(2026, 3, 1), date(2026, 3, 31))]
+        rows = [{"id": n, "platform_name": "Netflix", "service_name": "Premium", "start_date": start, "end_date": end}
+                for n, (start, end) in enumerate(periods, start=1)]
+        clusters = SubscriptionDeduplicator().find_duplicates(rows)
+        self.assertEqual([[row["id"] for row in cluster] for cluster in clusters], [[1, 2]])
+
+    def test_merges_near_duplicates(self):
+        email = EmailMessage.objects.create(user=self.user, subject="Receipt", sender="info@netflix.com",
+                                            received_date=timezone.now(), raw_email_body="...")
+        kept = self.subscribe("netflix", "Premium", price=Decimal("15.49"))
+        copy = self.subscribe("NETFLIX Inc.", "Premium Plan", payment_method="Visa", email_message_id=email,
+                              price=Decimal("15.49"))
+        typo = self.subscribe("Netflx", "Premium", start_date=self.start + timedelta(days=1), already_canceled=True)
+        next_month = self.subscribe("Netflix", "Premium", start_date=date(2026, 4, 1), end_date=date(2026, 4, 30))
+        other = self.subscribe("Spotify", "Family")
+        RenewalNotification.objects.create(user=self.user, subscription=copy, kind=RenewalNotification.RENEWAL,
+                                           event_date=self.end, window_days=7)
+
+        stats = SubscriptionDeduplicator().run()
+        self.assertEqual((stats.scanned, stats.clusters, stats.merged), (5, 1, 2))
+        self.assertEqual(set(Subscription.objects.values_list("pk", flat=True)), {kept.pk, next_month.pk, other.pk})
+
+        kept.refresh_from_db()
+        self.assertEqual((kept.platform_name, kept.service_name), ("Netflix", "Premium"))
+        self.assertEqual((kept.payment_method, kept.email_message_id), ("Visa", email))
+        self.assertTrue(kept.already_canceled)  # From the most recently updated copy
+        self.assertEqual(kept.renewal_notifications.count(), 1)
+        # The counts and totals no longer see the copies
+        self.assertEqual(SpendingRollup.objects.get(month=self.start).total, Decimal("15.49"))
+        self.assertEqual(sorted(get_search_backend().search(Subscription, "netflix")), sorted([kept.pk, next_month.pk]))
+
+        self.assertEqual(SubscriptionDeduplicator().run().merged, 0)
+
+    def test_dry_run_and_command(self):
+        self.subscribe("Netflix", "Premium")
+        self.subscribe("Netflix Inc", "Premium")
+        out = StringIO()
+        call_command("deduplicate_subscriptions", "--dry-run", "--user", "alice", stdout=out)
+        self.assertIn("Would merge 1 duplicates", out.getvalue())
+        self.assertEqual(Subscription.objects.count(), 2)
+        call_command("deduplicate_subscriptions", stdout=StringIO())
+        self.assertEqual(Subscription.objects.count(), 1)
+
+    def test_comparisons_grow_linearly(self):
+        rows = [
+            {"id": n, "platform_name": f"Platform {n % 400}", "service_name": "Premium",
+             "start_date": self.start + timedelta(days=30 * (n // 400)), "end_date": None}
+            for n in range(4000)
+        ]
+        deduplicator = SubscriptionDeduplicator(window=5)
+        with mock.patch.object(deduplicator, "_matches", wraps=deduplicator._matches) as matches:
+            self.assertEqual(deduplicator.find_duplicates(rows), [])
+        self.assertLessEqual(matches.call_count, 2 * 4 * len(rows))
+
+    def test_extraction_merges_on_ingest(self):
+        received = timezone.now()
+        self.subscribe("NETFLIX Inc.", "Premium Plan", start_date=received.date(),
+                       end_date=received.date() + timedelta(days=30))
+        EmailMessage.objects.create(user=self.user, subject="Your Netflix receipt", sender="info@netflix.com",
+                                    received_date=received, raw_email_body="Premium plan renewed: $15.49")
+        ExtractionWorker(StubLLMClient(latency=0)).run()
+        netflix = Subscription.objects.get()
+        self.assertEqual((netflix.platform_name, str(netflix.price)), ("Netflix", "15.49"))
+
+
+class AdminChangelistTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser(username="admin", password="x"))
+        self.users = [self.add_user(f"user{i}") for i in range(3)]
+
+    def add_user(self, username):
+        user = User.objects.create_user(username=username)
+        now = timezone.now()
+        for i in range(5):
+            email = EmailMessage.objects.create(user=user, subject=f"Receipt {i}", sender="billing@netflix.com",
+                                                received_date=now - timedelta(days=i), raw_email_body="...",
+                                                parsed_data={"platform_name": "Netflix"})
+            Subscription.objects.create(user=user, platform_name="Netflix" if i else "Spotify", service_name=f"Plan {i}",
+                                        email_message_id=email, unsubscribe_link="netflix.com/cancel")
+        return user
+
+    def changelist(self, model, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f"admin:subscriptions_{model}_changelist"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context["cl"], [query["sql"] for query in queries]
+
+    def test_query_count_does_not_grow_with_the_table(self):
+        # A table of 1M rows: the count comes from the database's bookkeeping, never from a scan
+        self.enterContext(mock.patch("subscriptions.admin.estimated_row_count", return_value=1_000_000))
+        for model, deferred in (("subscription", "unsubscribe_link"), ("emailmessage", "parsed_data")):
+            _, small = self.changelist(model)
+            for i in range(3, 8):
+                self.add_user(f"{model}{i}")
+            cl, large = self.changelist(model)
+            # Session, admin user, then the page itself with its users joined
+            self.assertEqual((len(small), len(large)), (3, 3))
+            self.assertEqual((cl.result_count, cl.paginator.num_pages), (1_000_000, 10_000))
+            self.assertEqual(len(cl.result_list), cl.model.objects.count())
+            self.assertFalse([sql for sql in large if "COUNT(" in sql])
+            self.assertFalse([sql for sql in large if f'."{deferred}"' in sql])
+
+    def test_estimated_count(self):
+        paginator = EstimatedCountPaginator(Subscription.objects.order_by("-end_date", "-id"), 100)
+        # Small tables are counted exactly
+        self.assertEqual(paginator.count, 15)
+        with mock.patch("subscriptions.admin.EXACT_COUNT_LIMIT", 10):
+            # Not analyzed yet: no estimate, the count stops at the limit
+            self.assertIsNone(estimated_row_count(Subscription, "default"))
+            self.assertEqual(EstimatedCountPaginator(Subscription.objects.all(), 100).count, 10)
+            self.assertEqual(EstimatedCountPaginator(Subscription.objects.filter(platform_name="Netflix"), 100).count, 10)
+
+            # The estimate is the analyzed row count, deleted rows (and their rowids) excluded
+            Subscription.objects.filter(pk__in=list(Subscription.objects.values_list("pk", flat=True)[:3])).delete()
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+            self.assertEqual(EstimatedCountPaginator(Subscription.objects.all(), 100).count, 12)
+
+    def test_search_and_user_autocomplete(self):
+        cl, _ = self.changelist("subscription", q="spotify")
+        self.assertEqual(cl.result_count, 3)
+        cl, _ = self.changelist("subscription", q="user1")
+        self.assertEqual({sub.user for sub in cl.result_list}, {self.users[1]})
+        cl, _ = self.changelist("emailmessage", q="receipt")
+        self.assertEqual(cl.result_count, 15)
+
+        response = self.client.get(reverse("admin:autocomplete"), {
+            "app_label": "subscriptions", "model_name": "subscription", "field_name": "user", "term": "user",
+        })
+        self.assertEqual([result["text"] for result in response.json()["results"]], ["user0", "user1", "user2"])
+
+
+class ExportCommandTests(TestCase):
+
+    def test_export_to_file_and_stdout(self):
+        user = User.objects.create_user(username="alice")
+        Subscription.objects.create(user=user, platform_name="Netflix", service_name="Premium", price=Decimal("9.99"))
+        Subscription.objects.create(user=User.objects.create_user(username="bob"), platform_name="Hulu",
+                                    service_name="Basic")
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "subscriptions.ndjson.gz"
+            call_command("export_data", "subscriptions", "--user", "alice", "--format", "ndjson", "--gzip",
+                         "--output", str(path), stderr=StringIO())
+            with gzip.open(path, "rt") as lines:
+                rows = [json.loads(line) for line in lines]
+        self.assertEqual([(row["platform_name"], row["price"]) for row in rows], [("Netflix", "9.99")])
+
+        out = StringIO()
+        call_command("export_data", "subscriptions", stdout=out)
+        self.assertEqual(out.getvalue().splitlines()[0].split(",")[:2], ["id", "user_id"])
+        self.assertEqual(len(out.getvalue().splitlines()), 3)
+
+
+@override_settings(DATABASE_SHARDS=["shard_1", "shard_2"])
+class ShardingTests(TestCase):
+    databases = {"default", "shard_1", "shard_2"}
+
+    def setUp(self):
+        shard_directory.clear()
+        self.addCleanup(shard_directory.clear)
+        self.user = User.objects.create_user(username="alice")
+        self.shard = self.user.profile.shard
+        self.other = next(alias for alias in shard_aliases() if alias != self.shard)
+        self.email = EmailMessage.objects.create(user=self.user, subject="Your Netflix receipt", sender="info@netflix.com",
+                                                 received_date=timezone.now(), raw_email_body="Thanks for renewing.")
+        self.netflix = Subscription.objects.create(user=self.user, platform_name="Netflix", service_name="Premium",
+                                                   price=Decimal("15.49"), email_message_id=self.email)
+
+    def test_placement_is_stable(self):
+        profile_ids = [uuid.uuid4() for _ in range(200)]
+        placements = [placement(profile_id) for profile_id in profile_ids]
+        self.assertEqual(placements, [placement(profile_id) for profile_id in profile_ids])
+        self.assertEqual(set(placements), {"shard_1", "shard_2"})
+        # A new shard only claims users, it never moves them between the existing ones
+        with override_settings(DATABASE_SHARDS=["shard_1", "shard_2", "shard_3"]):
+            moved = [(old, placement(profile_id)) for old, profile_id in zip(placements, profile_ids)
+                     if placement(profile_id) != old]
+        self.assertTrue(moved)
+        self.assertEqual({new for _, new in moved}, {"shard_3"})
+
+    def test_rows_live_on_the_shard_of_their_user(self):
+        self.assertIn(self.shard, ("shard_1", "shard_2"))
+        self.assertEqual(Subscription.objects.using(self.shard).filter(user=self.user).count(), 1)
+        self.assertEqual(EmailMessage.objects.using(self.shard).filter(body__isnull=False).count(), 1)
+        for alias in ("default", self.other):
+            self.assertFalse(Subscription.objects.using(alias).exists())
+            self.assertFalse(EmailMessage.objects.using(alias).exists())
+        self.assertEqual(list(self.user.subscriptions.all()), [self.netflix])
+        self.assertEqual(self.netflix.email_message_id.user, self.user)
+        self.assertEqual(get_search_backend().search(Subscription, "netflix", user=self.user), [self.netflix.pk])
+
+    def test_user_api_only_queries_the_user_shard(self):
+        contexts = {alias: CaptureQueriesContext(connections[alias]) for alias in self.databases}
+        with contexts["default"], contexts["shard_1"], contexts["shard_2"]:
+            response = self.client.get(reverse("api-active-subscriptions-url"), {"user_id": str(self.user.profile.id)})
+            data = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(data["num_active_subscriptions"], 1)
+        self.assertEqual(len(contexts[self.other]), 0)
+        self.assertTrue(contexts[self.shard])
+        self.assertFalse([query for query in contexts["default"] if "subscriptions_" in query["sql"]])
+
+    def test_listings_span_every_shard(self):
+        bob = User.objects.create_user(username="bob")
+        UserProfile.objects.filter(user=bob).update(shard=self.other)
+        shard_directory.clear()
+        today = timezone.localdate()
+        for days in (1, 3, 5):
+            Subscription.objects.create(user=bob, platform_name="Hulu", service_name="Basic",
+                                        start_date=today - timedelta(days=days))
+        self.assertEqual(Subscription.objects.using(self.other).count(), 3)
+
+        paginator = KeysetPaginator(Subscription.objects.all(), ("-end_date", "-start_date", "-id"), per_page=2)
+        first = paginator.page()
+        second = paginator.page(after=first.next_cursor)
+        self.assertEqual([sub.start_date for sub in [*first, *second]],
+                         [today - timedelta(days=days) for days in (1, 3, 5)] + [None])
+        self.assertIsNone(second.next_cursor)
+        self.assertEqual([sub.pk for sub in paginator.page(before=second.previous_cursor)], [sub.pk for sub in first])
+
+    def test_rebalance_moves_a_user(self):
+        call_command("rebalance_shards", usernames=["alice"], to=self.other, grace=0, stdout=StringIO())
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.shard, self.other)
+        self.assertEqual(shard_of(self.user.pk), self.other)
+        self.assertFalse(Subscription.objects.using(self.shard).exists())
+        self.assertFalse(EmailMessage.objects.using(self.shard).exists())
+
+        moved = Subscription.objects.using(self.other).get(pk=self.netflix.pk)
+        self.assertEqual(moved.updated_at, self.netflix.updated_at)
+        self.assertEqual(moved.email_message_id.body.content, "Thanks for renewing.")
+        self.assertTrue(SpendingRollup.objects.using(self.other).filter(user=self.user).exists())
+        self.assertEqual(get_search_backend().search(Subscription, "netflix", user=self.user), [self.netflix.pk])
+
+        out = StringIO()
+        call_command("rebalance_shards", usernames=["alice"], to=self.other, dry_run=True, stdout=out)
+        self.assertIn("Would move 0 users", out.getvalue())
+
+    def test_rebalance_carries_writes_that_keep_updated_at(self):
+        lock = ShardRebalancer._lock
+
+        def write_then_lock(user_id, alias):
+            # After the catch-up passes: `update()` leaves `updated_at` as it was
+            Subscription.objects.using(alias).filter(user_id=user_id).update(notes="written during the move")
+            lock(user_id, alias)
+
+        with mock.patch.object(ShardRebalancer, "_lock", staticmethod(write_then_lock)):
+            call_command("rebalance_shards", usernames=["alice"], to=self.other, grace=0, stdout=StringIO())
+        self.assertEqual(Subscription.objects.using(self.other).get(pk=self.netflix.pk).notes, "written during the move")
+
+    def test_rebalance_keeps_the_source_when_rows_are_missing(self):
+        with mock.patch.object(ShardRebalancer, "_copy", return_value=0), self.assertRaises(CommandError):
+            call_command("rebalance_shards", usernames=["alice"], to=self.other, grace=0, stdout=StringIO())
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.shard, self.shard)
+        self.assertTrue(Subscription.objects.using(self.shard).filter(pk=self.netflix.pk).exists())